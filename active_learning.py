@@ -0,0 +1,167 @@
+# active_learning.py
+# rank unlabeled tweets so the most uncertain ones are labeled first
+
+# the pool is scored in batches with the classifier's probability estimates
+# and kept in a heap ordered by uncertainty
+# as labels come in, the classifier is periodically retrained on the
+# corpus it was originally trained on plus the new labels;
+# heap entries scored by an older classifier are rescored lazily,
+# in batches, only when they reach the top of the heap
+
+import heapq
+
+
+def batch_prob_classify(classifier, featuresets):
+    """
+    return probability distributions for a batch of featuresets
+    uses the classifier's own batch method when it has one
+    """
+    if hasattr(classifier, "prob_classify_many"):
+        return classifier.prob_classify_many(featuresets)
+    elif hasattr(classifier, "batch_prob_classify"):
+        return classifier.batch_prob_classify(featuresets)
+    else:
+        return [classifier.prob_classify(features) for features in featuresets]
+
+
+def uncertainty(prob_dist):
+    """
+    1.0 when the classifier can't decide between political/apolitical,
+    0.0 when it is certain
+    """
+    return 1.0 - abs(2.0 * prob_dist.prob(True) - 1.0)
+
+
+class UncertaintyQueue(object):
+    """
+    UncertaintyQueue class
+    priority queue of unlabeled tweets, most uncertain first
+    """
+
+    def __init__(self, tweets, featureset, classifier, labeled=None,
+        training=None, batch_size=256, retrain_every=20):
+        self.featureset = featureset
+        self.classifier = classifier
+        self.batch_size = batch_size
+        self.retrain_every = retrain_every
+
+        #labeled tweets the classifier was trained on; featurized once,
+        #on the first retrain
+        self.training = list(training or [])
+        self.training_features = None
+
+        #tweets already labeled, used to retrain the classifier
+        self.labeled = list(labeled or [])
+        self.labeled_ids = set(tweet["id"] for tweet in self.labeled)
+        self.new_labels = 0
+
+        self.pool = dict(
+            (tweet["id"], tweet) for tweet in tweets
+            if not tweet["id"] in self.labeled_ids
+        )
+
+        #heap entries are (-uncertainty, tweet id, generation);
+        #the generation identifies the classifier that scored the entry
+        self.generation = 0
+        self.heap = []
+        ids = list(self.pool)
+        for i in xrange(0, len(ids), self.batch_size):
+            self.heap.extend(self._score(ids[i:i + self.batch_size]))
+        heapq.heapify(self.heap)
+
+
+    def __len__(self):
+        return len(self.pool)
+
+
+    def _score(self, ids):
+        """
+        score a batch of pool tweets with the current classifier
+        """
+        tweets = [self.pool[tweet_id] for tweet_id in ids]
+        featuresets = self.featureset.build_featureset(tweets)
+        prob_dists = batch_prob_classify(self.classifier, featuresets)
+
+        return [
+            (-uncertainty(prob_dist), tweet_id, self.generation)
+            for tweet_id, prob_dist in zip(ids, prob_dists)
+        ]
+
+
+    def _refresh_top(self):
+        """
+        rescore stale entries until the top of the heap is up to date
+        """
+        while self.heap:
+            score, tweet_id, generation = self.heap[0]
+            if not tweet_id in self.pool:
+                #labeled since it was scored
+                heapq.heappop(self.heap)
+            elif generation == self.generation:
+                return
+            else:
+                #pop a batch of stale entries and score them together
+                stale = []
+                while self.heap and len(stale) < self.batch_size:
+                    score, tweet_id, generation = self.heap[0]
+                    if generation == self.generation:
+                        break
+                    heapq.heappop(self.heap)
+                    if tweet_id in self.pool:
+                        stale.append(tweet_id)
+                for entry in self._score(stale):
+                    heapq.heappush(self.heap, entry)
+
+
+    def pop(self):
+        """
+        return the most uncertain unlabeled tweet, or None if the pool is empty
+        """
+        self._refresh_top()
+        if not self.heap:
+            return None
+
+        score, tweet_id, generation = heapq.heappop(self.heap)
+        return self.pool[tweet_id]
+
+
+    def label(self, tweet, political):
+        """
+        record a label; retrains the classifier every retrain_every labels
+        """
+        self.pool.pop(tweet["id"], None)
+        if not tweet["id"] in self.labeled_ids:
+            self.labeled_ids.add(tweet["id"])
+            self.labeled.append(dict(tweet, political=political))
+        self.new_labels += 1
+
+        if self.new_labels >= self.retrain_every:
+            self.retrain()
+
+
+    def retrain(self):
+        """
+        train a new classifier on the training tweets and the labeled ones;
+        a label replaces the training label of the same tweet
+        every entry in the heap becomes stale and is rescored on demand
+        """
+        self.new_labels = 0
+        if self.training_features is None:
+            self.training_features = zip(
+                [tweet["id"] for tweet in self.training],
+                self.featureset.build_tagged_featureset(self.training)
+            )
+
+        tagged_features = [
+            tagged for tweet_id, tagged in self.training_features
+            if not tweet_id in self.labeled_ids
+        ]
+        tagged_features.extend(self.featureset.build_tagged_featureset(self.labeled))
+        #naive bayes needs examples of both classes
+        if len(set(political for features, political in tagged_features)) < 2:
+            return
+
+        from nltk import NaiveBayesClassifier
+
+        self.classifier = NaiveBayesClassifier.train(tagged_features)
+        self.generation += 1
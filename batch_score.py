@@ -0,0 +1,251 @@
+# batch_score.py
+# classify a large JSON lines dump of tweets offline
+
+# the input is read a chunk of lines at a time; chunks are featurized and
+# classified by a pool of processes that each load the model once,
+# and written to the output in input order as soon as they are done
+# only a bounded number of chunks are in flight at a time, so memory use
+# doesn't grow with the size of the input
+# after every chunk is written, the input and output byte offsets are
+# saved to OUT.offset, so an interrupted run can continue with --resume
+
+# every output line is the input tweet with "political", "probability"
+# and "model_version" set (see timeline_poller.classify_tweets)
+
+# usage:
+# python batch_score.py INPUT OUTPUT [--processes N] [--chunk-size N]
+#     [--classifier FILE --featureset FILE | --registry DIR]
+#     [--offset BYTES | --resume]
+
+from __future__ import division
+import os
+import sys
+import json
+import time
+import signal
+import pickle
+import argparse
+from collections import deque
+from multiprocessing import Pool
+
+from model_registry import Model, ModelRegistry, model_version, write_atomic, \
+    CURRENT
+from timeline_poller import classify_tweets
+import preprocess_cache
+
+
+#number of lines classified by a worker at a time
+CHUNK_SIZE = 500
+
+#chunks queued or being classified per process
+IN_FLIGHT_PER_PROCESS = 2
+
+#seconds between progress reports
+REPORT_INTERVAL = 10.0
+
+#AsyncResult.get without a timeout can't be interrupted with ctrl-c
+RESULT_TIMEOUT = 365 * 24 * 60 * 60
+
+#the model of a worker process, loaded by load_worker_model
+worker_model = None
+
+
+def load_model(classifier_path=None, featureset_path=None, registry_path=None):
+    """
+    load the registry's current version, or the given files
+    """
+    if registry_path is not None:
+        model = ModelRegistry(registry_path).get(CURRENT)
+        if model is None:
+            raise ValueError("%s has no current model" % registry_path)
+        return model
+
+    with open(classifier_path, "rb") as f:
+        classifier = pickle.load(f)
+    with open(featureset_path, "rb") as f:
+        featureset = pickle.load(f)
+
+    return Model(classifier, featureset,
+        model_version(classifier_path, featureset_path))
+
+
+def load_worker_model(*args):
+    global worker_model
+    #let the parent handle ctrl-c and stop the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_model = load_model(*args)
+
+
+def score_lines(lines):
+    """
+    classify a chunk of JSON lines in a worker process
+    returns (output lines, number of lines that weren't valid tweets)
+    """
+    tweets = []
+    invalid = 0
+    for line in lines:
+        try:
+            tweet = json.loads(line)
+        except ValueError:
+            invalid += 1
+            continue
+        if not isinstance(tweet, dict) or not "text" in tweet:
+            invalid += 1
+            continue
+        tweets.append(tweet)
+
+    if not tweets:
+        return [], invalid
+
+    classified = classify_tweets(tweets, worker_model)
+
+    return [json.dumps(scored) + "\n" for scored in classified], invalid
+
+
+def iter_chunks(f, chunk_size=CHUNK_SIZE):
+    """
+    yield (lines, byte offset after the last line) chunks of a file object
+    readline is used rather than iterating over the file, so that
+    f.tell() gives the exact offset
+    """
+    lines = []
+    while True:
+        line = f.readline()
+        if not line:
+            break
+        if line.strip():
+            lines.append(line)
+        if len(lines) >= chunk_size:
+            yield lines, f.tell()
+            lines = []
+
+    if lines:
+        yield lines, f.tell()
+
+
+def offset_path(output_path):
+    return output_path + ".offset"
+
+
+def load_checkpoint(output_path):
+    """
+    return (input offset, output offset) saved by an earlier run, or (0, 0)
+    """
+    try:
+        with open(offset_path(output_path), "r") as f:
+            checkpoint = json.load(f)
+    except IOError:
+        return 0, 0
+
+    return checkpoint["input_offset"], checkpoint["output_offset"]
+
+
+def save_checkpoint(output_path, input_offset, output_offset):
+    write_atomic(offset_path(output_path), json.dumps({
+        "input_offset": input_offset,
+        "output_offset": output_offset
+    }))
+
+
+def score_file(input_path, output_path, model_args, processes=4,
+    chunk_size=CHUNK_SIZE, input_offset=0, output_offset=None,
+    report=sys.stderr):
+    """
+    classify the tweets of input_path from input_offset on and write them
+    to output_path, truncated to output_offset (or created when it's None)
+    returns the stats of the run
+    """
+    stats = {"tweets": 0, "invalid": 0, "seconds": 0.0}
+    pool = Pool(processes, load_worker_model, model_args)
+    pending = deque()
+    max_in_flight = processes * IN_FLIGHT_PER_PROCESS
+    start = last_report = time.time()
+
+    with open(input_path, "r") as input_file, \
+        open(output_path, "r+b" if output_offset is not None else "wb") as output_file:
+        input_file.seek(input_offset)
+        if output_offset is not None:
+            #drop whatever was written after the last checkpoint
+            output_file.truncate(output_offset)
+            output_file.seek(output_offset)
+
+        def write_oldest():
+            result, end_offset = pending.popleft()
+            lines, invalid = result.get(RESULT_TIMEOUT)
+            output_file.writelines(lines)
+            output_file.flush()
+            stats["tweets"] += len(lines)
+            stats["invalid"] += invalid
+            save_checkpoint(output_path, end_offset, output_file.tell())
+
+        try:
+            for lines, end_offset in iter_chunks(input_file, chunk_size):
+                pending.append(
+                    (pool.apply_async(score_lines, (lines,)), end_offset))
+                #wait for the oldest chunk, so output stays in input order
+                #and memory use stays bounded
+                while len(pending) >= max_in_flight or (
+                    pending and pending[0][0].ready()):
+                    write_oldest()
+
+                if report is not None and time.time() - last_report >= REPORT_INTERVAL:
+                    last_report = time.time()
+                    report.write("{0} tweets, {1:.0f} tweets/s, at byte {2}\n".format(
+                        stats["tweets"], stats["tweets"] / (last_report - start),
+                        end_offset))
+            while pending:
+                write_oldest()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    stats["seconds"] = time.time() - start
+
+    return stats
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="classify a JSON lines dump")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--classifier", default="classifier.txt")
+    parser.add_argument("--featureset", default="featureset.txt")
+    parser.add_argument("--registry", default=None,
+        help="use the current version of a model registry")
+    parser.add_argument("--preprocess-cache", default=None,
+        help="SQLite cache of tokenized tweets (see preprocess_cache.py)")
+    parser.add_argument("--offset", type=int, default=None,
+        help="start at this byte offset of the input, appending to the output")
+    parser.add_argument("--resume", action="store_true",
+        help="continue from the offsets saved by an interrupted run")
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    #enabled before the pool forks, so every worker inherits it
+    preprocess_cache.enable(args.preprocess_cache)
+
+    output_offset = None
+    if args.resume and os.path.exists(args.output):
+        input_offset, output_offset = load_checkpoint(args.output)
+    elif args.resume:
+        #nothing to resume; start over
+        input_offset = 0
+    elif args.offset is not None:
+        input_offset = args.offset
+        if os.path.exists(args.output):
+            output_offset = os.path.getsize(args.output)
+    else:
+        input_offset = 0
+
+    stats = score_file(args.input, args.output,
+        (args.classifier, args.featureset, args.registry),
+        args.processes, args.chunk_size, input_offset, output_offset)
+
+    print "{0} tweets ({1} invalid lines) in {2:.1f}s: {3:.0f} tweets/s".format(
+        stats["tweets"], stats["invalid"], stats["seconds"],
+        stats["tweets"] / stats["seconds"] if stats["seconds"] else 0)
@@ -0,0 +1,496 @@
+# benchmarks.py
+# micro-benchmarks for the featurization pipeline
+
+# usage:
+# python benchmarks.py tf [--documents N] [--length L] [--vocab V]
+# python benchmarks.py index [--requests N]
+# python benchmarks.py api [--requests N]
+# python benchmarks.py cache [--repeat N]
+# python benchmarks.py ngrams [--source FILE] [--repeat N]
+# python benchmarks.py threads [--source FILE] [--threads N] [--repeat N]
+#     [--batch-size N] [--pos-filter] [--preprocess-cache FILE]
+# python benchmarks.py profiler [--source FILE] [--repeat N] [--rounds N]
+#     [--interval SECONDS]
+# python benchmarks.py prefork [--source FILE] [--workers N] [--repeat N]
+
+from __future__ import division
+import sys
+import time
+import random
+import argparse
+
+
+def timed(func, *args):
+    """
+    return (result, seconds) of calling func
+    """
+    start = time.time()
+    result = func(*args)
+
+    return result, time.time() - start
+
+
+def bench_tf(args):
+    """
+    per-document tf-idf time of the one-count tf engine
+    against scoring every term with tf(), on long documents
+    """
+    from tf_idf import tf, idf_corpus, tf_idf_corpus
+
+    generator = random.Random(0)
+    vocab = ["term%d" % i for i in xrange(args.vocab)]
+    corpus = [
+        [generator.choice(vocab) for i in xrange(args.length)]
+        for j in xrange(args.documents)
+    ]
+    idf_set = idf_corpus(corpus)
+
+    def per_term(corpus, algorithm):
+        return [
+            dict((term, tf(term, document, algorithm) * idf_set[term])
+                for term in set(document))
+            for document in corpus
+        ]
+
+    for algorithm in ("RAW", "BOOL", "LOG", "AUG"):
+        expected, per_term_time = timed(per_term, corpus, algorithm)
+        result, engine_time = timed(tf_idf_corpus, corpus, algorithm, idf_set)
+        print "{0:4}: per term {1:.3f} ms/doc, engine {2:.3f} ms/doc " \
+            "({3:.1f}x), identical: {4}".format(
+                algorithm,
+                1000 * per_term_time / len(corpus),
+                1000 * engine_time / len(corpus),
+                per_term_time / engine_time,
+                result == expected)
+
+
+def cached_tweet_app():
+    """
+    the webapp with an in-process cache holding a classified tweet
+    """
+    import steveklabnik_politics as webapp
+    from memory_cache import MemoryCache
+
+    webapp.cache = MemoryCache()
+    tweet = {
+        "id": 350270551610228736,
+        "text": "Obama trying to make bad budget deal",
+        "created_at": "Wed Jun 26 17:40:32 +0000 2013",
+        "retweet": False,
+        "political": True,
+        "probability": 0.93,
+        "model_version": "benchmark",
+        "html": "<blockquote class=\"twitter-tweet\"><p>"
+            + "Obama trying to make bad budget deal " * 10 + "</p></blockquote>"
+    }
+    webapp.cache.set("tweet_entry:" + webapp.TWITTER_USER,
+        {"tweet": tweet, "expires": time.time() + 24 * 60 * 60})
+
+    return webapp, tweet
+
+
+def requests_per_second(app, path, headers, requests):
+    """
+    requests/sec and status of calling a WSGI app directly, so that only
+    the worker's own work (not the test client's request building) is measured
+    """
+    from werkzeug.test import EnvironBuilder
+
+    environ = EnvironBuilder(path=path, headers=headers).get_environ()
+    status = []
+    def start_response(status_line, response_headers):
+        status[:] = [int(status_line.split()[0])]
+
+    start = time.time()
+    for i in xrange(requests):
+        #consume the whole response, as a server would
+        "".join(app(dict(environ), start_response))
+    return requests / (time.time() - start), status[0]
+
+
+def bench_index(args):
+    """
+    requests/sec of the index route with a cached tweet:
+    rendering every request, serving the cached page, and answering 304
+    """
+    webapp, tweet = cached_tweet_app()
+    etag = webapp.page_etag(tweet)
+
+    def run(headers):
+        return requests_per_second(webapp.app, "/", headers, args.requests)
+
+    webapp.app.config["PAGE_CACHE"] = False
+    rendered, status = run({})
+    print "render every request: {0:.0f} req/s ({1})".format(rendered, status)
+
+    webapp.app.config["PAGE_CACHE"] = True
+    cached, status = run({})
+    print "cached page:          {0:.0f} req/s ({1}, {2:.1f}x)".format(
+        cached, status, cached / rendered)
+
+    conditional, status = run({"If-None-Match": "\"%s\"" % etag})
+    print "If-None-Match:        {0:.0f} req/s ({1}, {2:.1f}x)".format(
+        conditional, status, conditional / rendered)
+
+
+def bench_api(args):
+    """
+    requests/sec of /api/latest with a cached tweet, per content encoding,
+    against the index page
+    """
+    webapp, tweet = cached_tweet_app()
+
+    index, status = requests_per_second(webapp.app, "/", {}, args.requests)
+    print "index page:    {0:.0f} req/s ({1})".format(index, status)
+
+    for encoding in ("identity", "gzip", "deflate"):
+        rate, status = requests_per_second(webapp.app, "/api/latest",
+            {"Accept-Encoding": encoding}, args.requests)
+        size = len(webapp.get_api_payload(webapp.TWITTER_USER)[encoding])
+        print "api {0:9} {1:.0f} req/s ({2}, {3:.1f}x, {4} bytes)".format(
+            encoding + ":", rate, status, rate / index, size)
+
+
+def bench_cache(args):
+    """
+    size and encode/decode time of the webapp's cache entries in every
+    codec format, against pickling them the way pylibmc does
+    """
+    import cPickle as pickle
+    import cache_codec
+
+    webapp, tweet = cached_tweet_app()
+    tweet["html"] = unicode(tweet["html"])
+    entries = {
+        "tweet": tweet,
+        "page": webapp.app.test_client().get("/").data.decode("utf-8"),
+        "api": webapp.get_api_payload(webapp.TWITTER_USER),
+        "since_id": tweet["id"]
+    }
+
+    for kind, value in sorted(entries.iteritems()):
+        pickled, pickle_time = timed(lambda: [
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            for i in xrange(args.repeat)][0])
+        unpickled, unpickle_time = timed(lambda: [
+            pickle.loads(pickled) for i in xrange(args.repeat)][0])
+        print "{0:8} pylibmc pickle: {1:5d} bytes, encode {2:6.1f} us, " \
+            "decode {3:6.1f} us".format(kind, len(pickled),
+                1e6 * pickle_time / args.repeat, 1e6 * unpickle_time / args.repeat)
+
+        for name in ("pickle", "json", "marshal"):
+            format = cache_codec.FORMATS[name]
+            entry, encode_time = timed(lambda: [
+                cache_codec.encode(value, format) for i in xrange(args.repeat)][0])
+            decoded, decode_time = timed(lambda: [
+                cache_codec.decode(entry) for i in xrange(args.repeat)][0])
+            print "{0:8} {1:14} {2:5d} bytes, encode {3:6.1f} us, " \
+                "decode {4:6.1f} us{5}{6}".format("", name + ":", len(entry),
+                    1e6 * encode_time / args.repeat, 1e6 * decode_time / args.repeat,
+                    " (compressed)" if ord(entry[1]) & cache_codec.COMPRESSED else "",
+                    "" if decoded == value else " (MISMATCH)")
+
+
+#n-gram featurization should stay within this factor of tokens only
+NGRAM_SLOWDOWN_BUDGET = 1.5
+
+
+def bench_ngrams(args):
+    """
+    tweets/sec of build_featureset with n-gram features, against tokens only,
+    and the number of features each configuration keeps
+    """
+    from tweet_io import iter_tweets
+    from tweet_featureset import TweetFeatureset
+
+    tweets = list(iter_tweets(args.source))
+    configurations = [
+        ("tokens", {}),
+        ("bigrams", {"ngrams": 2}),
+        ("trigrams", {"ngrams": 3}),
+        ("bigrams, hashed", {"ngrams": 2, "hash_buckets": 4096}),
+    ]
+
+    baseline = None
+    for name, options in configurations:
+        featureset = TweetFeatureset(tweets, **options)
+        start = time.time()
+        for i in xrange(args.repeat):
+            featureset.build_featureset(tweets)
+        rate = args.repeat * len(tweets) / (time.time() - start)
+
+        if baseline is None:
+            baseline = rate
+        slowdown = baseline / rate
+        print "{0:16} {1:6.0f} tweets/s ({2:.2f}x slower{3}), {4} features".format(
+            name + ":", rate, slowdown,
+            "" if slowdown <= NGRAM_SLOWDOWN_BUDGET else ", OVER BUDGET",
+            len(featureset.idf_set))
+
+
+#texts that have no tokens left after preprocessing, mixed into the batches
+#of the threads benchmark to check that rows stay aligned with tweets
+EMPTY_TEXTS = ["@steveklabnik http://t.co/abc", "RT @steveklabnik: ...", "a b c"]
+
+
+def bench_threads(args):
+    """
+    featurize shuffled batches of the same tweets from many threads
+    sharing one featureset, and check that every row matches the row
+    of a single-threaded run and that no tweet was modified
+    """
+    import copy
+    import threading
+    from tweet_io import iter_tweets
+    from tweet_featureset import TweetFeatureset
+    import preprocess_cache
+
+    preprocess_cache.enable(args.preprocess_cache)
+    tweets = list(iter_tweets(args.source))
+    tweets.extend({"id": -i, "text": text, "political": False}
+        for i, text in enumerate(EMPTY_TEXTS, 1))
+    featureset = TweetFeatureset(tweets, pos_filter=args.pos_filter)
+    expected = dict(zip((tweet["id"] for tweet in tweets),
+        featureset.build_featureset(tweets)))
+    original = copy.deepcopy(tweets)
+
+    stats = {"tweets": 0, "mismatches": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def featurize(seed):
+        generator = random.Random(seed)
+        for i in xrange(args.repeat):
+            batch = generator.sample(tweets, min(args.batch_size, len(tweets)))
+            try:
+                rows = featureset.build_featureset(batch)
+                mismatches = len(batch) - len(rows) + sum(
+                    1 for tweet, row in zip(batch, rows)
+                    if row != expected[tweet["id"]])
+            except Exception:
+                with lock:
+                    stats["errors"] += 1
+                continue
+            with lock:
+                stats["tweets"] += len(batch)
+                stats["mismatches"] += mismatches
+
+    threads = [threading.Thread(target=featurize, args=(seed,))
+        for seed in xrange(args.threads)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - start
+
+    print "{0} threads: {1} tweets in {2:.1f}s ({3:.0f} tweets/s), " \
+        "{4} mismatched rows, {5} errors, tweets modified: {6}".format(
+            args.threads, stats["tweets"], seconds, stats["tweets"] / seconds,
+            stats["mismatches"], stats["errors"], tweets != original)
+
+
+def bench_profiler(args):
+    """
+    tweets/sec of build_featureset while the sampling profiler runs
+    in the background, against without it; rounds with and without the
+    profiler alternate, and the best round of each is compared
+    """
+    import threading
+    from tweet_io import iter_tweets
+    from tweet_featureset import TweetFeatureset
+    from sampling_profiler import SamplingProfiler
+
+    tweets = list(iter_tweets(args.source))
+    featureset = TweetFeatureset(tweets)
+
+    def rate():
+        start = time.time()
+        for i in xrange(args.repeat):
+            featureset.build_featureset(tweets)
+        return args.repeat * len(tweets) / (time.time() - start)
+
+    baseline = profiled = 0.0
+    samples = sample_seconds = elapsed = 0
+    for i in xrange(args.rounds):
+        baseline = max(baseline, rate())
+
+        profiler = SamplingProfiler(args.interval)
+        thread = threading.Thread(target=profiler.run)
+        thread.start()
+        try:
+            profiled = max(profiled, rate())
+        finally:
+            profiler.stop()
+            thread.join()
+        samples += profiler.samples
+        sample_seconds += profiler.sample_seconds
+        elapsed += profiler.elapsed
+
+    print "without profiler: {0:.0f} tweets/s, with profiler: {1:.0f} tweets/s " \
+        "({2:.1%} slower); {3} samples, {4:.1%} of the time spent sampling".format(
+            baseline, profiled, 1 - profiled / baseline, samples,
+            sample_seconds / elapsed)
+
+
+def prefork_workers(tweets, freeze, workers, repeat):
+    """
+    load the model, prepare it with freeze, then fork workers that
+    classify tweets repeat times and make a full garbage collection
+    returns the memory usage of the master and of every worker, measured
+    while all of them are alive
+    """
+    import os
+    import gc
+    import pickle
+    from prefork import memory_usage
+    from active_learning import batch_prob_classify
+
+    with open("classifier.txt", "rb") as f:
+        classifier = pickle.load(f)
+    with open("featureset.txt", "rb") as f:
+        featureset = pickle.load(f)
+    classifier, featureset = freeze(classifier, featureset)
+
+    pids = []
+    done_read, done_write = os.pipe()
+    exit_read, exit_write = os.pipe()
+    for i in xrange(workers):
+        pid = os.fork()
+        if pid == 0:
+            os.close(done_read)
+            os.close(exit_write)
+            for j in xrange(repeat):
+                batch_prob_classify(classifier, featureset.build_featureset(tweets))
+            gc.collect()
+            os.write(done_write, "x")
+            #stay alive until the master has measured every worker
+            os.read(exit_read, 1)
+            os._exit(0)
+        pids.append(pid)
+    os.close(done_write)
+    os.close(exit_read)
+
+    for pid in pids:
+        os.read(done_read, 1)
+    usage = [memory_usage(pid) for pid in pids]
+    master = memory_usage()
+    os.close(exit_write)
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+    return master, usage
+
+
+def bench_prefork(args):
+    """
+    memory of forked workers classifying tweets with a model loaded before
+    the fork: as loaded, with the idf scores frozen, and with the idf scores
+    and the classifier frozen (see prefork.py)
+    every configuration runs in its own process, so they don't share pages
+    """
+    import os
+    import json
+    from tweet_io import iter_tweets
+    from prefork import freeze_model, freeze_idf_set, FALLBACK_GC_THRESHOLDS
+
+    def freeze_idf(classifier, featureset):
+        import gc
+        featureset.idf_set = freeze_idf_set(featureset.idf_set)
+        gc.collect()
+        gc.set_threshold(*FALLBACK_GC_THRESHOLDS)
+        return classifier, featureset
+
+    configurations = [
+        ("as loaded", lambda classifier, featureset: (classifier, featureset)),
+        ("idf frozen", freeze_idf),
+        ("model frozen", freeze_model),
+    ]
+
+    tweets = list(iter_tweets(args.source))
+    for name, freeze in configurations:
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            result = prefork_workers(tweets, freeze, args.workers, args.repeat)
+            os.write(write_end, json.dumps(result))
+            os._exit(0)
+        os.close(write_end)
+        data = ""
+        while True:
+            chunk = os.read(read_end, 65536)
+            if not chunk:
+                break
+            data += chunk
+        os.close(read_end)
+        os.waitpid(pid, 0)
+
+        master, usage = json.loads(data)
+        average = lambda key: sum(worker[key] for worker in usage) / len(usage)
+        print "{0:13} master rss {1:6d} KB; per worker: rss {2:6.0f} KB, " \
+            "pss {3:6.0f} KB, private {4:6.0f} KB".format(
+                name + ":", master["rss"], average("rss"), average("pss"),
+                average("rss") - average("shared"))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="run a benchmark")
+    commands = parser.add_subparsers(dest="command")
+
+    tf_parser = commands.add_parser("tf", help="tf-idf engine")
+    tf_parser.add_argument("--documents", type=int, default=200)
+    tf_parser.add_argument("--length", type=int, default=1000)
+    tf_parser.add_argument("--vocab", type=int, default=2000)
+    tf_parser.set_defaults(func=bench_tf)
+
+    index_parser = commands.add_parser("index", help="index route")
+    index_parser.add_argument("--requests", type=int, default=2000)
+    index_parser.set_defaults(func=bench_index)
+
+    api_parser = commands.add_parser("api", help="JSON API route")
+    api_parser.add_argument("--requests", type=int, default=2000)
+    api_parser.set_defaults(func=bench_api)
+
+    cache_parser = commands.add_parser("cache", help="cache entry codecs")
+    cache_parser.add_argument("--repeat", type=int, default=2000)
+    cache_parser.set_defaults(func=bench_cache)
+
+    ngrams_parser = commands.add_parser("ngrams", help="n-gram features")
+    ngrams_parser.add_argument("--source", default="steveklabnik_tweets.txt")
+    ngrams_parser.add_argument("--repeat", type=int, default=3)
+    ngrams_parser.set_defaults(func=bench_ngrams)
+
+    threads_parser = commands.add_parser("threads",
+        help="featurizing from many threads")
+    threads_parser.add_argument("--source", default="steveklabnik_tweets.txt")
+    threads_parser.add_argument("--threads", type=int, default=8)
+    threads_parser.add_argument("--repeat", type=int, default=20,
+        help="batches per thread")
+    threads_parser.add_argument("--batch-size", type=int, default=100)
+    threads_parser.add_argument("--pos-filter", action="store_true")
+    threads_parser.add_argument("--preprocess-cache", default=None,
+        help="SQLite cache of tokenized tweets (see preprocess_cache.py)")
+    threads_parser.set_defaults(func=bench_threads)
+
+    profiler_parser = commands.add_parser("profiler",
+        help="overhead of the sampling profiler")
+    profiler_parser.add_argument("--source", default="steveklabnik_tweets.txt")
+    profiler_parser.add_argument("--repeat", type=int, default=2)
+    profiler_parser.add_argument("--rounds", type=int, default=5)
+    profiler_parser.add_argument("--interval", type=float, default=0.005,
+        help="seconds between samples")
+    profiler_parser.set_defaults(func=bench_profiler)
+
+    prefork_parser = commands.add_parser("prefork",
+        help="memory of workers sharing a preloaded model")
+    prefork_parser.add_argument("--source", default="steveklabnik_tweets.txt")
+    prefork_parser.add_argument("--workers", type=int, default=3)
+    prefork_parser.add_argument("--repeat", type=int, default=1)
+    prefork_parser.set_defaults(func=bench_prefork)
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    args.func(args)
@@ -0,0 +1,208 @@
+# cache_codec.py
+# compact, versioned serialization of cache entries
+
+# pylibmc pickles every value that isn't a string, and the entries of the
+# webapp (tweet dictionaries with their oEmbed HTML, rendered pages, API
+# payloads) pickle to much more than their content; a CodecCache wraps
+# the cache client and stores every value as a string instead:
+#   byte 0: CODEC_VERSION
+#   byte 1: format (pickle, json or marshal) | COMPRESSED flag
+#   rest:   the encoded value, zlib compressed if it was large enough
+#           for compression to pay off
+# entries written with another CODEC_VERSION, in an unknown format, or
+# by the plain client are treated as misses, so workers running different
+# versions of the code can share a cache while a deploy rolls out;
+# truncated or corrupt entries are treated as misses too
+# bump CODEC_VERSION when the layout of cached values changes
+
+# CodecCache.report() gives the entries' sizes and encode/decode times,
+# per kind of entry (the part of the key before the first ":")
+
+from __future__ import division
+import json
+import time
+import zlib
+import marshal
+import threading
+import cPickle as pickle
+
+
+CODEC_VERSION = 1
+
+#format byte values
+PICKLE = 0
+JSON = 1
+MARSHAL = 2
+COMPRESSED = 0x80
+
+FORMATS = {"pickle": PICKLE, "json": JSON, "marshal": MARSHAL}
+
+#values that encode to more bytes than this are compressed
+COMPRESS_THRESHOLD = 1024
+COMPRESS_LEVEL = 6
+
+
+def encode_value(value, format):
+    """
+    encode a value in a format; returns (format used, bytes)
+    values json can't represent (e.g. byte strings that aren't text)
+    fall back to pickle
+    """
+    if format == MARSHAL:
+        try:
+            return MARSHAL, marshal.dumps(value, 2)
+        except ValueError:
+            pass
+    elif format == JSON:
+        try:
+            return JSON, json.dumps(value, separators=(",", ":"))
+        except (TypeError, UnicodeDecodeError):
+            pass
+
+    return PICKLE, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def decode_value(data, format):
+    if format == MARSHAL:
+        return marshal.loads(data)
+    elif format == JSON:
+        return json.loads(data)
+
+    return pickle.loads(data)
+
+
+def encode_entry(value, format=MARSHAL, threshold=COMPRESS_THRESHOLD):
+    """
+    serialize a value into a versioned cache entry
+    returns (entry, size of the value before compression)
+    """
+    format, data = encode_value(value, format)
+    size = len(data)
+    if size > threshold:
+        compressed = zlib.compress(data, COMPRESS_LEVEL)
+        #already compressed data (e.g. gzip'd API payloads) doesn't shrink
+        if len(compressed) < len(data):
+            format |= COMPRESSED
+            data = compressed
+
+    return chr(CODEC_VERSION) + chr(format) + data, size
+
+
+def encode(value, format=MARSHAL, threshold=COMPRESS_THRESHOLD):
+    return encode_entry(value, format, threshold)[0]
+
+
+def decode(entry):
+    """
+    deserialize a cache entry; returns None for entries this version
+    of the codec didn't write, and for truncated or corrupt ones
+    """
+    if not isinstance(entry, str) or len(entry) < 2 \
+        or ord(entry[0]) != CODEC_VERSION:
+        return None
+
+    format = ord(entry[1])
+    data = entry[2:]
+    try:
+        if format & COMPRESSED:
+            data = zlib.decompress(data)
+            format &= ~COMPRESSED
+        if not format in (PICKLE, JSON, MARSHAL):
+            return None
+
+        return decode_value(data, format)
+    except (zlib.error, ValueError, EOFError, TypeError,
+        pickle.UnpicklingError):
+        return None
+
+
+class CodecCache(object):
+    """
+    CodecCache class
+    cache client wrapper that stores values as encoded strings
+    """
+
+    def __init__(self, client, format="marshal",
+        threshold=COMPRESS_THRESHOLD, clock=time.time):
+        self.client = client
+        self.clock = clock
+        self.format = FORMATS[format]
+        self.threshold = threshold
+
+        self.lock = threading.Lock()
+        #kind of entry -> counters
+        self.stats = {}
+
+
+    def count(self, key, **counts):
+        kind = key.split(":", 1)[0]
+        with self.lock:
+            stats = self.stats.get(kind)
+            if stats is None:
+                stats = self.stats[kind] = dict.fromkeys(
+                    ["sets", "raw_bytes", "bytes", "compressed", "encode_seconds",
+                     "gets", "hits", "decode_seconds"], 0)
+            for name, value in counts.iteritems():
+                stats[name] += value
+
+
+    def get(self, key):
+        entry = self.client.get(key)
+        if entry is None:
+            self.count(key, gets=1)
+            return None
+
+        start = self.clock()
+        value = decode(entry)
+        self.count(key, gets=1, hits=int(value is not None),
+            decode_seconds=self.clock() - start)
+
+        return value
+
+
+    def set(self, key, value, time=0):
+        #like memcached, a time of 0 means the entry never expires
+        start = self.clock()
+        entry, size = encode_entry(value, self.format, self.threshold)
+        self.count(key, sets=1, raw_bytes=size, bytes=len(entry),
+            compressed=int(ord(entry[1]) & COMPRESSED != 0),
+            encode_seconds=self.clock() - start)
+
+        return self.client.set(key, entry, time=time)
+
+
+    def delete(self, key):
+        return self.client.delete(key)
+
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+
+    def flush_all(self):
+        return self.client.flush_all()
+
+
+    def report(self):
+        """
+        per kind of entry: average bytes before and after compression,
+        and average encode and decode times in microseconds
+        """
+        with self.lock:
+            report = {}
+            for kind, stats in self.stats.iteritems():
+                sets = stats["sets"] or 1
+                hits = stats["hits"] or 1
+                report[kind] = {
+                    "sets": stats["sets"],
+                    "gets": stats["gets"],
+                    "hits": stats["hits"],
+                    "compressed": stats["compressed"],
+                    "raw_bytes_per_entry": stats["raw_bytes"] / sets,
+                    "bytes_per_entry": stats["bytes"] / sets,
+                    "encode_us": 1e6 * stats["encode_seconds"] / sets,
+                    "decode_us": 1e6 * stats["decode_seconds"] / hits
+                }
+
+        return report
+
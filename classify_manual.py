@@ -1,38 +1,158 @@
 # classify_politics.py
 # manually classify tweets as political or not
 
+# labels are appended to a label log next to the tweet file
+# (see label_store.py) instead of rewriting the tweet file,
+# so sessions can be interrupted and resumed at any time
+# tweets already labeled in the tweet file are not asked again; the
+# default label log of a tweet file is also read by train_classifier.py
+# (see corpus_store.py), so new labels are trained on without --export
+
 
 import sys
 import json
+import pickle
+import argparse
+from itertools import islice
+
+from tweet_io import iter_tweets
+from label_store import LabelStore, default_log_path, iter_labeled_tweets
+
+
+#the labeled tweet files classifier.txt was trained on
+TRAINING_FILES = ["steveklabnik_tweets.txt", "steveklabnik_tweets2.txt",
+    "rms_tweets.txt"]
+
+
+def ask_label(tweet):
+    """
+    ask the user to classify a tweet
+    returns True/False, or None if the user wants to quit
+    """
+    print "ID: {0} \n {1}".format(tweet["id"], tweet["text"].encode("ascii", "replace"))
+
+    while True:
+        input = raw_input("Is this a political tweet (y/n, q to quit)?")
+        if input == "y":
+            return True
+        elif input == "n":
+            return False
+        elif input == "q":
+            return None
+
+
+def label_tweets(tweets, store):
+    """
+    ask the user to label every tweet that isn't labeled yet
+    """
+    for tweet in tweets:
+        #skip tweets labeled in the tweet file or in an earlier session
+        if "political" in tweet or tweet["id"] in store:
+            continue
+
+        political = ask_label(tweet)
+        if political is None:
+            break
+        store.add(tweet, political)
+
+
+def training_tweets(paths):
+    """
+    the labeled tweets of the files the classifier was trained on,
+    with their label logs applied
+    """
+    return [
+        tweet for path in paths for tweet in iter_labeled_tweets(path)
+        if "political" in tweet
+    ]
+
+
+def label_uncertain_tweets(tweets, store, classifier_file, featureset_file,
+    training_files, retrain_every):
+    """
+    ask the user to label the tweets the classifier is least sure about first
+    the classifier is retrained on the training files plus the new labels
+    """
+    from active_learning import UncertaintyQueue
+
+    with open(classifier_file, "rb") as f:
+        classifier = pickle.load(f)
+    with open(featureset_file, "rb") as f:
+        featureset = pickle.load(f)
+
+    #labels in the tweet file count as labels too
+    tweets = list(store.apply(tweets))
+    labeled = dict((tweet["id"], tweet) for tweet in store.labeled_tweets())
+    labeled.update((tweet["id"], tweet) for tweet in tweets if "political" in tweet)
+
+    queue = UncertaintyQueue(tweets, featureset, classifier,
+        labeled=labeled.values(), training=training_tweets(training_files),
+        retrain_every=retrain_every)
+
+    while True:
+        tweet = queue.pop()
+        if tweet is None:
+            break
+
+        political = ask_label(tweet)
+        if political is None:
+            break
+        store.add(tweet, political)
+        queue.label(tweet, political)
+
+
+def export_tweets(tweets, store, path):
+    """
+    write the tweets with their labels applied as a JSON array
+    """
+    with open(path, "w") as f:
+        f.write("[")
+        for i, tweet in enumerate(store.apply(tweets)):
+            if i > 0:
+                f.write(", ")
+            json.dump(tweet, f)
+        f.write("]")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="manually label tweets")
+    parser.add_argument("tweet_file")
+    parser.add_argument("begin", nargs="?", type=int, default=0)
+    parser.add_argument("end", nargs="?", type=int, default=None)
+    parser.add_argument("--labels", help="label log (default: TWEET_FILE.labels)")
+    parser.add_argument("--compact", action="store_true",
+        help="rewrite the label log with one line per tweet and exit")
+    parser.add_argument("--export", metavar="PATH",
+        help="write the tweets with their labels applied to PATH and exit")
+    parser.add_argument("--active", action="store_true",
+        help="present the tweets the classifier is least sure about first")
+    parser.add_argument("--classifier", default="classifier.txt")
+    parser.add_argument("--featureset", default="featureset.txt")
+    parser.add_argument("--training", nargs="+", default=TRAINING_FILES,
+        metavar="FILE", help="labeled tweet files the classifier was trained on "
+        "(see train_classifier.py), retrained on with the new labels (--active)")
+    parser.add_argument("--retrain-every", type=int, default=20,
+        help="retrain the classifier after this many new labels (--active)")
+
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
-    #read tweets from JSON file
-    tweets = []
-    with open(sys.argv[1], "r") as f:
-        tweets = json.load(f)
-
-    #see if user specified a range of tweets to classify
-    begin = 0
-    end = len(tweets)
-    if len(sys.argv) >= 4:
-        begin = int(sys.argv[2])
-        end = int(sys.argv[3])
-
-    #iterate through each tweet and classify it as political/apolitical
-    for tweet in tweets[begin:end]:
-        print "ID: {0} \n {1}".format(tweet["id"], tweet["text"].encode("ascii", "replace"))
-
-        #ask the user to classify the tweet
-        while True:
-            input = raw_input("Is this a political tweet (y/n)?")
-            if input == "y":
-                tweet["political"] = True
-                break
-            elif input == "n":
-                tweet["political"] = False
-                break
-
-    #write back the tweets into the JSON file
-    with open(sys.argv[1], "w") as f:
-        tweets = json.dump(tweets, f)
+    args = parse_args(sys.argv[1:])
+    store = LabelStore(args.labels or default_log_path(args.tweet_file))
+
+    try:
+        if args.compact:
+            store.compact()
+        elif args.export:
+            export_tweets(iter_tweets(args.tweet_file), store, args.export)
+        elif args.active:
+            tweets = islice(iter_tweets(args.tweet_file), args.begin, args.end)
+            label_uncertain_tweets(tweets, store, args.classifier,
+                args.featureset, args.training, args.retrain_every)
+        else:
+            #stream the tweets so labeling starts before the file is read
+            tweets = islice(iter_tweets(args.tweet_file), args.begin, args.end)
+            label_tweets(tweets, store)
+    finally:
+        store.close()
@@ -0,0 +1,350 @@
+# corpus_store.py
+# on-disk store of preprocessed tweet corpora
+
+# a store is a directory holding the token id streams of a corpus
+# in flat binary files that are memory-mapped when the store is opened:
+# -tokens.bin: token ids of all documents, back to back (uint32)
+# -offsets.bin: where each document starts, plus the end (uint64)
+# -ids.bin: tweet id of each document (uint64)
+# -labels.bin: 1 political, 0 apolitical, -1 unlabeled (int8)
+# -vocab.json: token of each token id
+# -meta.json: sizes, source files and preprocessing fingerprint
+# labels come from the source files with their label logs applied
+# (see label_store.py); the store is rebuilt when a source file, its label
+# log or the preprocessing changes
+
+import os
+import sys
+import json
+import mmap
+import shutil
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from label_store import default_log_path, iter_labeled_tweets
+from tweet_preprocess import preprocess_fingerprint
+from vocabulary import Vocabulary
+
+
+STORE_FORMAT = 1
+
+#numpy dtype matching array("L") on this platform
+LONG_DTYPE = "uint%d" % (8 * array("L").itemsize)
+
+#file name -> array typecode, numpy dtype
+STORE_FILES = {
+    "tokens.bin": ("I", "uint32"),
+    "offsets.bin": ("L", LONG_DTYPE),
+    "ids.bin": ("L", LONG_DTYPE),
+    "labels.bin": ("b", "int8"),
+}
+
+UNLABELED = -1
+
+#number of tweets tokenized at a time while building a store
+BUILD_CHUNK_SIZE = 5000
+
+
+def file_signature(path):
+    stat = os.stat(path)
+
+    return {
+        "path": os.path.abspath(path),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime
+    }
+
+
+def source_signature(sources):
+    """
+    describe the source files and their label logs well enough to notice
+    when they change
+    """
+    signature = []
+    for path in sources:
+        signature.append(file_signature(path))
+        if os.path.exists(default_log_path(path)):
+            signature.append(file_signature(default_log_path(path)))
+
+    return signature
+
+
+def read_meta(path):
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+
+    with open(meta_path, "r") as f:
+        return json.load(f)
+
+
+class CorpusStore(object):
+    """
+    CorpusStore class
+    read-only, memory-mapped view of a store directory
+
+    a CorpusStore can be passed anywhere tf_idf expects a corpus:
+    it has a length and yields one array of token ids per document
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.meta = read_meta(path)
+        if self.meta is None or self.meta["format"] != STORE_FORMAT:
+            raise IOError("%s is not a corpus store" % path)
+        if self.meta["byteorder"] != sys.byteorder \
+            or self.meta["long_dtype"] != LONG_DTYPE:
+            raise IOError("%s was built on an incompatible platform" % path)
+
+        with open(os.path.join(path, "vocab.json"), "r") as f:
+            self.vocab = Vocabulary(json.load(f))
+
+        self.maps = []
+        self.token_ids = self._map("tokens.bin")
+        self.offsets = self._map("offsets.bin")
+        self.ids = self._map("ids.bin")
+        self.labels = self._map("labels.bin")
+
+
+    def _map(self, name):
+        """
+        memory-map one of the store's binary files
+        """
+        typecode, dtype = STORE_FILES[name]
+        file_path = os.path.join(self.path, name)
+
+        if os.path.getsize(file_path) == 0:
+            return numpy.zeros(0, dtype=dtype) if numpy else array(typecode)
+        if numpy is not None:
+            return numpy.memmap(file_path, dtype=dtype, mode="r")
+
+        #without numpy, keep the raw map; items are unpacked on access
+        with open(file_path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.maps.append(data)
+
+        return MappedArray(data, typecode)
+
+
+    @classmethod
+    def build(cls, path, sources, pos_filter=False):
+        """
+        preprocess the tweets of the source files into a new store
+        """
+        from tweet_featureset import TweetFeatureset
+
+        temp_path = path + ".building"
+        if os.path.exists(temp_path):
+            shutil.rmtree(temp_path)
+        os.makedirs(temp_path)
+
+        vocab = Vocabulary()
+        files = dict(
+            (name, open(os.path.join(temp_path, name), "wb"))
+            for name in STORE_FILES
+        )
+        counts = {"documents": 0, "tokens": 0}
+
+        def write_chunk(chunk):
+            corpus = TweetFeatureset.tokenize_corpus(chunk, pos_filter)
+            offsets = array("L")
+            for tweet in corpus:
+                token_ids = vocab.encode(tweet["tokens"])
+                token_ids.tofile(files["tokens.bin"])
+                counts["tokens"] += len(token_ids)
+                offsets.append(counts["tokens"])
+            offsets.tofile(files["offsets.bin"])
+            array("L", [tweet["id"] for tweet in corpus]).tofile(files["ids.bin"])
+            array("b", [
+                UNLABELED if not "political" in tweet else int(tweet["political"])
+                for tweet in corpus
+            ]).tofile(files["labels.bin"])
+            counts["documents"] += len(corpus)
+
+        try:
+            array("L", [0]).tofile(files["offsets.bin"])
+            chunk = []
+            for source in sources:
+                for tweet in iter_labeled_tweets(source):
+                    chunk.append(tweet)
+                    if len(chunk) >= BUILD_CHUNK_SIZE:
+                        write_chunk(chunk)
+                        chunk = []
+            write_chunk(chunk)
+        finally:
+            for f in files.values():
+                f.close()
+
+        with open(os.path.join(temp_path, "vocab.json"), "w") as f:
+            json.dump(vocab.tokens, f)
+
+        #meta.json is written last; a store without it is incomplete
+        with open(os.path.join(temp_path, "meta.json"), "w") as f:
+            json.dump({
+                "format": STORE_FORMAT,
+                "byteorder": sys.byteorder,
+                "long_dtype": LONG_DTYPE,
+                "preprocess": preprocess_fingerprint(pos_filter),
+                "pos_filter": pos_filter,
+                "sources": source_signature(sources),
+                "documents": counts["documents"],
+                "tokens": counts["tokens"]
+            }, f)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(temp_path, path)
+
+        return cls(path)
+
+
+    @classmethod
+    def is_current(cls, path, sources, pos_filter=False):
+        """
+        check if the store at path was built from the current sources
+        with the current preprocessing
+        """
+        meta = read_meta(path)
+
+        return meta is not None \
+            and meta["format"] == STORE_FORMAT \
+            and meta["preprocess"] == preprocess_fingerprint(pos_filter) \
+            and meta["sources"] == source_signature(sources)
+
+
+    @classmethod
+    def open(cls, path, sources, pos_filter=False):
+        """
+        open the store at path, (re)building it first if it is out of date
+        """
+        if cls.is_current(path, sources, pos_filter):
+            return cls(path)
+        else:
+            return cls.build(path, sources, pos_filter)
+
+
+    def __len__(self):
+        return self.meta["documents"]
+
+
+    def __getitem__(self, i):
+        """
+        token ids of document i (a view into the map when numpy is available)
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("document index out of range")
+
+        return self.token_ids[int(self.offsets[i]):int(self.offsets[i + 1])]
+
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+
+    def documents(self):
+        """
+        yield every document as a list of tokens
+        """
+        for token_ids in self:
+            yield self.vocab.decode(token_ids)
+
+
+    def labeled(self):
+        """
+        return a view of the documents that have a label
+        """
+        return CorpusView(self, [
+            i for i in xrange(len(self)) if self.labels[i] != UNLABELED
+        ])
+
+
+    def view(self, indexes):
+        return CorpusView(self, indexes)
+
+
+    def close(self):
+        for data in self.maps:
+            data.close()
+        self.maps = []
+
+
+class CorpusView(object):
+    """
+    CorpusView class
+    a subset of the documents of a CorpusStore, e.g. a cross-validation fold
+    """
+
+    def __init__(self, store, indexes):
+        self.store = store
+        self.vocab = store.vocab
+        self.indexes = indexes
+
+
+    def __len__(self):
+        return len(self.indexes)
+
+
+    def __getitem__(self, i):
+        return self.store[self.indexes[i]]
+
+
+    def __iter__(self):
+        for i in self.indexes:
+            yield self.store[i]
+
+
+    def documents(self):
+        for token_ids in self:
+            yield self.vocab.decode(token_ids)
+
+
+    def political(self):
+        """
+        label of each document (True if political)
+        """
+        return [self.store.labels[i] == 1 for i in self.indexes]
+
+
+    def folds(self, k):
+        """
+        yield (train view, test view) pairs for k-fold cross-validation
+        """
+        for fold in xrange(k):
+            test = [i for n, i in enumerate(self.indexes) if n % k == fold]
+            train = [i for n, i in enumerate(self.indexes) if n % k != fold]
+            yield CorpusView(self.store, train), CorpusView(self.store, test)
+
+
+class MappedArray(object):
+    """
+    MappedArray class
+    minimal read-only array over a memory map, used when numpy is missing
+    """
+
+    def __init__(self, data, typecode):
+        self.data = data
+        self.typecode = typecode
+        self.itemsize = array(typecode).itemsize
+
+
+    def __len__(self):
+        return len(self.data) // self.itemsize
+
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            return array(self.typecode,
+                self.data[start * self.itemsize:stop * self.itemsize])[::step]
+
+        if key < 0:
+            key += len(self)
+        return array(self.typecode,
+            self.data[key * self.itemsize:(key + 1) * self.itemsize])[0]
@@ -0,0 +1,206 @@
+# fake_twitter.py
+# local stand-in for the Twitter API endpoints the webapp uses
+
+# serves user timelines and oEmbed snippets, enforces rate limits per
+# endpoint and credential the way Twitter does (fixed windows, 429 with
+# x-rate-limit-* headers), and can add latency and random errors
+# call counts are served as JSON at /stats
+
+# usage:
+# python fake_twitter.py [--port N] [--limit N] [--window SECONDS]
+#     [--latency SECONDS] [--error-rate FRACTION] [--tweet-interval SECONDS]
+
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from urlparse import parse_qs
+from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+
+from windowed_idf import TWITTER_EPOCH_MS
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def snowflake_id(timestamp, sequence=0):
+    return ((int(timestamp * 1000) - TWITTER_EPOCH_MS) << 22) + sequence
+
+
+class FakeTwitter(object):
+    """
+    FakeTwitter class
+    WSGI app imitating the timeline and oEmbed endpoints
+    """
+
+    def __init__(self, limit=180, window=15 * 60, latency=0.0, error_rate=0.0,
+        tweet_interval=60.0, history=50, seed=0):
+        self.limit = limit
+        self.window = window
+        self.latency = latency
+        self.error_rate = error_rate
+        #every account posts a tweet every tweet_interval seconds
+        self.tweet_interval = tweet_interval
+        self.start = time.time() - history * tweet_interval
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        #(endpoint, credential) -> [window start, calls in window]
+        self.windows = {}
+        self.stats = {"calls": 0, "rejected": 0, "errors": 0, "endpoints": {}}
+
+
+    def timeline(self, account, since_id=None, max_id=None, count=20):
+        """
+        tweets of an account, newest first
+        """
+        now = time.time()
+        statuses = []
+        n = int((now - self.start) / self.tweet_interval)
+        while n >= 0 and len(statuses) < count:
+            timestamp = self.start + n * self.tweet_interval
+            tweet_id = snowflake_id(timestamp, hash(account) % 4096)
+            n -= 1
+            if max_id is not None and tweet_id > max_id:
+                continue
+            if since_id is not None and tweet_id <= since_id:
+                break
+            statuses.append({
+                "id": tweet_id,
+                "id_str": str(tweet_id),
+                "text": "%s tweet number %d about the budget deal" % (account, n + 1),
+                "created_at": time.strftime("%a %b %d %H:%M:%S +0000 %Y",
+                    time.gmtime(timestamp)),
+                "user": {"id": hash(account) % 100000}
+            })
+
+        return statuses
+
+
+    def check_rate_limit(self, endpoint, credential):
+        """
+        count a call; return the rate limit headers and whether it is allowed
+        """
+        now = time.time()
+        with self.lock:
+            window = self.windows.get((endpoint, credential))
+            if window is None or now >= window[0] + self.window:
+                window = self.windows[(endpoint, credential)] = [now, 0]
+            window[1] += 1
+            allowed = window[1] <= self.limit
+
+            self.stats["calls"] += 1
+            counts = self.stats["endpoints"].setdefault(endpoint, [0, 0])
+            counts[0] += 1
+            if not allowed:
+                self.stats["rejected"] += 1
+                counts[1] += 1
+
+        headers = [
+            ("x-rate-limit-limit", str(self.limit)),
+            ("x-rate-limit-remaining", str(max(0, self.limit - window[1]))),
+            ("x-rate-limit-reset", str(int(window[0] + self.window))),
+        ]
+
+        return headers, allowed
+
+
+    def __call__(self, environ, start_response):
+        path = environ["PATH_INFO"]
+        query = dict(
+            (name, values[0])
+            for name, values in parse_qs(environ.get("QUERY_STRING", "")).iteritems()
+        )
+
+        if path == "/stats":
+            with self.lock:
+                body = json.dumps(self.stats)
+            start_response("200 OK", [("Content-Type", "application/json")])
+            return [body]
+
+        match = re.match(r"^/1(\.1)?/(statuses/user_timeline|statuses/oembed)\.json$",
+            path)
+        if match is None:
+            start_response("404 Not Found", [("Content-Type", "application/json")])
+            return [json.dumps({"errors": [{"code": 34, "message": "not found"}]})]
+        endpoint = match.group(2)
+
+        token = re.search(r'oauth_token="([^"]+)"',
+            environ.get("HTTP_AUTHORIZATION", ""))
+        credential = token.group(1) if token else "app"
+
+        headers, allowed = self.check_rate_limit(endpoint, credential)
+        headers.append(("Content-Type", "application/json"))
+        if not allowed:
+            start_response("429 Too Many Requests", headers)
+            return [json.dumps({"errors": [
+                {"code": 88, "message": "Rate limit exceeded"}]})]
+
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and self.random.random() < self.error_rate:
+            with self.lock:
+                self.stats["errors"] += 1
+            start_response("503 Service Unavailable", headers)
+            return [json.dumps({"errors": [
+                {"code": 130, "message": "Over capacity"}]})]
+
+        if endpoint == "statuses/user_timeline":
+            body = self.timeline(
+                query.get("screen_name", "fake"),
+                since_id=int(query["since_id"]) if "since_id" in query else None,
+                max_id=int(query["max_id"]) if "max_id" in query else None,
+                count=int(query.get("count", 20))
+            )
+        else:
+            body = {"html": "<blockquote class=\"twitter-tweet\">"
+                "<p>tweet %s</p></blockquote>" % query.get("id")}
+
+        start_response("200 OK", headers)
+        return [json.dumps(body)]
+
+
+def start_fake_twitter(host="127.0.0.1", port=0, **kwargs):
+    """
+    serve a FakeTwitter on a background thread
+    returns (server, base url); stop it with server.shutdown()
+    """
+    server = make_server(host, port, FakeTwitter(**kwargs),
+        server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server, "http://%s:%d" % (host, server.server_port)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="fake Twitter API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--limit", type=int, default=180)
+    parser.add_argument("--window", type=float, default=15 * 60)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--tweet-interval", type=float, default=60.0)
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    server = make_server(args.host, args.port,
+        FakeTwitter(args.limit, args.window, args.latency, args.error_rate,
+            args.tweet_interval),
+        server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+    server.serve_forever()
@@ -0,0 +1,433 @@
+# fetch_scheduler.py
+# schedule Twitter API calls within Twitter's rate limits
+
+# every (endpoint, credential) pair gets a token bucket sized so that
+# no rate limit window, wherever it starts, can see more calls than the limit
+# calls are queued and run by worker threads as soon as their bucket has a token:
+# -identical calls (same endpoint, credential and key) that are queued or
+#  running at the same time are coalesced into one
+# -when calls have to wait for tokens, calls for hot accounts (the ones
+#  requested most) go first; hotness is counted per hot_key, the account,
+#  rather than per coalescing key, which also holds since_id, max_id or
+#  the tweet id and so changes from call to call
+# -if Twitter answers 429 anyway, the bucket is emptied until the window
+#  resets and the call is retried
+
+# usage (run against a local fake API that enforces limits):
+# python fetch_scheduler.py [--calls N] [--limit N] [--window SECONDS]
+
+from __future__ import division
+import os
+import sys
+import math
+import time
+import heapq
+import itertools
+import threading
+
+
+#Twitter API v1.1 limits: endpoint -> (calls, window in seconds)
+TWITTER_RATE_LIMITS = {
+    "statuses/user_timeline": (180, 15 * 60),
+    "statuses/oembed": (180, 15 * 60),
+}
+
+#fraction of the limit that may be used in a burst
+DEFAULT_BURST = 0.1
+
+#half-life of the request counts that make a key hot
+DEFAULT_HOT_HALF_LIFE = 5 * 60
+
+MAX_RETRIES = 3
+
+
+class RateLimited(Exception):
+    """
+    raised by a scheduled call when the API answered 429
+    """
+
+    def __init__(self, reset=None):
+        super(RateLimited, self).__init__("rate limit exceeded")
+        #unix time the rate limit window resets at, if the API said so
+        self.reset = reset
+
+
+class SchedulerTimeout(Exception):
+    pass
+
+
+def rate_limit_reset(error):
+    """
+    if error is a rate limit error, return the time the window resets at
+    (or 0 if unknown); otherwise return None
+    understands RateLimited, urllib2 HTTPErrors and python-twitter errors
+    """
+    if isinstance(error, RateLimited):
+        return error.reset or 0
+
+    if getattr(error, "code", None) == 429:
+        headers = getattr(error, "headers", None) or {}
+        try:
+            return float(headers.get("x-rate-limit-reset", 0))
+        except (TypeError, ValueError):
+            return 0
+
+    #python-twitter raises TwitterError with Twitter's error message (code 88)
+    message = str(error)
+    if "Rate limit exceeded" in message or "'code': 88" in message:
+        return 0
+
+    return None
+
+
+class TokenBucket(object):
+    """
+    TokenBucket class
+    at most `limit` takes in any `window` seconds
+    """
+
+    def __init__(self, limit, window, burst=DEFAULT_BURST, clock=time.time):
+        self.clock = clock
+        self.capacity = max(1.0, limit * burst)
+        #refill so that burst + refill over one window adds up to the limit
+        self.rate = max(0.0, limit - self.capacity) / window
+        self.window = window
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.blocked_until = 0
+
+
+    def refill(self):
+        now = self.clock()
+        if now > self.updated:
+            self.tokens = min(self.capacity,
+                self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+        return now
+
+
+    def try_take(self):
+        """
+        take a token if there is one
+        """
+        now = self.refill()
+        if now >= self.blocked_until and self.tokens >= 1:
+            self.tokens -= 1
+            return True
+
+        return False
+
+
+    def wait_time(self):
+        """
+        seconds until the next token is available
+        """
+        now = self.refill()
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            if self.rate == 0:
+                return self.window
+            wait = max(wait, (1 - self.tokens) / self.rate)
+
+        return wait
+
+
+    def block(self, reset=None):
+        """
+        stop handing out tokens until reset (default: one window from now)
+        """
+        now = self.refill()
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until,
+            reset if reset and reset > now else now + self.window)
+
+
+class ScheduledCall(object):
+    """
+    ScheduledCall class
+    a queued API call; every caller that coalesced into it waits on result
+    """
+
+    def __init__(self, endpoint, credential, key, func, args, kwargs,
+        hot_key=None):
+        self.endpoint = endpoint
+        self.credential = credential
+        self.key = key
+        self.hot_key = hot_key
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.retries = 0
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+    def result(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise SchedulerTimeout("%s %r timed out" % (self.endpoint, self.key))
+        if self.error is not None:
+            raise self.error
+
+        return self.value
+
+
+class FetchScheduler(object):
+    """
+    FetchScheduler class
+    runs API calls on worker threads within per-endpoint, per-credential limits
+    """
+
+    def __init__(self, limits=TWITTER_RATE_LIMITS, workers=2, share=1.0,
+        burst=DEFAULT_BURST, hot_half_life=DEFAULT_HOT_HALF_LIFE,
+        clock=time.time):
+        #share: fraction of every limit this scheduler may use, e.g.
+        #1 / number of processes when several processes use the same credentials
+        self.limits = dict(
+            (endpoint, (limit * share, window))
+            for endpoint, (limit, window) in limits.iteritems()
+        )
+        self.workers = workers
+        self.burst = burst
+        self.hot_half_life = hot_half_life
+        self.clock = clock
+
+        self.condition = threading.Condition()
+        #(endpoint, credential) -> TokenBucket
+        self.buckets = {}
+        #(endpoint, credential, key) -> ScheduledCall, queued or running
+        self.calls = {}
+        #heap of (-hotness, sequence number, ScheduledCall)
+        self.queue = []
+        self.sequence = itertools.count()
+        #hot key -> (decayed request count, time of last update)
+        self.hotness = {}
+        self.stats = {"submitted": 0, "coalesced": 0, "calls": 0,
+            "rate_limited": 0}
+
+        self.threads = []
+        self.pid = None
+
+
+    def bucket(self, endpoint, credential):
+        bucket = self.buckets.get((endpoint, credential))
+        if bucket is None:
+            limit, window = self.limits[endpoint]
+            bucket = TokenBucket(limit, window, self.burst, self.clock)
+            self.buckets[(endpoint, credential)] = bucket
+
+        return bucket
+
+
+    def heat(self, hot_key):
+        """
+        count a request for hot_key and return its decayed request count
+        """
+        now = self.clock()
+        count, updated = self.hotness.get(hot_key, (0.0, now))
+        count = count * math.pow(0.5, (now - updated) / self.hot_half_life) + 1
+        self.hotness[hot_key] = (count, now)
+
+        return count
+
+
+    def start(self):
+        """
+        start the worker threads (again, after a fork)
+        """
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.threads = []
+        for i in xrange(self.workers):
+            thread = threading.Thread(target=self.run_worker)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+
+    def submit(self, endpoint, credential, key, func, *args, **kwargs):
+        """
+        queue func(*args, **kwargs) as a call to endpoint with credential
+        calls with the same endpoint, credential and key are coalesced;
+        a hot_key keyword (e.g. the account) is what hotness is counted
+        for, and defaults to key
+        returns a ScheduledCall
+        """
+        hot_key = kwargs.pop("hot_key", key)
+        with self.condition:
+            self.start()
+            self.stats["submitted"] += 1
+            hotness = self.heat(hot_key)
+
+            call = self.calls.get((endpoint, credential, key))
+            if call is not None:
+                self.stats["coalesced"] += 1
+                return call
+
+            call = ScheduledCall(endpoint, credential, key, func, args, kwargs,
+                hot_key)
+            self.calls[(endpoint, credential, key)] = call
+            heapq.heappush(self.queue, (-hotness, next(self.sequence), call))
+            self.condition.notify()
+
+            return call
+
+
+    def call(self, endpoint, credential, key, func, *args, **kwargs):
+        """
+        submit a call and wait for its result, at most timeout seconds
+        (a keyword; raises SchedulerTimeout)
+        """
+        timeout = kwargs.pop("timeout", None)
+
+        return self.submit(endpoint, credential, key, func, *args, **kwargs) \
+            .result(timeout)
+
+
+    def next_call(self):
+        """
+        pop the hottest queued call whose bucket has a token, or None
+        must be called with the condition held
+        """
+        skipped = []
+        call = None
+        while self.queue:
+            entry = heapq.heappop(self.queue)
+            if self.bucket(entry[2].endpoint, entry[2].credential).try_take():
+                call = entry[2]
+                break
+            skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self.queue, entry)
+
+        return call
+
+
+    def next_wait(self):
+        """
+        seconds until a queued call may get a token
+        """
+        if not self.queue:
+            return None
+
+        return min(
+            self.bucket(call.endpoint, call.credential).wait_time()
+            for priority, sequence, call in self.queue
+        )
+
+
+    def run_worker(self):
+        while True:
+            with self.condition:
+                call = self.next_call()
+                while call is None:
+                    wait = self.next_wait()
+                    self.condition.wait(wait if wait is None else max(wait, 0.001))
+                    call = self.next_call()
+
+            self.run_call(call)
+
+
+    def run_call(self, call):
+        try:
+            value = call.func(*call.args, **call.kwargs)
+            error = None
+        except Exception, error:
+            value = None
+
+        with self.condition:
+            self.stats["calls"] += 1
+            reset = rate_limit_reset(error) if error is not None else None
+            if reset is not None:
+                self.stats["rate_limited"] += 1
+                self.bucket(call.endpoint, call.credential).block(reset)
+                if call.retries < MAX_RETRIES:
+                    #put the call back in the queue; it keeps its callers
+                    call.retries += 1
+                    hotness = self.hotness.get(call.hot_key, (0.0, 0))[0]
+                    heapq.heappush(self.queue,
+                        (-hotness, next(self.sequence), call))
+                    self.condition.notify()
+                    return
+
+            del self.calls[(call.endpoint, call.credential, call.key)]
+            call.value = value
+            call.error = error
+            call.done.set()
+
+
+class ScheduledApi(object):
+    """
+    ScheduledApi class
+    wraps a python-twitter Api so that timeline requests go through a scheduler
+    with a timeout, a call that has to wait longer (e.g. for a rate limit
+    window to reset) raises SchedulerTimeout instead
+    """
+
+    def __init__(self, api, scheduler, credential, timeout=None):
+        self.api = api
+        self.scheduler = scheduler
+        self.credential = credential
+        self.timeout = timeout
+
+
+    def GetUserTimeline(self, **kwargs):
+        key = tuple(sorted(kwargs.iteritems()))
+
+        return self.scheduler.call("statuses/user_timeline", self.credential,
+            key, self.api.GetUserTimeline, hot_key=kwargs.get("screen_name"),
+            timeout=self.timeout, **kwargs)
+
+
+def simulate(args):
+    """
+    drive the scheduler against a local fake API and report 429s
+    """
+    import json
+    import random
+    import urllib2
+    from fake_twitter import start_fake_twitter
+
+    server, base_url = start_fake_twitter(limit=args.limit, window=args.window)
+    scheduler = FetchScheduler(
+        {"statuses/user_timeline": (args.limit, args.window)}, workers=4)
+
+    def fetch(account):
+        url = "%s/1.1/statuses/user_timeline.json?screen_name=%s" % (
+            base_url, account)
+        return json.load(urllib2.urlopen(url))
+
+    generator = random.Random(0)
+    #a few hot accounts get most of the requests
+    accounts = ["account%d" % int(generator.paretovariate(1.2))
+        for i in xrange(args.calls)]
+
+    start = time.time()
+    calls = [
+        scheduler.submit("statuses/user_timeline", "app", account, fetch, account)
+        for account in accounts
+    ]
+    for call in calls:
+        call.result()
+    elapsed = time.time() - start
+
+    stats = json.load(urllib2.urlopen(base_url + "/stats"))
+    server.shutdown()
+    print "{0} requests -> {1} API calls ({2} coalesced) in {3:.1f}s; " \
+        "{4} answered 429 (fake API counted {5} calls, {6} rejected)".format(
+            scheduler.stats["submitted"], scheduler.stats["calls"],
+            scheduler.stats["coalesced"], elapsed,
+            scheduler.stats["rate_limited"], stats["calls"], stats["rejected"])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="run the scheduler against a local fake API")
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=60)
+    parser.add_argument("--window", type=float, default=10.0)
+    simulate(parser.parse_args(sys.argv[1:]))
@@ -0,0 +1,47 @@
+# gunicorn_config.py
+# gunicorn settings for the webapp
+
+# set STEVEKLABNIK_TWEETS_POLITICS_PRELOAD=True to load the model once in
+# the master process and share it between workers (see prefork.py)
+# memory usage of the master and the workers is logged, so the effect
+# of preloading on per-worker memory can be checked
+
+# sending a worker SIGPROF writes a profile of it to the webapp's
+# PROFILE_DIR (see sampling_profiler.py)
+
+import os
+
+from prefork import memory_usage, format_memory_usage, preload_enabled
+from sampling_profiler import install_signal_handler
+
+
+preload_app = preload_enabled()
+workers = int(os.getenv("WEB_CONCURRENCY", 3))
+
+#log the memory usage of a worker every this many requests
+MEMORY_REPORT_INTERVAL = 1000
+
+request_counts = {}
+
+
+def when_ready(server):
+    server.log.info("master %s: %s", os.getpid(),
+        format_memory_usage(memory_usage()))
+
+
+def post_fork(server, worker):
+    server.log.info("worker %s forked: %s", worker.pid,
+        format_memory_usage(memory_usage()))
+    #gunicorn doesn't reset SIGPROF when the worker starts, so the handler
+    #can be installed here; without preloading, this imports the app
+    #a moment before the worker would
+    from steveklabnik_politics import PROFILE_DIR
+    install_signal_handler(PROFILE_DIR)
+
+
+def post_request(worker, req):
+    count = request_counts.get(worker.pid, 0) + 1
+    request_counts[worker.pid] = count
+    if count % MEMORY_REPORT_INTERVAL == 0:
+        worker.log.info("worker %s after %d requests: %s", worker.pid, count,
+            format_memory_usage(memory_usage()))
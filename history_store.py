@@ -0,0 +1,147 @@
+# history_store.py
+# SQLite store of every classified tweet
+
+# the database runs in WAL mode so that readers (the /history endpoint)
+# never block the writer (the timeline poller) and vice versa
+# pages are fetched with keyset pagination (WHERE id < cursor ORDER BY id),
+# which uses the (account, id) index and stays fast however deep the page
+
+import sqlite3
+import threading
+
+from windowed_idf import tweet_timestamp
+
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS tweets (
+        id INTEGER PRIMARY KEY,
+        account TEXT NOT NULL,
+        created_at INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        retweet INTEGER NOT NULL,
+        political INTEGER NOT NULL,
+        probability REAL,
+        model_version TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS tweets_account_id ON tweets (account, id)",
+    "CREATE INDEX IF NOT EXISTS tweets_account_created_at "
+        "ON tweets (account, created_at)",
+]
+
+COLUMNS = ["id", "account", "created_at", "text", "retweet", "political",
+    "probability", "model_version"]
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+#max number of ids per "IN (...)" query (SQLite limits query parameters)
+LOOKUP_CHUNK_SIZE = 500
+
+
+def row_to_tweet(row):
+    tweet = dict(zip(COLUMNS, row))
+    tweet["retweet"] = bool(tweet["retweet"])
+    tweet["political"] = bool(tweet["political"])
+
+    return tweet
+
+
+class HistoryStore(object):
+    """
+    HistoryStore class
+    classified tweets of every polled account
+    """
+
+    def __init__(self, path):
+        self.path = path
+        #sqlite3 connections can't be shared between threads
+        self.local = threading.local()
+        connection = self.connection()
+        with connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+
+    def connection(self):
+        """
+        return the connection of the current thread, opening it on first use
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+
+        return connection
+
+
+    def add_many(self, account, tweets):
+        """
+        store classified tweets; tweets that are already stored are skipped
+        """
+        connection = self.connection()
+        with connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO tweets (%s) VALUES (%s)" % (
+                    ", ".join(COLUMNS), ", ".join("?" * len(COLUMNS))),
+                [
+                    (tweet["id"], account, tweet_timestamp(tweet), tweet["text"],
+                        bool(tweet.get("retweet")), bool(tweet["political"]),
+                        tweet.get("probability"), tweet.get("model_version"))
+                    for tweet in tweets
+                ]
+            )
+
+
+    def lookup(self, ids):
+        """
+        return the stored tweets among ids, as a dictionary keyed by id
+        """
+        ids = list(ids)
+        tweets = {}
+        for start in xrange(0, len(ids), LOOKUP_CHUNK_SIZE):
+            chunk = ids[start:start + LOOKUP_CHUNK_SIZE]
+            rows = self.connection().execute(
+                "SELECT %s FROM tweets WHERE id IN (%s)" % (
+                    ", ".join(COLUMNS), ", ".join("?" * len(chunk))),
+                chunk
+            )
+            for row in rows:
+                tweets[row[0]] = row_to_tweet(row)
+
+        return tweets
+
+
+    def page(self, account, before_id=None, limit=DEFAULT_PAGE_SIZE):
+        """
+        return (tweets, cursor): up to limit tweets of an account older than
+        before_id, newest first; pass cursor as before_id to get the next page
+        cursor is None on the last page
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        if before_id is None:
+            rows = self.connection().execute(
+                "SELECT %s FROM tweets WHERE account = ? "
+                "ORDER BY id DESC LIMIT ?" % ", ".join(COLUMNS),
+                (account, limit)
+            )
+        else:
+            rows = self.connection().execute(
+                "SELECT %s FROM tweets WHERE account = ? AND id < ? "
+                "ORDER BY id DESC LIMIT ?" % ", ".join(COLUMNS),
+                (account, before_id, limit)
+            )
+        tweets = [row_to_tweet(row) for row in rows]
+        cursor = tweets[-1]["id"] if len(tweets) == limit else None
+
+        return tweets, cursor
+
+
+    def close(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
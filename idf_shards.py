@@ -0,0 +1,216 @@
+# idf_shards.py
+# compute idf scores of a large tweet archive in shards
+
+# map: tokenize one shard of the archive and save its partial document
+#      frequency counts (see tf_idf.DfCounts) to a file; a shard is made
+#      of whole JSON array sources and byte ranges of JSON lines sources
+#      (see plan_shards), so each map task only parses its own share
+# reduce: merge any number of partial count files into an IdfDict
+# the map step can run on any number of processes or machines;
+# "run" does both steps locally with a process pool
+
+# usage:
+# python idf_shards.py map OUT SHARD NUM_SHARDS SOURCE...
+# python idf_shards.py reduce FEATURESET PARTIAL...
+# python idf_shards.py run FEATURESET --processes N SOURCE...
+
+from __future__ import division
+import os
+import sys
+import time
+import pickle
+import argparse
+import tempfile
+import shutil
+from multiprocessing import Pool
+
+from tf_idf import DfCounts, merge_document_frequencies
+from tweet_io import iter_tweets, iter_json_lines_range, is_json_array
+from tweet_featureset import TweetFeatureset
+import preprocess_cache
+
+
+#number of tweets tokenized at a time by a map task
+CHUNK_SIZE = 5000
+
+
+def plan_shards(sources, num_shards):
+    """
+    split the sources into num_shards lists of (path, start, end) pieces
+    of about the same number of bytes
+    JSON array files can only be parsed from the start, so each one is
+    read whole (start and end None) by the shard with the fewest bytes so
+    far; the JSON lines files are then cut into byte ranges that even the
+    shards out
+    """
+    shards = [[] for shard in xrange(num_shards)]
+    sizes = [0] * num_shards
+    arrays = []
+    lines = []
+    for source in sources:
+        with open(source, "r") as f:
+            json_array = is_json_array(f)
+        (arrays if json_array else lines).append(
+            (os.path.getsize(source), source))
+
+    #largest first, so the shards end up about the same size
+    for size, source in sorted(arrays, reverse=True):
+        shard = sizes.index(min(sizes))
+        shards[shard].append((source, None, None))
+        sizes[shard] += size
+
+    #fill the shards up to the level that takes all the JSON lines bytes
+    total = sum(size for size, source in lines)
+    ordered = sorted(sizes)
+    for below in xrange(1, num_shards + 1):
+        level = (total + sum(ordered[:below])) / below
+        if below == num_shards or level <= ordered[below]:
+            break
+
+    #the JSON lines files are cut as if they were one stream of bytes
+    position = 0
+    cumulative = 0.0
+    for shard in xrange(num_shards):
+        cumulative += max(0.0, level - sizes[shard])
+        end = total if shard == num_shards - 1 else int(round(cumulative))
+        offset = 0
+        for size, source in lines:
+            start, stop = max(position, offset), min(end, offset + size)
+            if start < stop:
+                shards[shard].append((source, start - offset, stop - offset))
+            offset += size
+        position = end
+
+    return shards
+
+
+def iter_shard(sources, shard, num_shards):
+    """
+    yield the tweets of one shard of the sources; only the shard's own
+    pieces of the sources are parsed
+    """
+    for source, start, end in plan_shards(sources, num_shards)[shard]:
+        if start is None:
+            for tweet in iter_tweets(source):
+                yield tweet
+        else:
+            with open(source, "rb") as f:
+                for tweet in iter_json_lines_range(f, start, end):
+                    yield tweet
+
+
+def map_shard(sources, shard, num_shards, out_path, pos_filter=False):
+    """
+    count the document frequencies of one shard and save them to out_path
+    """
+    df = DfCounts()
+    chunk = []
+
+    def count_chunk(chunk):
+        for tweet in TweetFeatureset.tokenize_corpus(chunk, pos_filter):
+            df.add(tweet["tokens"])
+
+    for tweet in iter_shard(sources, shard, num_shards):
+        chunk.append(tweet)
+        if len(chunk) >= CHUNK_SIZE:
+            count_chunk(chunk)
+            chunk = []
+    count_chunk(chunk)
+
+    df.save(out_path)
+
+    return out_path
+
+
+def map_task(args):
+    return map_shard(*args)
+
+
+def featureset_from_idf(idf_set, pos_filter=False):
+    """
+    wrap merged idf scores in a TweetFeatureset
+    """
+    featureset = TweetFeatureset.__new__(TweetFeatureset)
+    featureset.pos_filter = pos_filter
+    featureset.idf_set = idf_set
+
+    return featureset
+
+
+def run(sources, processes, pos_filter=False):
+    """
+    compute the idf scores of the sources with a local process pool
+    """
+    work_dir = tempfile.mkdtemp(prefix="idf_shards")
+    try:
+        tasks = [
+            (sources, shard, processes,
+                os.path.join(work_dir, "df-%d.json" % shard), pos_filter)
+            for shard in xrange(processes)
+        ]
+        pool = Pool(processes)
+        try:
+            partials = pool.map(map_task, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+        return merge_document_frequencies(partials)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="compute idf scores in shards")
+    parser.add_argument("--pos-filter", action="store_true")
+    parser.add_argument("--preprocess-cache", default=None,
+        help="SQLite cache of tokenized tweets (see preprocess_cache.py)")
+    commands = parser.add_subparsers(dest="command")
+
+    map_parser = commands.add_parser("map")
+    map_parser.add_argument("out")
+    map_parser.add_argument("shard", type=int)
+    map_parser.add_argument("num_shards", type=int)
+    map_parser.add_argument("sources", nargs="+")
+
+    reduce_parser = commands.add_parser("reduce")
+    reduce_parser.add_argument("featureset")
+    reduce_parser.add_argument("partials", nargs="+")
+
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("featureset")
+    run_parser.add_argument("sources", nargs="+")
+    run_parser.add_argument("--processes", type=int, default=4)
+    run_parser.add_argument("--check", action="store_true",
+        help="compare against idf scores computed in a single process")
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    preprocess_cache.enable(args.preprocess_cache)
+
+    if args.command == "map":
+        map_shard(args.sources, args.shard, args.num_shards, args.out,
+            args.pos_filter)
+        sys.exit(0)
+
+    start = time.time()
+    if args.command == "reduce":
+        idf_set = merge_document_frequencies(args.partials)
+    else:
+        idf_set = run(args.sources, args.processes, args.pos_filter)
+    print "{0} terms, {1} documents in {2:.2f}s".format(
+        len(idf_set), idf_set.corpus_size, time.time() - start)
+
+    if args.command == "run" and args.check:
+        start = time.time()
+        single = run(args.sources, 1, args.pos_filter)
+        print "single process: {0:.2f}s, identical: {1}".format(
+            time.time() - start,
+            dict(single) == dict(idf_set)
+            and single.corpus_size == idf_set.corpus_size)
+
+    with open(args.featureset, "wb") as f:
+        pickle.dump(featureset_from_idf(idf_set, args.pos_filter), f)
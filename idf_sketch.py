@@ -0,0 +1,211 @@
+# idf_sketch.py
+# approximate idf scores in fixed memory
+
+# document frequencies are counted in a count-min sketch instead of a dict,
+# so memory doesn't grow with the vocabulary of an endless tweet stream
+# a count-min sketch of width w (a power of two) and depth d never
+# underestimates a count, and overestimates it by at most
+# (e / w) * (number of counted documents) with probability 1 - e^-d
+# overestimated counts can only make idf scores smaller than the exact ones
+
+# usage (compare against exact idf scores):
+# python idf_sketch.py SOURCE... [--width W] [--depth D]
+
+from __future__ import division
+import sys
+import math
+import time
+import struct
+import hashlib
+import argparse
+from array import array
+
+
+DEFAULT_WIDTH = 1 << 16
+DEFAULT_DEPTH = 4
+
+
+class CountMinSketch(object):
+    """
+    CountMinSketch class
+    approximate counts of hashable terms in width * depth counters
+    """
+
+    #whether indexes steps through the tables by an odd number; a class
+    #attribute so that sketches pickled before it keep their old indexes
+    odd_step = False
+
+    def __init__(self, width=DEFAULT_WIDTH, depth=DEFAULT_DEPTH):
+        if width < 1 or width & (width - 1):
+            raise ValueError("width must be a power of two, not %r" % width)
+        self.width = width
+        self.odd_step = True
+        self.depth = depth
+        self.tables = [array("L", [0]) * width for i in xrange(depth)]
+        self.total = 0
+
+
+    def indexes(self, term):
+        """
+        counter index of the term in each table
+        derived from two halves of one md5 hash (double hashing),
+        so they are the same in every process; the step is odd, so with a
+        power of two width a term's indexes never cycle through only some
+        of the columns
+        """
+        if isinstance(term, unicode):
+            term = term.encode("utf-8")
+        h1, h2 = struct.unpack("<QQ", hashlib.md5(str(term)).digest())
+        if self.odd_step:
+            h2 |= 1
+
+        return [(h1 + i * h2) % self.width for i in xrange(self.depth)]
+
+
+    def add(self, term, count=1):
+        """
+        count a term, using conservative update:
+        only the counters holding the current minimum are raised
+        """
+        indexes = self.indexes(term)
+        estimate = min(
+            table[index] for table, index in zip(self.tables, indexes)
+        ) + count
+        for table, index in zip(self.tables, indexes):
+            if table[index] < estimate:
+                table[index] = estimate
+        self.total += count
+
+
+    def __getitem__(self, term):
+        return min(
+            table[index] for table, index in zip(self.tables, self.indexes(term))
+        )
+
+
+    def update(self, other):
+        """
+        merge another sketch of the same size into this one
+        the merged sketch is still an upper bound of the true counts
+        """
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("cannot merge sketches of different sizes")
+
+        for table, other_table in zip(self.tables, other.tables):
+            for index, count in enumerate(other_table):
+                if count:
+                    table[index] += count
+        self.total += other.total
+
+
+    def error_bound(self):
+        """
+        return (max overestimate of any count, probability it is exceeded)
+        """
+        return math.e / self.width * self.total, math.exp(-self.depth)
+
+
+    def nbytes(self):
+        return sum(len(table) * table.itemsize for table in self.tables)
+
+
+class SketchIdf(object):
+    """
+    SketchIdf class
+    drop-in replacement for tf_idf.IdfDict backed by a CountMinSketch
+    """
+
+    def __init__(self, width=DEFAULT_WIDTH, depth=DEFAULT_DEPTH):
+        self.sketch = CountMinSketch(width, depth)
+        self.corpus_size = 0
+
+
+    def add(self, document):
+        """
+        count the terms of one document
+        """
+        for term in set(document):
+            self.sketch.add(term)
+        self.corpus_size += 1
+
+
+    def add_tweet(self, tweet):
+        self.add(tweet["tokens"])
+
+
+    def update(self, other):
+        self.sketch.update(other.sketch)
+        self.corpus_size += other.corpus_size
+
+
+    def __getitem__(self, term):
+        #same formula as tf_idf.idf(); terms that were never counted
+        #get log(corpus_size), like missing terms of an IdfDict
+        return math.log( self.corpus_size / (self.sketch[term]+1) )
+
+
+    def nbytes(self):
+        return self.sketch.nbytes()
+
+
+def sketch_idf_corpus(corpus, width=DEFAULT_WIDTH, depth=DEFAULT_DEPTH):
+    """
+    calculates approximate idf scores for all terms in a corpus
+    """
+    idf_set = SketchIdf(width, depth)
+    for document in corpus:
+        idf_set.add(document)
+
+    return idf_set
+
+
+def compare_idf(approx, exact):
+    """
+    measure how far approximate idf scores are from exact ones
+    returns a dictionary of error statistics over the exact vocabulary
+    """
+    errors = [abs(approx[term] - score) for term, score in exact.iteritems()]
+    errors.sort()
+
+    return {
+        "terms": len(errors),
+        "exact": sum(1 for error in errors if error < 1e-12) / len(errors),
+        "mean_error": sum(errors) / len(errors),
+        "p99_error": errors[int(0.99 * (len(errors) - 1))],
+        "max_error": errors[-1]
+    }
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="compare sketched idf scores with exact ones")
+    parser.add_argument("sources", nargs="+")
+    parser.add_argument("--width", type=int, action="append")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH)
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    from tf_idf import idf_corpus
+    from tweet_io import iter_tweets
+    from tweet_featureset import TweetFeatureset
+
+    args = parse_args(sys.argv[1:])
+    tweets = [tweet for source in args.sources for tweet in iter_tweets(source)]
+    corpus = [tweet["tokens"] for tweet in TweetFeatureset.tokenize_corpus(tweets)]
+    exact = idf_corpus(corpus)
+    print "exact: {0} terms, {1} documents".format(len(exact), exact.corpus_size)
+
+    for width in args.width or [1 << 10, 1 << 12, 1 << 14, DEFAULT_WIDTH]:
+        start = time.time()
+        approx = sketch_idf_corpus(corpus, width, args.depth)
+        elapsed = time.time() - start
+        stats = compare_idf(approx, exact)
+        overestimate, probability = approx.sketch.error_bound()
+        print "width {0} depth {1} ({2} KB, {3:.2f}s): " \
+            "{4:.1%} exact, mean error {5:.4f}, p99 {6:.4f}, max {7:.4f}; " \
+            "bound: df +{8:.1f} with p {9:.3f}".format(
+                width, args.depth, approx.nbytes() // 1024, elapsed,
+                stats["exact"], stats["mean_error"], stats["p99_error"],
+                stats["max_error"], overestimate, probability)
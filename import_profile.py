@@ -0,0 +1,75 @@
+# import_profile.py
+# report how long importing a module takes, and which imports it spends it on
+
+# usage:
+# python import_profile.py [MODULE] [--top N] [--budget SECONDS]
+# exits with status 1 if the import takes longer than the budget,
+# so it can be used as a check that cold starts stay fast
+# (test_import_time.py runs the same check as a unit test)
+
+import sys
+import time
+import argparse
+import __builtin__
+
+
+def profile_import(module_name):
+    """
+    import a module and return (total seconds, list of import records)
+    every record is (inclusive seconds, exclusive seconds, depth, module name)
+    """
+    original_import = __builtin__.__import__
+    records = []
+    #stack of [name, start time, time spent in nested imports]
+    stack = []
+
+    def timed_import(name, *args, **kwargs):
+        #only the first import of a module does any work
+        if name in sys.modules:
+            return original_import(name, *args, **kwargs)
+
+        stack.append([name, time.time(), 0.0])
+        try:
+            return original_import(name, *args, **kwargs)
+        finally:
+            name, start, nested = stack.pop()
+            elapsed = time.time() - start
+            if stack:
+                stack[-1][2] += elapsed
+            records.append((elapsed, elapsed - nested, len(stack), name))
+
+    __builtin__.__import__ = timed_import
+    start = time.time()
+    try:
+        __import__(module_name)
+    finally:
+        __builtin__.__import__ = original_import
+
+    return time.time() - start, records
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="profile module import time")
+    parser.add_argument("module", nargs="?", default="steveklabnik_politics")
+    parser.add_argument("--top", type=int, default=20,
+        help="number of slowest imports to list")
+    parser.add_argument("--budget", type=float, default=None,
+        help="fail if the import takes longer than this many seconds")
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+
+    total, records = profile_import(args.module)
+    print "import {0}: {1:.3f}s".format(args.module, total)
+    print "{0:>10} {1:>10}  module".format("inclusive", "self")
+    for inclusive, exclusive, depth, name in \
+        sorted(records, reverse=True)[:args.top]:
+        print "{0:>9.1f}ms {1:>9.1f}ms  {2}{3}".format(
+            1000 * inclusive, 1000 * exclusive, "  " * depth, name)
+
+    if args.budget is not None and total > args.budget:
+        print "over budget: {0:.3f}s > {1:.3f}s".format(total, args.budget)
+        sys.exit(1)
@@ -0,0 +1,144 @@
+# label_store.py
+# append-only log of manual political/apolitical labels
+
+# every label is written as one JSON line and flushed to disk immediately,
+# so a crashed labeling session loses at most the tweet being labeled
+# labeling the same tweet again appends a new line; the last line wins
+# the log is only opened for writing once a label is added, so reading
+# the labels of a tweet file (see iter_labeled_tweets) never creates one
+
+import os
+import json
+
+from tweet_io import iter_tweets
+
+
+def default_log_path(tweet_path):
+    """
+    path of the label log that belongs to a tweet file
+    """
+    return tweet_path + ".labels"
+
+
+def iter_labeled_tweets(tweet_path, log_path=None):
+    """
+    lazily yield the tweets of a tweet file with its label log applied
+    """
+    store = LabelStore(log_path or default_log_path(tweet_path))
+
+    return store.apply(iter_tweets(tweet_path))
+
+
+class LabelStore(object):
+    """
+    LabelStore class
+    append-only JSON lines label log with an in-memory id index
+    """
+
+    def __init__(self, path):
+        self.path = path
+        #id -> label record (the last one written for that id)
+        self.index = {}
+        self.appended = 0
+        self.log = None
+        self._load()
+
+
+    def _load(self):
+        """
+        rebuild the id index by replaying the log
+        """
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    #a torn last line from a crashed session; skip it
+                    continue
+                self.index[record["id"]] = record
+                self.appended += 1
+
+
+    def __contains__(self, tweet_id):
+        return tweet_id in self.index
+
+
+    def __len__(self):
+        return len(self.index)
+
+
+    def get(self, tweet_id, default=None):
+        """
+        return the label of a tweet, or default if it isn't labeled
+        """
+        record = self.index.get(tweet_id)
+        return default if record is None else record["political"]
+
+
+    def add(self, tweet, political):
+        """
+        label a tweet and append the label to the log
+        """
+        record = {
+            "id": tweet["id"],
+            "text": tweet["text"],
+            "political": political
+        }
+        if self.log is None:
+            self.log = open(self.path, "a")
+        self.log.write(json.dumps(record) + "\n")
+        self.log.flush()
+        os.fsync(self.log.fileno())
+
+        self.index[record["id"]] = record
+        self.appended += 1
+
+        return record
+
+
+    def labeled_tweets(self):
+        """
+        return all labeled tweets as a tweet corpus
+        """
+        return list(self.index.values())
+
+
+    def apply(self, tweets):
+        """
+        lazily yield tweets with the "political" key set from the log
+        tweets that aren't in the log are passed through unchanged
+        """
+        for tweet in tweets:
+            record = self.index.get(tweet["id"])
+            if record is not None:
+                tweet = dict(tweet, political=record["political"])
+            yield tweet
+
+
+    def compact(self):
+        """
+        rewrite the log so that it holds exactly one line per labeled tweet
+        """
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            for record in self.index.values():
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.close()
+        #rename is atomic, so readers either see the old or the new log
+        os.rename(temp_path, self.path)
+        self.appended = len(self.index)
+
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
@@ -0,0 +1,260 @@
+# loadtest.py
+# load test the webapp under gunicorn against local fakes of its upstreams
+
+# starts:
+# -a fake Twitter API (see fake_twitter.py) with configurable latency,
+#  error rate and rate limits, posting a new tweet every --tweet-interval
+# -an in-memory cache shared by all workers, standing in for memcached
+#  (see memory_cache.serve_shared_cache)
+# -the webapp under gunicorn, pointed at both through its environment
+# then drives concurrent requests at it and reports, per scenario,
+# throughput, p50/p95/p99/max latency, errors and the calls the fake API got
+
+# scenarios run in two phases:
+# -steady: the cache timeout is longer than the test, so after warming up
+#  every request is served from the cache
+# -expiry: the cache timeout is short (--cache-timeout), so the test crosses
+#  many expiries and requests have to wait for polls and oEmbed fetches
+
+# usage:
+# python loadtest.py [--workers N] [--concurrency N] [--duration SECONDS]
+#     [--cache-timeout SECONDS] [--latency SECONDS] [--error-rate FRACTION]
+#     [--tweet-interval SECONDS] [--preload]
+
+from __future__ import division
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import urllib2
+import httplib
+import argparse
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+
+from fake_twitter import start_fake_twitter
+from memory_cache import serve_shared_cache
+
+
+#seconds to wait for gunicorn to answer
+STARTUP_TIMEOUT = 60
+
+#requests made by every client before a phase is measured
+WARMUP_REQUESTS = 5
+
+#path, extra headers
+SCENARIOS = {
+    "index": ("/", {}),
+    "index-304": ("/", {"If-None-Match": None}),
+    "api-gzip": ("/api/latest", {"Accept-Encoding": "gzip"}),
+    "history": ("/history?limit=50", {}),
+}
+STEADY_SCENARIOS = ["index", "index-304", "api-gzip", "history"]
+EXPIRY_SCENARIOS = ["index", "api-gzip"]
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    return port
+
+
+def request(host, port, path, headers, timeout=60):
+    """
+    return (status, headers, body) of a GET request
+    """
+    connection = httplib.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+@contextmanager
+def run_app(args, work_dir, api_url, cache_address, cache_timeout, name):
+    """
+    run the webapp under gunicorn for the duration of the with block
+    yields (host, port)
+    """
+    port = free_port()
+    env = dict(os.environ,
+        WEB_CONCURRENCY=str(args.workers),
+        STEVEKLABNIK_TWEETS_POLITICS_CACHE="shared",
+        STEVEKLABNIK_TWEETS_POLITICS_CACHE_ADDRESS=cache_address,
+        STEVEKLABNIK_TWEETS_POLITICS_CACHE_TIMEOUT=str(cache_timeout),
+        STEVEKLABNIK_TWEETS_POLITICS_TWITTER_API_URL=api_url + "/1.1",
+        STEVEKLABNIK_TWEETS_POLITICS_OEMBED_URL=api_url + "/1/statuses/oembed.json",
+        STEVEKLABNIK_TWEETS_POLITICS_HISTORY_DB=os.path.join(work_dir, name + ".db"),
+        STEVEKLABNIK_TWEETS_POLITICS_PRELOAD=str(args.preload),
+        TWITTER_CONSUMER_KEY="loadtest",
+        TWITTER_CONSUMER_SECRET="loadtest",
+        TWITTER_OAUTH_TOKEN="loadtest",
+        TWITTER_OAUTH_TOKEN_SECRET="loadtest"
+    )
+    log_path = os.path.join(work_dir, name + ".log")
+    log = open(log_path, "w")
+    process = subprocess.Popen([
+        sys.executable, "-c", "from gunicorn.app.wsgiapp import run; run()",
+        "-c", "gunicorn_config.py",
+        "-b", "127.0.0.1:%d" % port,
+        "-w", str(args.workers),
+        "steveklabnik_politics:app"
+    ], env=env, stdout=log, stderr=subprocess.STDOUT,
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    try:
+        deadline = time.time() + STARTUP_TIMEOUT
+        while True:
+            try:
+                request("127.0.0.1", port, "/history?limit=1", {}, timeout=5)
+                break
+            except (socket.error, httplib.HTTPException):
+                if process.poll() is not None or time.time() > deadline:
+                    raise RuntimeError("gunicorn didn't start, see %s" % log_path)
+                time.sleep(0.2)
+
+        yield "127.0.0.1", port
+    finally:
+        if process.poll() is None:
+            process.terminate()
+            process.wait()
+        log.close()
+
+
+def fake_api_calls(api_url):
+    """
+    {endpoint: [calls, rejected]} so far
+    """
+    return json.load(urllib2.urlopen(api_url + "/stats"))["endpoints"]
+
+
+def drive(host, port, path, headers, concurrency, duration):
+    """
+    request path from concurrency clients for duration seconds
+    returns a list of (latency, status) of every request
+    """
+    results = [[] for i in xrange(concurrency)]
+    deadline = time.time() + duration
+
+    def client(results):
+        while time.time() < deadline:
+            start = time.time()
+            try:
+                status = request(host, port, path, headers)[0]
+            except (socket.error, httplib.HTTPException):
+                status = None
+            results.append((time.time() - start, status))
+
+    threads = [
+        threading.Thread(target=client, args=(client_results,))
+        for client_results in results
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return [result for client_results in results for result in client_results]
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def report(name, results, duration, calls_before, calls_after):
+    latencies = sorted(latency for latency, status in results)
+    errors = sum(1 for latency, status in results
+        if status is None or status >= 500)
+    upstream = ", ".join(
+        "{0} {1}{2}".format(endpoint.split("/")[-1],
+            counts[0] - calls_before.get(endpoint, [0, 0])[0],
+            " ({0} rejected)".format(counts[1] - calls_before.get(endpoint, [0, 0])[1])
+                if counts[1] > calls_before.get(endpoint, [0, 0])[1] else "")
+        for endpoint, counts in sorted(calls_after.iteritems())
+    ) or "none"
+
+    print "  {0:10} {1:6d} requests {2:7.1f} req/s  p50 {3:6.1f}  p95 {4:6.1f}  " \
+        "p99 {5:7.1f}  max {6:7.1f} ms  {7} errors  upstream: {8}".format(
+            name, len(results), len(results) / duration,
+            1000 * percentile(latencies, 0.5), 1000 * percentile(latencies, 0.95),
+            1000 * percentile(latencies, 0.99), 1000 * latencies[-1],
+            errors, upstream)
+
+
+def run_phase(args, work_dir, api_url, cache_address, cache_timeout, name,
+    scenarios):
+    print "{0} (cache timeout {1}s, {2} workers, {3} clients, {4}s per scenario):" \
+        .format(name, cache_timeout, args.workers, args.concurrency, args.duration)
+
+    with run_app(args, work_dir, api_url, cache_address, cache_timeout,
+        name) as (host, port):
+        status, headers, body = request(host, port, "/", {})
+        etag = headers.get("etag")
+        #warm up every worker (model loading, first poll)
+        drive(host, port, "/", {}, args.workers, 0)
+        for i in xrange(WARMUP_REQUESTS * args.workers):
+            request(host, port, "/", {})
+
+        for scenario in scenarios:
+            path, headers = SCENARIOS[scenario]
+            headers = dict((header, value if value is not None else etag)
+                for header, value in headers.iteritems())
+            calls_before = fake_api_calls(api_url)
+            results = drive(host, port, path, headers, args.concurrency,
+                args.duration)
+            report(scenario, results, args.duration, calls_before,
+                fake_api_calls(api_url))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="load test the webapp")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0,
+        help="seconds per scenario")
+    parser.add_argument("--cache-timeout", type=int, default=2,
+        help="cache timeout of the expiry phase")
+    parser.add_argument("--latency", type=float, default=0.05,
+        help="latency of the fake API")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+        help="fraction of fake API calls that fail with 503")
+    parser.add_argument("--limit", type=int, default=180,
+        help="fake API calls per endpoint per 15 minutes")
+    parser.add_argument("--tweet-interval", type=float, default=1.0,
+        help="seconds between new tweets on the fake API")
+    parser.add_argument("--preload", action="store_true",
+        help="load the model in the gunicorn master (see prefork.py)")
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+
+    work_dir = tempfile.mkdtemp(prefix="loadtest")
+    api_server, api_url = start_fake_twitter(limit=args.limit, window=15 * 60,
+        latency=args.latency, error_rate=args.error_rate,
+        tweet_interval=args.tweet_interval)
+    cache_manager, cache_address = serve_shared_cache()
+    try:
+        #longer than the whole test, so nothing expires
+        steady_timeout = int(10 * args.duration * len(STEADY_SCENARIOS)) + 60
+        run_phase(args, work_dir, api_url, cache_address, steady_timeout,
+            "steady", STEADY_SCENARIOS)
+        cache_manager.shutdown()
+        cache_manager, cache_address = serve_shared_cache()
+        run_phase(args, work_dir, api_url, cache_address, args.cache_timeout,
+            "expiry", EXPIRY_SCENARIOS)
+    finally:
+        cache_manager.shutdown()
+        api_server.shutdown()
+        shutil.rmtree(work_dir)
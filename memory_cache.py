@@ -0,0 +1,101 @@
+# memory_cache.py
+# in-process stand-in for the memcached client
+
+# implements the part of the pylibmc.Client interface the webapp uses,
+# for development, benchmarks and load tests without a memcached server
+# entries are private to the process, so every gunicorn worker has its own,
+# unless the cache is served to all of them with serve_shared_cache
+# (a multiprocessing manager) and reached with connect_shared_cache
+
+import time
+import threading
+from multiprocessing.managers import BaseManager
+
+
+class MemoryCache(object):
+    """
+    MemoryCache class
+    dictionary with per-entry expiry times
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        #key -> (value, expiry time or None)
+        self.entries = {}
+        self.lock = threading.Lock()
+
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= self.clock():
+                del self.entries[key]
+                return None
+
+            return value
+
+
+    def set(self, key, value, time=0):
+        #like memcached, a time of 0 means the entry never expires
+        with self.lock:
+            self.entries[key] = (value, self.clock() + time if time else None)
+
+        return True
+
+
+    def delete(self, key):
+        with self.lock:
+            return self.entries.pop(key, None) is not None
+
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+
+    def flush_all(self):
+        with self.lock:
+            self.entries.clear()
+
+
+#shared caches are only reachable from the local machine,
+#so the key only guards against connecting to the wrong server
+SHARED_CACHE_AUTHKEY = "memory_cache"
+
+
+class SharedCacheManager(BaseManager):
+    pass
+
+
+def parse_address(address):
+    host, port = address.rsplit(":", 1)
+
+    return host, int(port)
+
+
+def serve_shared_cache(address="127.0.0.1:0"):
+    """
+    serve a MemoryCache from a new process
+    returns the manager (stop it with shutdown()) and the "host:port" address
+    """
+    cache = MemoryCache()
+    SharedCacheManager.register("cache", callable=lambda: cache,
+        exposed=["get", "set", "delete", "__contains__", "flush_all"])
+    manager = SharedCacheManager(parse_address(address), SHARED_CACHE_AUTHKEY)
+    manager.start()
+
+    return manager, "%s:%d" % manager.address
+
+
+def connect_shared_cache(address):
+    """
+    return a proxy of the MemoryCache served at address
+    the proxy can be used from any thread
+    """
+    SharedCacheManager.register("cache")
+    manager = SharedCacheManager(parse_address(address), SHARED_CACHE_AUTHKEY)
+    manager.connect()
+
+    return manager.cache()
@@ -0,0 +1,462 @@
+# model_registry.py
+# versioned models and the pointers that say which one is live
+
+# a registry is a directory with one subdirectory per model version:
+#   <registry>/<version>/classifier.txt, featureset.txt, meta.json
+#   <registry>/current   name of the version that classifies tweets
+#   <registry>/shadow    name of a version scored alongside it (optional)
+# versions are the sha1 of the classifier and featureset files, like the
+# version of the fixed model files, and are never modified once published
+# pointers are replaced with a rename, so a reader sees the old version
+# or the new one, never a partial write; running workers check the
+# pointers every few seconds and load the new version without restarting
+
+# a ShadowScorer classifies the tweets the current model classified with
+# the shadow model on a background thread, and counts how often the two
+# disagree and how long each takes; the request path only queues the work,
+# the shadow model is looked up and loaded on the background thread
+
+# usage:
+# python model_registry.py [--registry DIR] publish CLASSIFIER FEATURESET
+#     [--activate] [--shadow]
+# python model_registry.py [--registry DIR] activate VERSION
+# python model_registry.py [--registry DIR] shadow VERSION|none
+# python model_registry.py [--registry DIR] list
+
+from __future__ import division
+import os
+import sys
+import json
+import time
+import Queue
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import cPickle as pickle
+from collections import namedtuple
+
+
+Model = namedtuple("Model", ["classifier", "featureset", "version"])
+
+CLASSIFIER_NAME = "classifier.txt"
+FEATURESET_NAME = "featureset.txt"
+META_NAME = "meta.json"
+
+CURRENT = "current"
+SHADOW = "shadow"
+
+#seconds between checks of a pointer in a running process
+DEFAULT_CHECK_INTERVAL = 5.0
+
+#batches waiting for the shadow model; more are dropped, not waited for
+SHADOW_QUEUE_SIZE = 100
+
+#number of recent latencies kept for percentiles
+LATENCY_SAMPLES = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), ""):
+            digest.update(block)
+
+    return digest
+
+
+def model_version(classifier_path, featureset_path):
+    """
+    identify a model by a hash of its classifier and featureset files
+    """
+    version = hashlib.sha1()
+    for path in (classifier_path, featureset_path):
+        with open(path, "rb") as f:
+            version.update(f.read())
+
+    return version.hexdigest()[:12]
+
+
+def write_atomic(path, data):
+    """
+    replace the contents of a file with a rename
+    """
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".",
+        prefix=".tmp-")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class ModelRegistry(object):
+    """
+    ModelRegistry class
+    publishes model versions, moves the pointers between them and
+    keeps the versions they point to loaded
+    """
+
+    def __init__(self, path, check_interval=DEFAULT_CHECK_INTERVAL,
+        prepare=None, clock=time.time):
+        self.path = path
+        self.check_interval = check_interval
+        #called with (classifier, featureset) after loading a version,
+        #returns them prepared for use (e.g. prefork.freeze_model)
+        self.prepare = prepare
+        self.clock = clock
+
+        #guards self.loaded; held for lookups only, never while loading
+        self.lock = threading.Lock()
+        #held while a version is loaded
+        self.load_lock = threading.Lock()
+        #pointer -> (Model or None, time the pointer was last read)
+        self.loaded = {}
+        #featureset sha1 -> featureset, so versions trained on the same
+        #featureset share one loaded copy
+        self.featuresets = {}
+
+
+    def version_path(self, version, name=""):
+        return os.path.join(self.path, version, name)
+
+
+    def versions(self):
+        """
+        published versions, oldest first
+        """
+        if not os.path.isdir(self.path):
+            return []
+
+        versions = [
+            name for name in os.listdir(self.path)
+            if os.path.isfile(self.version_path(name, META_NAME))
+        ]
+
+        return sorted(versions, key=lambda version: self.meta(version)["created"])
+
+
+    def meta(self, version):
+        with open(self.version_path(version, META_NAME), "r") as f:
+            return json.load(f)
+
+
+    def publish(self, classifier_path, featureset_path):
+        """
+        copy a classifier and featureset into the registry as a new version
+        returns the version; publishing the same files again is a no-op
+        """
+        version = model_version(classifier_path, featureset_path)
+        if os.path.isdir(self.version_path(version)):
+            return version
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        #copy into a temporary directory first, so a version directory
+        #is either complete or absent
+        temp_path = tempfile.mkdtemp(dir=self.path, prefix=".tmp-")
+        try:
+            shutil.copyfile(classifier_path, os.path.join(temp_path, CLASSIFIER_NAME))
+            shutil.copyfile(featureset_path, os.path.join(temp_path, FEATURESET_NAME))
+            with open(os.path.join(temp_path, META_NAME), "w") as f:
+                json.dump({
+                    "version": version,
+                    "created": time.time(),
+                    "featureset_sha1": file_digest(featureset_path).hexdigest(),
+                    "source": [classifier_path, featureset_path]
+                }, f)
+            os.rename(temp_path, self.version_path(version))
+        except:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            raise
+
+        return version
+
+
+    def pointer(self, name=CURRENT):
+        """
+        the version a pointer names, or None
+        """
+        try:
+            with open(os.path.join(self.path, name), "r") as f:
+                return f.read().strip() or None
+        except IOError:
+            return None
+
+
+    def set_pointer(self, name, version):
+        """
+        point a pointer at a published version (None to clear it)
+        """
+        if version is not None and not version in self.versions():
+            raise ValueError("unknown model version %r" % version)
+
+        if version is None:
+            if os.path.exists(os.path.join(self.path, name)):
+                os.remove(os.path.join(self.path, name))
+        else:
+            write_atomic(os.path.join(self.path, name), version + "\n")
+
+
+    def activate(self, version):
+        self.set_pointer(CURRENT, version)
+
+
+    def load(self, version):
+        """
+        load a version as a Model
+        """
+        meta = self.meta(version)
+        with open(self.version_path(version, CLASSIFIER_NAME), "rb") as f:
+            classifier = pickle.load(f)
+
+        featureset = self.featuresets.get(meta["featureset_sha1"])
+        if featureset is None:
+            with open(self.version_path(version, FEATURESET_NAME), "rb") as f:
+                featureset = pickle.load(f)
+        #every classifier is prepared; a shared featureset is left as it is
+        #by prepare (e.g. prefork.freeze_model) the second time
+        if self.prepare is not None:
+            classifier, featureset = self.prepare(classifier, featureset)
+        self.featuresets[meta["featureset_sha1"]] = featureset
+
+        return Model(classifier, featureset, version)
+
+
+    def get(self, name=CURRENT):
+        """
+        the loaded model a pointer names, or None if it is unset
+        the pointer is read at most every check_interval seconds; when it
+        has moved, the new version is loaded (by the first caller to notice)
+        and the old one is kept if loading fails
+        other callers keep getting the old version while the new one is
+        unpickled, outside self.lock
+        """
+        with self.lock:
+            model, checked = self.loaded.get(name, (None, None))
+            now = self.clock()
+            if checked is not None and now - checked < self.check_interval:
+                return model
+            if checked is not None:
+                self.loaded[name] = (model, now)
+
+        version = self.pointer(name)
+        if version is None:
+            model = None
+        elif model is None or model.version != version:
+            #one load at a time; a caller that waited here may find the
+            #version already loaded by the one before it
+            with self.load_lock:
+                with self.lock:
+                    loaded = self.loaded.get(name, (None, None))[0]
+                if loaded is not None and loaded.version == version:
+                    model = loaded
+                else:
+                    try:
+                        model = self.load(version)
+                        logger.info("loaded %s model %s", name, version)
+                    except Exception:
+                        logger.exception("loading %s model %s failed", name, version)
+                self.swap(name, model, now)
+            return model
+
+        self.swap(name, model, now)
+
+        return model
+
+
+    def swap(self, name, model, checked):
+        """
+        make model the one a pointer names
+        """
+        with self.lock:
+            self.loaded[name] = (model, checked)
+
+            #forget featuresets no loaded model uses any more
+            in_use = set(id(loaded[0].featureset)
+                for loaded in self.loaded.itervalues() if loaded[0] is not None)
+            for digest, featureset in self.featuresets.items():
+                if not id(featureset) in in_use:
+                    del self.featuresets[digest]
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class ShadowScorer(object):
+    """
+    ShadowScorer class
+    scores classified batches with a shadow model on a background thread
+    """
+
+    def __init__(self, get_model, queue_size=SHADOW_QUEUE_SIZE):
+        #returns the shadow Model, or None when there is none
+        self.get_model = get_model
+        self.queue = Queue.Queue(queue_size)
+        self.lock = threading.Lock()
+        self.stats = {"batches": 0, "tweets": 0, "disagreements": 0,
+            "dropped": 0, "errors": 0}
+        #seconds per tweet of recent batches
+        self.primary_latencies = []
+        self.shadow_latencies = []
+        #version of the shadow model the last batch was scored with
+        self.shadow_version = None
+        self.thread = None
+        self.pid = None
+
+
+    def start(self):
+        """
+        start the scoring thread (again, after a fork)
+        """
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def submit(self, model, tweets, featuresets, labels, seconds):
+        """
+        queue a batch the model classified as labels in seconds;
+        never blocks: when the shadow model falls behind, batches are dropped
+        the shadow model is looked up (and loaded) by the scoring thread
+        """
+        self.start()
+        try:
+            self.queue.put_nowait((model, tweets, featuresets, labels, seconds))
+        except Queue.Full:
+            with self.lock:
+                self.stats["dropped"] += 1
+
+
+    def score(self, model, tweets, featuresets, labels, seconds):
+        from active_learning import batch_prob_classify
+
+        shadow = self.get_model()
+        self.shadow_version = None if shadow is None else shadow.version
+        if shadow is None or shadow.version == model.version:
+            return
+
+        start = time.time()
+        #the primary model's featuresets can only be reused when
+        #the shadow model was trained on the same featureset
+        if shadow.featureset is not model.featureset:
+            featuresets = shadow.featureset.build_featureset(tweets)
+        shadow_labels = [prob_dist.max()
+            for prob_dist in batch_prob_classify(shadow.classifier, featuresets)]
+        shadow_seconds = time.time() - start
+
+        with self.lock:
+            self.stats["batches"] += 1
+            self.stats["tweets"] += len(labels)
+            self.stats["disagreements"] += sum(
+                1 for label, shadow_label in zip(labels, shadow_labels)
+                if label != shadow_label)
+            for latencies, batch_seconds in (
+                (self.primary_latencies, seconds),
+                (self.shadow_latencies, shadow_seconds)):
+                latencies.append(batch_seconds / len(labels))
+                del latencies[:-LATENCY_SAMPLES]
+
+
+    def run(self):
+        while True:
+            batch = self.queue.get()
+            try:
+                self.score(*batch)
+            except Exception:
+                with self.lock:
+                    self.stats["errors"] += 1
+                logger.exception("shadow scoring failed")
+
+
+    def report(self):
+        """
+        disagreement rate and per-tweet latencies (ms) of both models,
+        and the shadow version of the last batch
+        """
+        with self.lock:
+            report = dict(self.stats)
+            report["disagreement_rate"] = \
+                self.stats["disagreements"] / self.stats["tweets"] \
+                if self.stats["tweets"] else None
+            for name, latencies in (("primary", self.primary_latencies),
+                ("shadow", self.shadow_latencies)):
+                for label, fraction in (("p50", 0.5), ("p95", 0.95)):
+                    value = percentile(latencies, fraction)
+                    report["%s_%s_ms" % (name, label)] = \
+                        None if value is None else 1000 * value
+
+        report["shadow_version"] = self.shadow_version
+
+        return report
+
+
+def parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="manage the model registry")
+    parser.add_argument("--registry", default="models")
+    commands = parser.add_subparsers(dest="command")
+
+    publish_parser = commands.add_parser("publish", help="add a model version")
+    publish_parser.add_argument("classifier")
+    publish_parser.add_argument("featureset")
+    publish_parser.add_argument("--activate", action="store_true",
+        help="make it the current version")
+    publish_parser.add_argument("--shadow", action="store_true",
+        help="make it the shadow version")
+
+    activate_parser = commands.add_parser("activate",
+        help="make a version current")
+    activate_parser.add_argument("version")
+
+    shadow_parser = commands.add_parser("shadow",
+        help="score a version in the shadow of the current one")
+    shadow_parser.add_argument("version", help="a version, or none")
+
+    commands.add_parser("list", help="list versions")
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    registry = ModelRegistry(args.registry)
+
+    if args.command == "publish":
+        version = registry.publish(args.classifier, args.featureset)
+        if args.activate:
+            registry.activate(version)
+        if args.shadow:
+            registry.set_pointer(SHADOW, version)
+        print version
+    elif args.command == "activate":
+        registry.activate(args.version)
+    elif args.command == "shadow":
+        registry.set_pointer(SHADOW,
+            None if args.version == "none" else args.version)
+    else:
+        current = registry.pointer(CURRENT)
+        shadow = registry.pointer(SHADOW)
+        for version in registry.versions():
+            meta = registry.meta(version)
+            print "{0} {1} {2}{3}".format(version,
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(meta["created"])),
+                " current" if version == current else "",
+                " shadow" if version == shadow else "")
@@ -0,0 +1,243 @@
+# near_duplicates.py
+# find retweets and near-identical tweets with MinHash and LSH
+
+# every tweet is reduced to a MinHash signature of its token set
+# the signature is cut into bands; tweets that share any band end up
+# in the same LSH bucket and become candidates, so only candidate pairs
+# are compared instead of all pairs of tweets
+# with the defaults (64 hashes, 16 bands of 4) tweets whose token sets
+# have a Jaccard similarity above ~0.5 are very likely to be candidates
+
+# usage (report how much deduplication cuts training time):
+# python near_duplicates.py SOURCE... [--threshold T]
+
+from __future__ import division
+import sys
+import time
+import random
+import struct
+import hashlib
+import argparse
+from array import array
+
+from tweet_featureset import TweetFeatureset
+
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+DEFAULT_NUM_HASHES = 64
+DEFAULT_BANDS = 16
+DEFAULT_THRESHOLD = 0.8
+
+
+def token_hash(token):
+    """
+    stable 32 bit hash of a token (the same in every process)
+    """
+    if isinstance(token, unicode):
+        token = token.encode("utf-8")
+
+    return struct.unpack("<I", hashlib.md5(token).digest()[:4])[0]
+
+
+class MinHasher(object):
+    """
+    MinHasher class
+    computes MinHash signatures of token sets
+    """
+
+    def __init__(self, num_hashes=DEFAULT_NUM_HASHES, seed=1):
+        generator = random.Random(seed)
+        self.num_hashes = num_hashes
+        self.permutations = [
+            (generator.randint(1, MERSENNE_PRIME - 1),
+                generator.randint(0, MERSENNE_PRIME - 1))
+            for i in xrange(num_hashes)
+        ]
+
+
+    def signature(self, tokens):
+        """
+        return the MinHash signature of a token list as an array
+        """
+        hashes = [token_hash(token) for token in set(tokens)]
+        if not hashes:
+            return array("L", [MAX_HASH]) * self.num_hashes
+
+        return array("L", [
+            min((a * h + b) % MERSENNE_PRIME for h in hashes) & MAX_HASH
+            for a, b in self.permutations
+        ])
+
+
+def similarity(signature, other):
+    """
+    estimate the Jaccard similarity of two token sets from their signatures
+    """
+    return sum(1 for x, y in zip(signature, other) if x == y) / len(signature)
+
+
+class NearDuplicateIndex(object):
+    """
+    NearDuplicateIndex class
+    LSH index of MinHash signatures
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD,
+        num_hashes=DEFAULT_NUM_HASHES, bands=DEFAULT_BANDS):
+        if num_hashes % bands != 0:
+            raise ValueError("num_hashes must be a multiple of bands")
+
+        self.threshold = threshold
+        self.hasher = MinHasher(num_hashes)
+        self.bands = bands
+        self.rows = num_hashes // bands
+        #one dictionary per band: band values -> keys of indexed tweets
+        self.buckets = [{} for i in xrange(bands)]
+        self.signatures = {}
+
+
+    def __len__(self):
+        return len(self.signatures)
+
+
+    def band_keys(self, signature):
+        for band in xrange(self.bands):
+            yield tuple(signature[band * self.rows:(band + 1) * self.rows])
+
+
+    def add(self, key, tokens):
+        """
+        index the tokens of a tweet under key (e.g. the tweet id)
+        """
+        signature = self.hasher.signature(tokens)
+        self.signatures[key] = signature
+        for buckets, band_key in zip(self.buckets, self.band_keys(signature)):
+            buckets.setdefault(band_key, []).append(key)
+
+        return signature
+
+
+    def query(self, tokens, signature=None):
+        """
+        return the keys of indexed tweets that are near-duplicates of tokens,
+        most similar first
+        """
+        if signature is None:
+            signature = self.hasher.signature(tokens)
+
+        candidates = set()
+        for buckets, band_key in zip(self.buckets, self.band_keys(signature)):
+            candidates.update(buckets.get(band_key, ()))
+
+        matches = [
+            (similarity(signature, self.signatures[key]), key)
+            for key in candidates
+        ]
+        matches = [match for match in matches if match[0] >= self.threshold]
+        matches.sort(reverse=True)
+
+        return [key for score, key in matches]
+
+
+    def find(self, tokens):
+        """
+        return the key of the most similar indexed tweet, or None
+        """
+        matches = self.query(tokens)
+
+        return matches[0] if matches else None
+
+
+def deduplicate_tokenized(corpus, threshold=DEFAULT_THRESHOLD):
+    """
+    return the tweets of a tokenized corpus (see TweetFeatureset.tokenize_corpus)
+    without near-duplicates of earlier tweets, and the index of kept tweets
+    tweets are indexed by their position in corpus; tweets without tokens
+    can't be compared, so they are all kept and none is indexed
+    """
+    index = NearDuplicateIndex(threshold)
+    kept = []
+    for position, tweet in enumerate(corpus):
+        if not tweet["tokens"]:
+            kept.append(tweet)
+            continue
+        signature = index.hasher.signature(tweet["tokens"])
+        if not index.query(tweet["tokens"], signature):
+            index.add(position, tweet["tokens"])
+            kept.append(tweet)
+
+    return kept, index
+
+
+def deduplicate_tweets(tweets, threshold=DEFAULT_THRESHOLD):
+    """
+    return the tweets of a corpus without repeated ids and near-duplicates
+    of earlier tweets, in order
+    the tweets are not modified
+    """
+    #the same tweet can be in more than one source; keep its first copy
+    seen_ids = set()
+    unique = []
+    for tweet in tweets:
+        if not tweet["id"] in seen_ids:
+            seen_ids.add(tweet["id"])
+            unique.append(tweet)
+
+    #ids are unique now, so tokenized copies can be matched up by id;
+    #tweets without tokens aren't in the tokenized corpus
+    tokens = dict((tweet["id"], tweet["tokens"])
+        for tweet in TweetFeatureset.tokenize_corpus(unique))
+    kept, index = deduplicate_tokenized([
+        {"tweet": tweet, "tokens": tokens.get(tweet["id"], ())}
+        for tweet in unique
+    ], threshold)
+
+    return [entry["tweet"] for entry in kept]
+
+
+def time_training(tweets):
+    """
+    seconds it takes to train a featureset and classifier on tweets
+    """
+    from nltk import NaiveBayesClassifier
+
+    start = time.time()
+    featureset = TweetFeatureset(tweets)
+    NaiveBayesClassifier.train(
+        featureset.build_tagged_featureset(tweets))
+
+    return time.time() - start
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="report near-duplicates and their cost in training time")
+    parser.add_argument("sources", nargs="+")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    from tweet_io import iter_tweets
+
+    args = parse_args(sys.argv[1:])
+    tweets = [tweet for source in args.sources for tweet in iter_tweets(source)]
+
+    start = time.time()
+    deduplicated = deduplicate_tweets(tweets, args.threshold)
+    dedup_time = time.time() - start
+    unique_ids = len(set(tweet["id"] for tweet in tweets))
+    print "{0} tweets, {1} repeated ids, {2} near-duplicates: {3} after " \
+        "deduplication ({4:.1%} removed) in {5:.2f}s".format(
+            len(tweets), len(tweets) - unique_ids,
+            unique_ids - len(deduplicated), len(deduplicated),
+            1 - len(deduplicated) / len(tweets), dedup_time)
+
+    full_time = time_training(tweets)
+    dedup_train_time = time_training(deduplicated)
+    print "training: {0:.2f}s on all tweets, {1:.2f}s after deduplication " \
+        "({2:.2f}s including deduplication)".format(
+            full_time, dedup_train_time, dedup_train_time + dedup_time)
@@ -0,0 +1,235 @@
+# prefork.py
+# share the loaded model between gunicorn workers
+
+# with preloading, the master process loads the classifier and featureset
+# before forking, and workers inherit them as copy-on-write pages
+# pages only stay shared if the workers don't write to them;
+# reference counting and garbage collection both write to every object
+# they touch, so the model is frozen after it is loaded:
+# -the idf scores are moved into flat arrays (tf_idf.FrozenIdf)
+# -the naive Bayes classifier's probabilities, one dictionary, probability
+#  distribution and frequency distribution per (label, feature), are
+#  moved into flat arrays too (FrozenNaiveBayes)
+# -on Python 3.7+, the objects that exist at that point are moved out of
+#  the garbage collector's reach (gc.freeze); Python 2.7, which the app
+#  runs on, has no way to do that, so full collections are made rare
+#  instead, and since the frozen model is a handful of arrays rather
+#  than tens of thousands of objects, collections barely touch its pages
+# see "benchmarks.py prefork" for the memory workers use with and without
+# freezing
+
+from __future__ import division
+import gc
+import os
+from array import array
+from bisect import bisect_left
+
+from tf_idf import FrozenIdf, IdfDict
+
+
+#gc thresholds used when gc.freeze isn't available
+FALLBACK_GC_THRESHOLDS = (50000, 50, 1000)
+
+
+class FrozenNaiveBayes(object):
+    """
+    read-only, array-backed copy of a trained NLTK NaiveBayesClassifier
+
+    a trained classifier has a probability distribution per (label,
+    feature) over the feature's values: the single value the feature
+    had in training tweets, or None for tweets without it
+    for every label, the log probability of each of those three cases
+    (the training value, None, any other value) is kept in flat arrays
+    indexed like the sorted hashes of the feature names, so classifying
+    gives the same probabilities as the classifier it was built from
+    feature name hashes are process-specific, so a FrozenNaiveBayes is
+    built at load time and is never pickled
+    """
+
+    def __init__(self, classifier):
+        self._labels = list(classifier.labels())
+        self.label_logprobs = [classifier._label_probdist.logprob(label)
+            for label in self._labels]
+
+        #feature name -> {label: probability distribution}
+        features = {}
+        for (label, fname), probdist in classifier._feature_probdist.iteritems():
+            features.setdefault(fname, {})[label] = probdist
+        fnames = sorted(features, key=hash)
+        hashes = [hash(fname) for fname in fnames]
+        if len(set(hashes)) < len(hashes):
+            raise ValueError("feature names with the same hash")
+        self.hashes = array("l", hashes)
+
+        #per label: the training value of every feature and the log
+        #probabilities of that value, of None, and of any other value;
+        #features a label has no distribution for get -inf, like NLTK
+        self.values = []
+        self.value_logprobs = []
+        self.none_logprobs = []
+        self.other_logprobs = []
+        for label in self._labels:
+            values, value_logprobs, none_logprobs, other_logprobs = \
+                array("d"), array("d"), array("d"), array("d")
+            for fname in fnames:
+                probdist = features[fname].get(label)
+                if probdist is None:
+                    value = float("nan")
+                    value_logprob = none_logprob = other_logprob = float("-inf")
+                else:
+                    samples = [sample for sample in probdist.samples()
+                        if sample is not None]
+                    if len(samples) > 1 or not all(
+                        isinstance(sample, float) for sample in samples):
+                        raise ValueError(
+                            "feature %r has more than one value" % (fname,))
+                    value = samples[0] if samples else float("nan")
+                    value_logprob = probdist.logprob(value) \
+                        if samples else float("-inf")
+                    none_logprob = probdist.logprob(None)
+                    #probability of a value never seen in training
+                    other_logprob = probdist.logprob(object())
+                values.append(value)
+                value_logprobs.append(value_logprob)
+                none_logprobs.append(none_logprob)
+                other_logprobs.append(other_logprob)
+            self.values.append(values)
+            self.value_logprobs.append(value_logprobs)
+            self.none_logprobs.append(none_logprobs)
+            self.other_logprobs.append(other_logprobs)
+
+
+    def labels(self):
+        return self._labels
+
+
+    def index(self, fname):
+        """
+        position of a feature in the arrays, or None if it wasn't trained on
+        """
+        fname_hash = hash(fname)
+        i = bisect_left(self.hashes, fname_hash)
+        if i < len(self.hashes) and self.hashes[i] == fname_hash:
+            return i
+
+        return None
+
+
+    def prob_classify(self, featureset):
+        from nltk.probability import DictionaryProbDist
+
+        logprobs = list(self.label_logprobs)
+        #features are visited in the order NLTK visits them,
+        #so the sums, and the probabilities, are identical
+        for fname, fval in featureset.copy().items():
+            i = self.index(fname)
+            if i is None:
+                continue
+            for j in xrange(len(self._labels)):
+                if fval is None:
+                    logprobs[j] += self.none_logprobs[j][i]
+                elif fval == self.values[j][i]:
+                    logprobs[j] += self.value_logprobs[j][i]
+                else:
+                    logprobs[j] += self.other_logprobs[j][i]
+
+        return DictionaryProbDist(dict(zip(self._labels, logprobs)),
+            normalize=True, log=True)
+
+
+    def classify(self, featureset):
+        return self.prob_classify(featureset).max()
+
+
+    def __reduce__(self):
+        raise TypeError("FrozenNaiveBayes cannot be pickled; "
+            "pickle the NaiveBayesClassifier")
+
+
+def freeze_idf_set(idf_set):
+    """
+    return a FrozenIdf copy of an IdfDict,
+    or the IdfDict itself when it can't be frozen
+    """
+    if not isinstance(idf_set, IdfDict):
+        return idf_set
+    try:
+        return FrozenIdf(idf_set)
+    except ValueError:
+        return idf_set
+
+
+def freeze_classifier(classifier):
+    """
+    return a FrozenNaiveBayes copy of a naive Bayes classifier,
+    or the classifier itself when it can't be frozen
+    """
+    if not hasattr(classifier, "_feature_probdist"):
+        return classifier
+    try:
+        return FrozenNaiveBayes(classifier)
+    except ValueError:
+        return classifier
+
+
+def freeze_model(classifier, featureset):
+    """
+    prepare a loaded model to be shared by forked workers
+    """
+    featureset.idf_set = freeze_idf_set(featureset.idf_set)
+    classifier = freeze_classifier(classifier)
+
+    #collect garbage once now, so it isn't done in every worker later
+    gc.collect()
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+    else:
+        gc.set_threshold(*FALLBACK_GC_THRESHOLDS)
+
+    return classifier, featureset
+
+
+def memory_usage(pid="self"):
+    """
+    return resident, proportional and shared memory of a process in KB
+    RSS counts shared pages in full for every process;
+    PSS splits them between the processes that share them
+    (Linux only; values are None elsewhere)
+    """
+    usage = {"rss": None, "pss": None, "shared": None}
+
+    try:
+        with open("/proc/%s/status" % pid, "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    usage["rss"] = int(line.split()[1])
+    except IOError:
+        return usage
+
+    #smaps_rollup is cheap but new (Linux 4.14); fall back to smaps
+    for name in ("smaps_rollup", "smaps"):
+        try:
+            with open("/proc/%s/%s" % (pid, name), "r") as f:
+                pss = shared = 0
+                for line in f:
+                    if line.startswith("Pss:"):
+                        pss += int(line.split()[1])
+                    elif line.startswith("Shared_Clean:") \
+                        or line.startswith("Shared_Dirty:"):
+                        shared += int(line.split()[1])
+            usage["pss"] = pss
+            usage["shared"] = shared
+            break
+        except IOError:
+            continue
+
+    return usage
+
+
+def format_memory_usage(usage):
+    return "rss {0} KB, pss {1} KB, shared {2} KB".format(
+        usage["rss"], usage["pss"], usage["shared"])
+
+
+def preload_enabled():
+    return os.getenv("STEVEKLABNIK_TWEETS_POLITICS_PRELOAD") == "True"
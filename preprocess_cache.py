@@ -0,0 +1,215 @@
+# preprocess_cache.py
+# SQLite cache of preprocessed tweets
+
+# cleaning up, tokenizing and cleaning up the tokens of a tweet's text
+# (see TweetFeatureset.tokenize_corpus) is the slowest part of training,
+# evaluating and scoring, and is repeated for the same tweets on every run
+# the cache maps a hash of the raw text to the cleaned up text and tokens;
+# entries are kept per preprocessing fingerprint (see
+# tweet_preprocess.preprocess_fingerprint), so changing the stopwords,
+# contractions, regular expressions or POS filter never returns stale
+# tokens; prune() drops the entries of other fingerprints
+# the cache is used by TweetFeatureset once it is set as
+# TweetFeatureset.preprocess_cache (see enable)
+
+# usage:
+# python preprocess_cache.py CACHE [--prune]
+
+import os
+import sys
+import hashlib
+import sqlite3
+import threading
+
+from tweet_preprocess import preprocess_fingerprint
+
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS fingerprints (
+        id INTEGER PRIMARY KEY,
+        fingerprint TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tweets (
+        fingerprint_id INTEGER NOT NULL,
+        hash BLOB NOT NULL,
+        text TEXT NOT NULL,
+        tokens TEXT NOT NULL,
+        PRIMARY KEY (fingerprint_id, hash)
+    ) WITHOUT ROWID
+    """,
+]
+
+#max number of hashes per "IN (...)" query (SQLite limits query parameters)
+LOOKUP_CHUNK_SIZE = 500
+
+#seconds to wait for another process writing to the cache
+BUSY_TIMEOUT = 60
+
+#tokens are stored joined by a space; they never contain one
+TOKEN_SEPARATOR = " "
+
+
+def text_hash(text):
+    if isinstance(text, unicode):
+        text = text.encode("utf-8")
+
+    return buffer(hashlib.sha1(text).digest())
+
+
+class PreprocessCache(object):
+    """
+    PreprocessCache class
+    cleaned up text and tokens of tweets, keyed by a hash of the raw text
+    """
+
+    def __init__(self, path):
+        self.path = path
+        #sqlite3 connections can't be shared between threads (or processes)
+        self.local = threading.local()
+        #(pos filter) -> fingerprint id
+        self.fingerprint_ids = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        connection = self.connection()
+        with connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+
+    def connection(self):
+        """
+        return the connection of the current thread and process,
+        opening it on first use
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+            #tokens are byte strings, so return them as such
+            connection.text_factory = str
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+
+        return connection
+
+
+    def fingerprint_id(self, pos_filter=False):
+        """
+        return the id of the current preprocessing fingerprint
+        """
+        fingerprint_id = self.fingerprint_ids.get(bool(pos_filter))
+        if fingerprint_id is None:
+            fingerprint = preprocess_fingerprint(pos_filter)
+            connection = self.connection()
+            with connection:
+                connection.execute(
+                    "INSERT OR IGNORE INTO fingerprints (fingerprint) VALUES (?)",
+                    (fingerprint,))
+            fingerprint_id = connection.execute(
+                "SELECT id FROM fingerprints WHERE fingerprint = ?",
+                (fingerprint,)).fetchone()[0]
+            self.fingerprint_ids[bool(pos_filter)] = fingerprint_id
+
+        return fingerprint_id
+
+
+    def lookup(self, texts, pos_filter=False):
+        """
+        return a list with the (cleaned up text, tokens) of every raw text,
+        or None for texts that aren't cached
+        """
+        fingerprint_id = self.fingerprint_id(pos_filter)
+        hashes = [text_hash(text) for text in texts]
+        found = {}
+        for start in xrange(0, len(hashes), LOOKUP_CHUNK_SIZE):
+            chunk = hashes[start:start + LOOKUP_CHUNK_SIZE]
+            rows = self.connection().execute(
+                "SELECT hash, text, tokens FROM tweets "
+                "WHERE fingerprint_id = ? AND hash IN (%s)" % ", ".join("?" * len(chunk)),
+                [fingerprint_id] + chunk
+            )
+            for hash, text, tokens in rows:
+                found[str(hash)] = (text,
+                    tokens.split(TOKEN_SEPARATOR) if tokens else [])
+
+        results = [found.get(str(hash)) for hash in hashes]
+        hits = len(results) - results.count(None)
+        with self.lock:
+            self.hits += hits
+            self.misses += len(results) - hits
+
+        return results
+
+
+    def add_many(self, entries, pos_filter=False):
+        """
+        cache (raw text, cleaned up text, tokens) entries
+        """
+        fingerprint_id = self.fingerprint_id(pos_filter)
+        connection = self.connection()
+        with connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO tweets (fingerprint_id, hash, text, tokens) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (fingerprint_id, text_hash(raw_text), text,
+                        TOKEN_SEPARATOR.join(tokens))
+                    for raw_text, text, tokens in entries
+                ]
+            )
+
+
+    def prune(self):
+        """
+        delete the entries of every fingerprint but the current ones
+        """
+        current = [preprocess_fingerprint(False), preprocess_fingerprint(True)]
+        connection = self.connection()
+        with connection:
+            connection.execute(
+                "DELETE FROM tweets WHERE fingerprint_id IN "
+                "(SELECT id FROM fingerprints WHERE fingerprint NOT IN (?, ?))",
+                current)
+            connection.execute(
+                "DELETE FROM fingerprints WHERE fingerprint NOT IN (?, ?)",
+                current)
+        self.fingerprint_ids = {}
+
+
+    def __len__(self):
+        return self.connection().execute("SELECT COUNT(*) FROM tweets").fetchone()[0]
+
+
+def enable(path):
+    """
+    make TweetFeatureset read and write tokenized tweets through a cache at path
+    """
+    from tweet_featureset import TweetFeatureset
+
+    if path is None:
+        TweetFeatureset.preprocess_cache = None
+    else:
+        TweetFeatureset.preprocess_cache = PreprocessCache(path)
+
+    return TweetFeatureset.preprocess_cache
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="inspect a preprocessing cache")
+    parser.add_argument("cache")
+    parser.add_argument("--prune", action="store_true",
+        help="delete entries of old preprocessing configurations")
+    args = parser.parse_args(sys.argv[1:])
+
+    cache = PreprocessCache(args.cache)
+    if args.prune:
+        cache.prune()
+        cache.connection().execute("VACUUM")
+    print "{0} cached tweets".format(len(cache))
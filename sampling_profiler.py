@@ -0,0 +1,268 @@
+# sampling_profiler.py
+# sampling profiler for a running process, e.g. a gunicorn worker
+
+# a background thread takes a sample every interval seconds: the stack of
+# every other thread of the process (sys._current_frames); nothing is
+# traced between samples, so the overhead is one walk of every thread's
+# stack per sample (see "benchmarks.py profiler")
+# profiles are reported in collapsed form, ready for flamegraph.pl or
+# speedscope: one line per distinct stack, with the thread's name and its
+# frames from the outermost to the innermost joined by ";", followed by
+# the number of samples the stack was seen in, e.g.
+#   MainThread;...;steveklabnik_politics:index;...;tf_idf:tf_idf_corpus 42
+
+# in the webapp, a worker is profiled in the background with
+# POST /admin/profile?seconds=N, or by sending it SIGPROF (see
+# gunicorn_config.post_fork); the profile is written to a directory all
+# workers share, so any worker can serve it (see steveklabnik_politics.py)
+
+# usage:
+# python sampling_profiler.py [--interval SECONDS] [--output FILE]
+#     SCRIPT [ARGS...]
+
+from __future__ import division
+import os
+import re
+import sys
+import time
+import signal
+import argparse
+import threading
+
+from model_registry import write_atomic
+
+
+#seconds between samples
+DEFAULT_INTERVAL = 0.005
+
+#length of a profile started by a signal
+DEFAULT_SECONDS = 30
+
+#file names of finished profiles; profiles are written under a temporary
+#name and renamed, so unfinished ones never match
+PROFILE_NAME = re.compile(r"^profile-\d+-\d+\.folded$")
+
+
+class SamplingProfiler(object):
+    """
+    SamplingProfiler class
+    counts the stacks of the threads of this process, sampled periodically
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        #stack (tuple of frame labels) -> number of samples
+        self.counts = {}
+        #code object -> frame label
+        self.labels = {}
+        #thread id -> thread name
+        self.thread_names = {}
+        self.samples = 0
+        self.sample_seconds = 0.0
+        self.elapsed = 0.0
+        self.stopped = False
+
+
+    def frame_label(self, frame):
+        code = frame.f_code
+        label = self.labels.get(code)
+        if label is None:
+            label = "{0}:{1}".format(frame.f_globals.get("__name__", "?"),
+                code.co_name).replace(";", ":")
+            self.labels[code] = label
+
+        return label
+
+
+    def thread_name(self, ident):
+        name = self.thread_names.get(ident)
+        if name is None:
+            self.thread_names = dict(
+                (thread.ident, thread.name) for thread in threading.enumerate())
+            name = self.thread_names.setdefault(ident, "thread %d" % ident)
+
+        return name
+
+
+    def sample(self):
+        """
+        count the current stack of every thread but the calling one
+        """
+        own = threading.current_thread().ident
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self.frame_label(frame))
+                frame = frame.f_back
+            stack.append(self.thread_name(ident))
+            stack = tuple(reversed(stack))
+            self.counts[stack] = self.counts.get(stack, 0) + 1
+        self.samples += 1
+
+
+    def run(self, seconds=None):
+        """
+        sample until stop is called, or for seconds
+        """
+        start = next_sample = time.time()
+        while not self.stopped:
+            sample_start = time.time()
+            if seconds is not None and sample_start - start >= seconds:
+                break
+            self.sample()
+            self.sample_seconds += time.time() - sample_start
+
+            next_sample += self.interval
+            delay = next_sample - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                #fell behind (e.g. waiting for the GIL); don't catch up
+                next_sample = time.time()
+        self.elapsed = time.time() - start
+
+
+    def stop(self):
+        self.stopped = True
+
+
+    def collapsed(self):
+        """
+        the counted stacks in collapsed form, most sampled first
+        """
+        return "".join(
+            "{0} {1}\n".format(";".join(stack), count)
+            for stack, count in sorted(self.counts.iteritems(),
+                key=lambda (stack, count): (-count, stack))
+        )
+
+
+    def overhead(self):
+        """
+        fraction of the profiled time spent sampling
+        """
+        return self.sample_seconds / self.elapsed if self.elapsed else 0.0
+
+
+#profiler running in the background in this process (see start_profile)
+active_profiler = None
+active_lock = threading.Lock()
+
+
+def start_profile(directory, seconds=DEFAULT_SECONDS, interval=DEFAULT_INTERVAL):
+    """
+    profile this process for seconds in a background thread, then write
+    the collapsed stacks to a file in directory
+    returns the name of the file, or None when a profile is already running
+    """
+    global active_profiler
+
+    #called from signal handlers too, so never wait for the lock
+    if not active_lock.acquire(False):
+        return None
+    try:
+        if active_profiler is not None:
+            return None
+        profiler = active_profiler = SamplingProfiler(interval)
+    finally:
+        active_lock.release()
+
+    name = "profile-{0}-{1}.folded".format(os.getpid(), int(time.time()))
+
+    def run():
+        global active_profiler
+        try:
+            profiler.run(seconds)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            write_atomic(os.path.join(directory, name), profiler.collapsed())
+        finally:
+            active_profiler = None
+
+    thread = threading.Thread(target=run, name="sampling profiler")
+    thread.daemon = True
+    thread.start()
+
+    return name
+
+
+def list_profiles(directory):
+    """
+    (name, bytes, modification time) of the finished profiles in directory,
+    newest first
+    """
+    if not os.path.isdir(directory):
+        return []
+
+    profiles = []
+    for name in os.listdir(directory):
+        if PROFILE_NAME.match(name):
+            stat = os.stat(os.path.join(directory, name))
+            profiles.append((name, stat.st_size, stat.st_mtime))
+
+    return sorted(profiles, key=lambda profile: profile[2], reverse=True)
+
+
+def read_profile(directory, name):
+    """
+    the collapsed stacks of a finished profile, or None if there is none
+    by that name
+    """
+    if not PROFILE_NAME.match(name):
+        return None
+    try:
+        with open(os.path.join(directory, name), "rb") as f:
+            return f.read()
+    except IOError:
+        return None
+
+
+def install_signal_handler(directory, seconds=DEFAULT_SECONDS,
+    signum=signal.SIGPROF):
+    """
+    start a profile (see start_profile) whenever this process gets signum
+    """
+    def handle(signum, frame):
+        start_profile(directory, seconds)
+
+    signal.signal(signum, handle)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="profile a Python script by sampling its stack")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL,
+        help="seconds between samples")
+    parser.add_argument("--output", default=None,
+        help="write the collapsed stacks here instead of to stdout")
+    parser.add_argument("script")
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    import runpy
+
+    args = parse_args(sys.argv[1:])
+    sys.argv = [args.script] + args.args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+
+    profiler = SamplingProfiler(args.interval)
+    thread = threading.Thread(target=profiler.run, name="sampling profiler")
+    thread.daemon = True
+    thread.start()
+    try:
+        runpy.run_path(args.script, run_name="__main__")
+    finally:
+        profiler.stop()
+        thread.join()
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(profiler.collapsed())
+        else:
+            sys.stdout.write(profiler.collapsed())
+        sys.stderr.write("{0} samples in {1:.1f}s, {2:.1%} spent sampling\n".format(
+            profiler.samples, profiler.elapsed, profiler.overhead()))
@@ -4,19 +4,31 @@
 import pickle
 import os
 import json
+import time
+import zlib
+import hashlib
+import hmac
 from urllib2 import urlopen
 
-import twitter
-from nltk import NaiveBayesClassifier
-from flask import Flask, render_template
-import pylibmc
+from flask import Flask, render_template, request, jsonify, make_response, abort
 
 from tweet_featureset import TweetFeatureset
+from prefork import freeze_model, preload_enabled
+from timeline_poller import TimelinePoller
+from history_store import HistoryStore, DEFAULT_PAGE_SIZE
+from fetch_scheduler import FetchScheduler, ScheduledApi, SchedulerTimeout
+from windowed_idf import tweet_timestamp
+from cache_codec import CodecCache
+from model_registry import Model, ModelRegistry, ShadowScorer, model_version, \
+    CURRENT, SHADOW
+import sampling_profiler
 
 
 DEBUG = True if os.getenv("STEVEKLABNIK_TWEETS_POLITICS_DEBUG") == "True" else False
 CLASSIFIER_FILE = "classifier.txt"
 FEATURESET_FILE = "featureset.txt"
+MODEL_REGISTRY = os.getenv("STEVEKLABNIK_TWEETS_POLITICS_MODELS", "models")
+HISTORY_DB = os.getenv("STEVEKLABNIK_TWEETS_POLITICS_HISTORY_DB", "history.db")
 
 #OAuth credentials
 TWITTER_CONSUMER_KEY = os.getenv("TWITTER_CONSUMER_KEY")
@@ -24,60 +36,145 @@ TWITTER_CONSUMER_SECRET = os.getenv("TWITTER_CONSUMER_SECRET")
 TWITTER_OAUTH_TOKEN = os.getenv("TWITTER_OAUTH_TOKEN")
 TWITTER_OAUTH_TOKEN_SECRET = os.getenv("TWITTER_OAUTH_TOKEN_SECRET")
 TWITTER_USER = "steveklabnik"
-TWITTER_OEMBED_API_URL = "https://api.twitter.com/1/statuses/oembed.json?" \
+#accounts that can be polled through the API (comma separated)
+TWITTER_ACCOUNTS = os.getenv("STEVEKLABNIK_TWEETS_POLITICS_ACCOUNTS",
+    TWITTER_USER).split(",")
+#the API URLs can be pointed elsewhere, e.g. at fake_twitter.py for load tests
+#(None: python-twitter's default)
+TWITTER_API_URL = os.getenv("STEVEKLABNIK_TWEETS_POLITICS_TWITTER_API_URL")
+TWITTER_OEMBED_API_URL = os.getenv("STEVEKLABNIK_TWEETS_POLITICS_OEMBED_URL",
+    "https://api.twitter.com/1/statuses/oembed.json") + "?" \
 + "align=center" \
 + "&maxwidth=500" \
 + "&hide_media=false" \
 + "&hide_thread=false" \
 + "&id="
 
+#Twitter API calls of all threads of a worker go through one scheduler;
+#the workers of a dyno share the rate limits of the credentials equally
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 3))
+scheduler = FetchScheduler(share=1.0 / WEB_CONCURRENCY)
+#seconds a request waits for a Twitter API call (including waiting for
+#rate limit tokens) before serving the latest tweet it has instead;
+#well below gunicorn's 30 second worker timeout
+API_TIMEOUT = 5
+#seconds that latest tweet is then served for before trying again
+FALLBACK_CACHE_TIMEOUT = 30
+#pages of new tweets a request polls for (see timeline_poller.py);
+#each page is an API call of at most API_TIMEOUT seconds, and a poll
+#that finds new tweets ends with a call that returns an empty page
+REQUEST_MAX_PAGES = 2
+
 #cache settings
-CACHE_TIMEOUT = 60 * 5 #timeout after 5 minutes
+CACHE_TIMEOUT = int(os.getenv("STEVEKLABNIK_TWEETS_POLITICS_CACHE_TIMEOUT",
+    60 * 5)) #timeout after 5 minutes
+#"memory" uses an in-process cache instead of memcached, "shared" an
+#in-memory cache served to all workers at CACHE_ADDRESS (see memory_cache.py)
+CACHE_BACKEND = os.getenv("STEVEKLABNIK_TWEETS_POLITICS_CACHE", "memcached")
+CACHE_ADDRESS = os.getenv("STEVEKLABNIK_TWEETS_POLITICS_CACHE_ADDRESS",
+    "127.0.0.1:11311")
+#how values are serialized in the cache (see cache_codec.py):
+#"marshal", "json", "pickle", or "none" to let the client pickle them
+CACHE_CODEC = os.getenv("STEVEKLABNIK_TWEETS_POLITICS_CACHE_CODEC", "marshal")
+#cache rendered pages, keyed by tweet id and model version
+PAGE_CACHE = os.getenv("STEVEKLABNIK_TWEETS_POLITICS_PAGE_CACHE") != "False"
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+#bump this when templates/index.html changes, so cached pages are replaced
+PAGE_VERSION = 2
+
+#the /admin endpoints are disabled unless a token is set;
+#requests must pass it in the X-Admin-Token header
+ADMIN_TOKEN = os.getenv("STEVEKLABNIK_TWEETS_POLITICS_ADMIN_TOKEN")
+#profiles of workers (see sampling_profiler.py) are written here
+PROFILE_DIR = os.getenv("STEVEKLABNIK_TWEETS_POLITICS_PROFILE_DIR", "profiles")
+PROFILE_MAX_SECONDS = 300
 
 #initialize Flask app
 app = Flask(__name__)
 app.config.from_object(__name__)
 
-#initialize memcached
-if DEBUG:
-    #development settings
-    cache = pylibmc.Client(
-        servers=["127.0.0.1"],
-        binary=True
-    )
-else:
-    #production settings
-    cache = pylibmc.Client(
-        servers=[os.environ.get('MEMCACHIER_SERVERS')],
-        username=os.environ.get('MEMCACHIER_USERNAME'),
-        password=os.environ.get('MEMCACHIER_PASSWORD'),
-        binary=True
-    )
+#memcached client, created on first use (see get_cache)
+cache = None
+
 
+#heavy dependencies (python-twitter, pylibmc, and nltk through the
+#pickled classifier) are imported on first use rather than at import time,
+#so that starting and restarting workers is fast;
+#see import_profile.py for the import time of this module
 
-def get_raw_tweet():
+def get_cache():
     """
-    fetch the latest tweet of TWITTER_USER (steveklabnik)
+    return the memcached client, connecting on first use
     """
-    api = twitter.Api(
+    global cache
+    if cache is not None:
+        return cache
+
+    if CACHE_BACKEND == "memory":
+        from memory_cache import MemoryCache
+        client = MemoryCache()
+    elif CACHE_BACKEND == "shared":
+        from memory_cache import connect_shared_cache
+        client = connect_shared_cache(CACHE_ADDRESS)
+    else:
+        import pylibmc
+
+        if DEBUG:
+            #development settings
+            client = pylibmc.Client(
+                servers=["127.0.0.1"],
+                binary=True
+            )
+        else:
+            #production settings
+            client = pylibmc.Client(
+                servers=[os.environ.get('MEMCACHIER_SERVERS')],
+                username=os.environ.get('MEMCACHIER_USERNAME'),
+                password=os.environ.get('MEMCACHIER_PASSWORD'),
+                binary=True
+            )
+
+    if CACHE_CODEC == "none":
+        cache = client
+    else:
+        cache = CodecCache(client, CACHE_CODEC)
+
+    return cache
+
+
+def get_twitter_api():
+    """
+    return a python-twitter Api authenticated with the OAuth credentials
+    """
+    import twitter
+
+    return twitter.Api(
         consumer_key=TWITTER_CONSUMER_KEY,
         consumer_secret=TWITTER_CONSUMER_SECRET,
         access_token_key=TWITTER_OAUTH_TOKEN,
-        access_token_secret=TWITTER_OAUTH_TOKEN_SECRET
+        access_token_secret=TWITTER_OAUTH_TOKEN_SECRET,
+        base_url=TWITTER_API_URL
     )
 
-    tweets = api.GetUserTimeline(
-        screen_name=TWITTER_USER,
-        trim_user=True,
-        count=1
-    )
-    tweet = tweets[0]
 
-    return {
-        "id": tweet.id,
-        "text": tweet.text,
-        "retweet": tweet.retweeted_status != None
-    }
+#timeline poller, created on first use (see get_poller)
+poller = None
+
+
+def get_poller():
+    """
+    return the poller that fetches and classifies new tweets;
+    since ids are kept in memcached so that all workers share them
+    """
+    global poller
+    if poller is None:
+        api = ScheduledApi(get_twitter_api(), scheduler,
+            TWITTER_OAUTH_TOKEN or "app", timeout=API_TIMEOUT)
+        poller = TimelinePoller(api, get_model, get_cache(),
+            history=get_history(), shadow=shadow_scorer,
+            max_pages=REQUEST_MAX_PAGES)
+
+    return poller
 
 
 def load_classifier():
@@ -100,56 +197,397 @@ def load_featureset():
     return featureset
 
 
-def get_tweet_display(tweet_id):
+def get_model_version():
+    """
+    identify the model by a hash of the classifier and featureset files
+    """
+    return model_version(CLASSIFIER_FILE, FEATURESET_FILE)
+
+
+#model loaded from the fixed files, once per process (see get_model)
+model = None
+
+#the model registry, used instead of the fixed files once it has
+#a current version (see model_registry.py); a shadow version is scored
+#in the background when it is set
+registry = ModelRegistry(MODEL_REGISTRY)
+shadow_scorer = ShadowScorer(lambda: registry.get(SHADOW))
+
+
+def get_model():
+    """
+    return the model (classifier, featureset, version), loading it on first use
+    the registry's current version is followed without restarting
+    """
+    global model
+    current = registry.get(CURRENT)
+    if current is not None:
+        return current
+
+    if model is None:
+        model = Model(load_classifier(), load_featureset(), get_model_version())
+
+    return model
+
+
+def preload_model():
+    """
+    load the model and freeze it so forked workers can share its pages
+    """
+    global model
+    registry.prepare = freeze_model
+    current = registry.get(CURRENT)
+    if current is not None:
+        return current
+
+    classifier, featureset = freeze_model(load_classifier(), load_featureset())
+    model = Model(classifier, featureset, get_model_version())
+
+    return model
+
+
+#history of classified tweets, opened on first use (see get_history)
+history = None
+
+
+def get_history():
+    global history
+    if history is None:
+        history = HistoryStore(HISTORY_DB)
+
+    return history
+
+
+def get_tweet_display(tweet_id, account=TWITTER_USER):
     """
     Use Twitter's oEmbed API to retrieve a HTML snippet of the tweet
+    returns None if Twitter doesn't answer within API_TIMEOUT, or fails
     """
-    url = urlopen(TWITTER_OEMBED_API_URL + str(tweet_id))
-    data = json.load(url)
+    def fetch():
+        return json.load(urlopen(TWITTER_OEMBED_API_URL + str(tweet_id),
+            timeout=API_TIMEOUT))
+
+    try:
+        data = scheduler.call("statuses/oembed", "app", tweet_id, fetch,
+            hot_key=account, timeout=API_TIMEOUT)
+    except (SchedulerTimeout, IOError):
+        return None
 
     return data["html"]
 
 
-def get_classified_tweet():
+def get_classified_tweet(account=TWITTER_USER):
     """
-    load a tweet and classify it
+    load the latest tweet of an account (steveklabnik by default), classified
+    returns (tweet, time its cache entry expires), or (None, None) if the
+    account has no tweets
     """
-    global cache
+    cache = get_cache()
     #check if the last tweet is in the cache
     #if not, fetch it
     #caching would create the possibility that the tweet displayed
     #is not the last tweet, but given small enough values CACHE_TIMEOUT,
     #this problem would be a decent sacrifice for performance
-    if not "tweet" in cache:
-        #fetch last tweet
-        tweet = get_raw_tweet()
+    entry = cache.get("tweet_entry:" + account)
+    if entry is None:
+        try:
+            tweet = poll_classified_tweet(account)
+            timeout = CACHE_TIMEOUT
+        except SchedulerTimeout:
+            #Twitter is slow, or the rate limit is used up; serve the
+            #latest tweet for now rather than keep the request waiting
+            tweet = cache.get("latest:" + account)
+            if tweet is None:
+                raise
+            timeout = FALLBACK_CACHE_TIMEOUT
+        if tweet is None:
+            return None, None
+
+        #save tweet to the cache, with its expiry time so that what is
+        #derived from it expires with it (see seconds_left)
+        entry = {"tweet": tweet, "expires": time.time() + timeout}
+        cache.set("tweet_entry:" + account, entry, time=timeout)
+
+    return entry["tweet"], entry["expires"]
+
+
+def seconds_left(expires):
+    """
+    whole seconds until an expiry time, at least 0
+    """
+    return max(0, int(expires - time.time()))
+
 
-        #load classifier and featureset
-        classifier = load_classifier()
-        tf = load_featureset()
+def poll_classified_tweet(account):
+    """
+    poll an account for new tweets and return the latest one, classified,
+    or None if the account has no tweets
+    raises SchedulerTimeout if Twitter doesn't answer in time
+    """
+    cache = get_cache()
+    #fetch and classify every tweet posted since the last poll
+    new_tweets = get_poller().poll(account)
+    tweet = None
+    if not new_tweets:
+        tweet = cache.get("latest:" + account)
+        if tweet is None:
+            #the latest tweet was evicted; fetch it again
+            get_poller().reset(account)
+            new_tweets = get_poller().poll(account)
+
+    if new_tweets:
+        tweet = new_tweets[-1]
+    elif tweet is None:
+        return None
+    #get HTML display of a new tweet, or of the latest one if that
+    #timed out before
+    if new_tweets or tweet.get("html") is None:
+        tweet["html"] = get_tweet_display(tweet["id"], account)
+        #the latest classified tweet never expires;
+        #it is served whenever a poll finds no new tweets
+        cache.set("latest:" + account, tweet)
+
+    return tweet
+
+
+def build_api_payload(tweet):
+    """
+    serialize the classification of a tweet for the JSON API once,
+    in every supported encoding
+    """
+    body = json.dumps({
+        #ids are strings because they don't fit in a JavaScript number
+        "id": str(tweet["id"]),
+        "label": "political" if tweet["political"] else "apolitical",
+        "probability": tweet.get("probability"),
+        "retweet": tweet.get("retweet", False),
+        "model_version": tweet.get("model_version")
+    }, separators=(",", ":"), sort_keys=True)
 
-        #classify tweet
-        tweet_features = tf.build_featureset([tweet])[0]
-        tweet["political"] = classifier.classify(tweet_features)
+    gzip = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
 
-        #get HTML display of tweet
-        tweet["html"] = get_tweet_display(tweet["id"])
+    return {
+        "etag": hashlib.sha1(body).hexdigest(),
+        "last_modified": tweet_timestamp(tweet),
+        "identity": body,
+        "gzip": gzip.compress(body) + gzip.flush(),
+        "deflate": zlib.compress(body, 9)
+    }
 
-        #save tweet to the cache
-        cache.set("tweet", tweet, time=CACHE_TIMEOUT)
 
-        return tweet
-    #if the tweet is in the cache, serve that
-    else:
-        return cache.get("tweet")
+def get_api_payload(account):
+    """
+    return the serialized classification of an account's latest tweet,
+    or None if the account has no tweets
+    the payload expires with the cached tweet it was built from
+    """
+    cache = get_cache()
+    payload = cache.get("api:" + account)
+    if payload is None:
+        tweet, expires = get_classified_tweet(account)
+        if tweet is None:
+            return None
+        payload = build_api_payload(tweet)
+        payload["expires"] = expires
+        #a timeout of 0 would never expire
+        if seconds_left(expires) > 0:
+            cache.set("api:" + account, payload, time=seconds_left(expires))
+
+    return payload
+
+
+#with preloading enabled, this module is imported by the gunicorn master
+#before it forks workers (see gunicorn_config.py)
+if preload_enabled():
+    preload_model()
+
+
+def page_etag(tweet):
+    """
+    strong ETag of the index page of a tweet: the page only changes
+    when the tweet, the model that classified it, the template, or whether
+    the tweet's oEmbed HTML could be fetched changes
+    """
+    return hashlib.sha1("%s:%s:%s:%s" % (
+        tweet["id"], tweet.get("model_version"), PAGE_VERSION,
+        tweet.get("html") is not None)).hexdigest()
+
+
+def render_index(tweet, etag):
+    """
+    return the rendered index page of a tweet, from the cache if possible
+    """
+    if not app.config["PAGE_CACHE"]:
+        return render_template("index.html", tweet=tweet)
+
+    cache = get_cache()
+    key = "page:" + etag
+    page = cache.get(key)
+    if page is None:
+        page = render_template("index.html", tweet=tweet)
+        cache.set(key, page, time=PAGE_CACHE_TIMEOUT)
+
+    return page
 
 
 @app.route("/")
 def index():
     #fetch classified tweet
-    tweet = get_classified_tweet()
+    tweet, expires = get_classified_tweet()
+    if tweet is None:
+        abort(404)
+    etag = page_etag(tweet)
+
+    #answer conditional requests for an unchanged page without rendering it
+    if etag in request.if_none_match:
+        response = make_response("", 304)
+    else:
+        response = make_response(render_index(tweet, etag))
+
+    response.set_etag(etag)
+    response.last_modified = tweet_timestamp(tweet)
+    #let browsers and CDNs reuse the page as long as the tweet is cached
+    response.cache_control.public = True
+    response.cache_control.max_age = seconds_left(expires)
+
+    return response
+
+
+@app.route("/api/latest")
+@app.route("/api/latest/<account>")
+def api_latest(account=TWITTER_USER):
+    """
+    the latest tweet of an account and its classification as compact JSON
+    """
+    if not account in TWITTER_ACCOUNTS:
+        abort(404)
+
+    payload = get_api_payload(account)
+    if payload is None:
+        abort(404)
+
+    if payload["etag"] in request.if_none_match:
+        response = make_response("", 304)
+    else:
+        #pick the client's preferred encoding among the precomputed ones
+        encoding = "identity"
+        quality = 0
+        for candidate in ("gzip", "deflate"):
+            if request.accept_encodings[candidate] > quality:
+                encoding = candidate
+                quality = request.accept_encodings[candidate]
+
+        response = make_response(payload[encoding])
+        response.mimetype = "application/json"
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+
+    response.set_etag(payload["etag"])
+    response.last_modified = payload["last_modified"]
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.max_age = seconds_left(payload["expires"])
+
+    return response
+
+
+@app.route("/models")
+def models():
+    """
+    the model versions in use and how the shadow model compares
+    """
+    return jsonify(current=get_model().version, shadow=shadow_scorer.report())
+
+
+@app.route("/cache")
+def cache_stats():
+    """
+    size and encode/decode time of this worker's cache entries, per kind
+    """
+    client = get_cache()
+    if not isinstance(client, CodecCache):
+        return jsonify(codec=None)
+
+    return jsonify(codec=CACHE_CODEC, entries=client.report())
+
+
+def check_admin():
+    """
+    abort unless the request carries the admin token
+    """
+    if not ADMIN_TOKEN:
+        abort(404)
+
+    token = request.headers.get("X-Admin-Token", "")
+    if isinstance(token, unicode):
+        token = token.encode("utf-8")
+    if not hmac.compare_digest(token, ADMIN_TOKEN):
+        abort(403)
+
+
+@app.route("/admin/profile", methods=["POST"])
+def admin_start_profile():
+    """
+    profile this worker for ?seconds= in the background
+    the profile can be fetched from any worker once it is finished
+    """
+    check_admin()
+    seconds = request.args.get("seconds", sampling_profiler.DEFAULT_SECONDS,
+        type=float)
+    interval = request.args.get("interval", sampling_profiler.DEFAULT_INTERVAL,
+        type=float)
+    if not 0 < seconds <= PROFILE_MAX_SECONDS or interval <= 0:
+        abort(400)
+
+    name = sampling_profiler.start_profile(PROFILE_DIR, seconds, interval)
+    if name is None:
+        return jsonify(error="this worker is already being profiled"), 409
+
+    return jsonify(profile=name, pid=os.getpid(), seconds=seconds), 202
+
+
+@app.route("/admin/profile")
+def admin_profiles():
+    """
+    the finished profiles, newest first
+    """
+    check_admin()
+
+    return jsonify(profiles=[
+        {"name": name, "bytes": size, "finished": int(mtime)}
+        for name, size, mtime in sampling_profiler.list_profiles(PROFILE_DIR)
+    ])
+
+
+@app.route("/admin/profile/<name>")
+def admin_profile(name):
+    """
+    the collapsed stacks of a profile, for flamegraph.pl or speedscope
+    """
+    check_admin()
+    stacks = sampling_profiler.read_profile(PROFILE_DIR, name)
+    if stacks is None:
+        abort(404)
+
+    response = make_response(stacks)
+    response.mimetype = "text/plain"
+
+    return response
+
+
+@app.route("/history")
+def tweet_history():
+    """
+    classified tweets, newest first, a page at a time
+    pass the returned "next" value as ?before= to get the next page
+    """
+    account = request.args.get("account", TWITTER_USER)
+    before = request.args.get("before", None, type=int)
+    limit = request.args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+
+    tweets, cursor = get_history().page(account, before, limit)
 
-    return render_template("index.html", tweet=tweet)
+    return jsonify(tweets=tweets, next=cursor)
 
 
 if __name__ == "__main__":
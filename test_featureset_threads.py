@@ -0,0 +1,109 @@
+# test_featureset_threads.py
+# check that one featureset can featurize tweets from many threads at once
+# (see tweet_featureset.py)
+
+# every thread featurizes shuffled batches of the same tweets, including
+# tweets that have no tokens left after cleanup; the rows must equal those
+# of a single-threaded run and the tweets must come back unchanged
+
+# usage:
+# python -m unittest test_featureset_threads
+
+import copy
+import random
+import shutil
+import tempfile
+import unittest
+import threading
+from itertools import islice
+
+from tweet_io import iter_tweets
+from tweet_featureset import TweetFeatureset
+import preprocess_cache
+
+
+SOURCE = "rms_tweets.txt"
+TWEETS = 600
+
+#tweets with no tokens left after cleanup
+EMPTY_TEXTS = ["@steveklabnik http://t.co/abc", "RT @steveklabnik: ...", "a b c"]
+
+THREADS = 8
+BATCHES = 10
+BATCH_SIZE = 100
+
+
+class FeaturesetThreadsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tweets = list(islice(iter_tweets(SOURCE), TWEETS))
+        cls.tweets.extend({"id": -i, "text": text, "political": False}
+            for i, text in enumerate(EMPTY_TEXTS, 1))
+        cls.featureset = TweetFeatureset(cls.tweets)
+
+
+    def setUp(self):
+        self.original = copy.deepcopy(self.tweets)
+        self.expected = dict(zip((tweet["id"] for tweet in self.tweets),
+            self.featureset.build_featureset(self.tweets)))
+
+
+    def tearDown(self):
+        preprocess_cache.enable(None)
+
+
+    def featurize_in_threads(self):
+        """
+        (tweet id, row) pairs of every batch featurized by every thread,
+        and the exceptions raised by the threads
+        """
+        results = []
+        errors = []
+
+        def featurize(seed):
+            generator = random.Random(seed)
+            try:
+                for i in xrange(BATCHES):
+                    batch = generator.sample(self.tweets, BATCH_SIZE)
+                    rows = self.featureset.build_featureset(batch)
+                    self.assertEqual(len(rows), len(batch))
+                    results.extend(zip((tweet["id"] for tweet in batch), rows))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=featurize, args=(seed,))
+            for seed in xrange(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results, errors
+
+
+    def check_threads(self):
+        results, errors = self.featurize_in_threads()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), THREADS * BATCHES * BATCH_SIZE)
+        for tweet_id, row in results:
+            self.assertEqual(row, self.expected[tweet_id])
+        self.assertEqual(self.tweets, self.original)
+
+
+    def test_threads_match_single_thread(self):
+        self.check_threads()
+
+
+    def test_threads_match_single_thread_with_preprocess_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            preprocess_cache.enable(directory + "/preprocess.db")
+            self.check_threads()
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
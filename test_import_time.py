@@ -0,0 +1,62 @@
+# test_import_time.py
+# check that the webapp module stays fast to import (see import_profile.py)
+
+# every import is timed in a fresh interpreter, since a module is only
+# imported once per process
+
+# usage:
+# python -m unittest test_import_time
+
+import sys
+import json
+import unittest
+import subprocess
+
+
+#seconds importing the webapp may take; about 0.33s at the time of writing
+IMPORT_BUDGET = 1.0
+
+#modules that are imported on first use, never by importing the webapp
+LAZY_MODULES = ["nltk", "twitter", "pylibmc"]
+
+MODULE = "steveklabnik_politics"
+
+
+def profile_in_subprocess(module_name):
+    """
+    (seconds, names of the loaded modules) of importing a module
+    in a fresh interpreter
+    """
+    script = (
+        "import sys, json\n"
+        "from import_profile import profile_import\n"
+        "total, records = profile_import(%r)\n"
+        "print json.dumps([total, sorted(sys.modules)])\n" % module_name
+    )
+    output = subprocess.check_output([sys.executable, "-c", script])
+
+    return json.loads(output.splitlines()[-1])
+
+
+class ImportTimeTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.seconds, cls.modules = profile_in_subprocess(MODULE)
+
+
+    def test_within_budget(self):
+        self.assertLessEqual(self.seconds, IMPORT_BUDGET,
+            "import {0} took {1:.3f}s, over the {2:.3f}s budget; "
+            "see python import_profile.py {0}".format(
+                MODULE, self.seconds, IMPORT_BUDGET))
+
+
+    def test_lazy_modules_not_imported(self):
+        for name in LAZY_MODULES:
+            self.assertNotIn(name, self.modules,
+                "import {0} imported {1}".format(MODULE, name))
+
+
+if __name__ == "__main__":
+    unittest.main()
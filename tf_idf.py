@@ -5,10 +5,16 @@
 # for convenience, the functions below assume the following:
 # a "document" is a list of tokens
 # a "corpus" is a list of documents (a list of lists of tokens)
+# terms can be any hashable value, so a document can also be an array of
+# integer token ids and a corpus a vocabulary.TokenCorpus
 
 #allows for integer division that returns rational numbers, not rounded integers
 from __future__ import division
 import math
+import json
+from array import array
+from bisect import bisect_left
+from collections import Counter
 
 
 class IdfDict(dict):
@@ -29,6 +35,53 @@ class IdfDict(dict):
             return super(IdfDict, self).__getitem__(key)
 
 
+class FrozenIdf(object):
+    """
+    read-only, array-backed copy of an IdfDict
+
+    idf values live in two flat arrays (sorted term hashes and scores)
+    instead of one dict entry and one float object per term,
+    so lookups don't touch per-term objects; after a fork, the pages
+    holding the arrays stay shared between processes
+    term hashes are process-specific, so a FrozenIdf is built at load time
+    from an IdfDict and is never pickled; terms with the same hash would
+    take each other's score, so an IdfDict with such terms can't be frozen
+    """
+
+    def __init__(self, idf_set):
+        self.corpus_size = idf_set.corpus_size
+        self.default = math.log(self.corpus_size)
+        items = sorted((hash(term), score) for term, score in idf_set.iteritems())
+        if len(set(term_hash for term_hash, score in items)) < len(items):
+            raise ValueError("terms with the same hash")
+        self.hashes = array("l", [term_hash for term_hash, score in items])
+        self.scores = array("d", [score for term_hash, score in items])
+
+
+    def __len__(self):
+        return len(self.hashes)
+
+
+    def __contains__(self, key):
+        term_hash = hash(key)
+        i = bisect_left(self.hashes, term_hash)
+        return i < len(self.hashes) and self.hashes[i] == term_hash
+
+
+    def __getitem__(self, key):
+        #if a term is not in the arrays, calculate an idf value anyway
+        term_hash = hash(key)
+        i = bisect_left(self.hashes, term_hash)
+        if i < len(self.hashes) and self.hashes[i] == term_hash:
+            return self.scores[i]
+        else:
+            return self.default
+
+
+    def __reduce__(self):
+        raise TypeError("FrozenIdf cannot be pickled; pickle the IdfDict")
+
+
 def tf_raw(term, document):
     return document.count(term)
 
@@ -41,6 +94,10 @@ def tf_log(term, document):
     return math.log(document.count(term))
 
 
+def tf_aug(term, document):
+    return document.count(term) / max(Counter(document).itervalues())
+
+
 def tf(term, document, algorithm="RAW"):
     """
     Calculates the frequency of a term within a document
@@ -55,7 +112,8 @@ def tf(term, document, algorithm="RAW"):
     in the document
         -i.e., this prevents bias towards longer documents
 
-    NOTE: only RAW, BOOL, and LOG are implemented at the moment
+    to score every term of a document, count the document once with
+    term_counts and use tf_scores instead of calling tf for each term
     """
 
     if algorithm == "RAW":
@@ -64,6 +122,38 @@ def tf(term, document, algorithm="RAW"):
         return tf_bool(term, document)
     elif algorithm == "LOG":
         return tf_log(term, document)
+    elif algorithm == "AUG":
+        return tf_aug(term, document)
+    else:
+        raise ValueError("tf cannot use algorithm %s" % algorithm)
+
+
+def term_counts(document):
+    """
+    raw frequency of every term in a document, counted in one pass
+    """
+    return Counter(document)
+
+
+def tf_scores(counts, algorithm="RAW"):
+    """
+    calculates the frequency of every term of a document from its term counts
+    (see tf for the algorithms)
+    """
+    if algorithm == "RAW":
+        return dict(counts)
+    elif algorithm == "BOOL":
+        return dict.fromkeys(counts, 1)
+    elif algorithm == "LOG":
+        log = math.log
+        return dict((term, log(count)) for term, count in counts.iteritems())
+    elif algorithm == "AUG":
+        if not counts:
+            return {}
+        max_count = max(counts.itervalues())
+        return dict(
+            (term, count / max_count) for term, count in counts.iteritems()
+        )
     else:
         raise ValueError("tf cannot use algorithm %s" % algorithm)
 
@@ -99,23 +189,113 @@ def tf_idf(term, document, corpus, algorithm="RAW"):
         return tf(term, document, algorithm) * idf(term, corpus)
 
 
-def idf_corpus(corpus):
+class DfCounts(object):
     """
-    calculates idf score for all terms in a corpus
+    document frequency counts of a corpus (or of one shard of a corpus)
+    partial counts of any number of shards can be merged,
+    so idf scores can be computed in a map step (count each shard)
+    and a reduce step (merge the counts)
     """
 
-    #build idf score for all terms in the corpus
-    #first, build a vocab of the corpus
-    vocab = set()
+    def __init__(self, counts=None, corpus_size=0):
+        #term -> number of documents the term occurs in
+        self.counts = counts if counts is not None else {}
+        self.corpus_size = corpus_size
+
+
+    def add(self, document):
+        """
+        count the terms of one document
+        """
+        counts = self.counts
+        for term in set(document):
+            counts[term] = counts.get(term, 0) + 1
+        self.corpus_size += 1
+
+
+    def update(self, other):
+        """
+        merge the counts of another shard into these counts
+        """
+        counts = self.counts
+        for term, count in other.counts.iteritems():
+            counts[term] = counts.get(term, 0) + count
+        self.corpus_size += other.corpus_size
+
+
+    def prune(self, min_count, select=None):
+        """
+        drop the terms that occur in fewer than min_count documents
+        (only the terms select(term) is true for, if select is given)
+        """
+        counts = self.counts
+        for term, count in counts.items():
+            if count < min_count and (select is None or select(term)):
+                del counts[term]
+
+
+    def idf(self):
+        """
+        return the idf scores of the counted corpus
+        """
+        #same formula as idf()
+        idf_set = IdfDict(self.corpus_size)
+        for term, count in self.counts.iteritems():
+            idf_set[term] = math.log( self.corpus_size / (count+1) )
+
+        return idf_set
+
+
+    def save(self, path):
+        #store terms and counts as pairs so that non-string terms
+        #(e.g. token ids) keep their type
+        with open(path, "w") as f:
+            json.dump({
+                "corpus_size": self.corpus_size,
+                "counts": list(self.counts.iteritems())
+            }, f)
+
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            data = json.load(f)
+
+        return cls(dict(data["counts"]), data["corpus_size"])
+
+
+def document_frequencies(corpus):
+    """
+    map step: count the documents each term of a corpus occurs in
+    """
+    df = DfCounts()
     for document in corpus:
-        vocab |= set(document)
+        df.add(document)
+
+    return df
 
-    #then, calculate the idf for each term in the vocab
-    idf_set = IdfDict(len(corpus))
-    for term in vocab:
-        idf_set[term] = idf(term, corpus)
 
-    return idf_set
+def merge_document_frequencies(partials):
+    """
+    reduce step: merge partial counts (DfCounts or paths of saved DfCounts)
+    and return the idf scores of the whole corpus
+    """
+    df = DfCounts()
+    for partial in partials:
+        if not isinstance(partial, DfCounts):
+            partial = DfCounts.load(partial)
+        df.update(partial)
+
+    return df.idf()
+
+
+def idf_corpus(corpus):
+    """
+    calculates idf score for all terms in a corpus
+    """
+    #count the documents each term occurs in, in a single pass over the corpus
+    #(the corpus only needs to support iteration)
+    return document_frequencies(corpus).idf()
 
 
 def tf_idf_corpus(corpus, algorithm="RAW", idf_set=None):
@@ -129,13 +309,11 @@ def tf_idf_corpus(corpus, algorithm="RAW", idf_set=None):
     #calculate tf-idf score for every document
     doc_set = []
     for document in corpus:
-        doc_vocab = set(document)
-        tf_idf_set = {}
-        #calculate tf and then tf-idf score for every term
-        for term in doc_vocab:
-            tf_score = tf(term, document, algorithm)
-            tf_idf_set[term] = tf_idf(term, document, idf_set[term], algorithm)
-
-        doc_set.append(tf_idf_set)
+        #count the document once, then calculate tf and tf-idf for every term
+        tf_set = tf_scores(term_counts(document), algorithm)
+        doc_set.append(dict(
+            (term, tf_score * idf_set[term])
+            for term, tf_score in tf_set.iteritems()
+        ))
 
     return doc_set
\ No newline at end of file
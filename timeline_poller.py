@@ -0,0 +1,213 @@
+# timeline_poller.py
+# fetch and classify every new tweet of an account since the last poll
+
+# the id of the newest tweet seen so far (since_id) is kept per account,
+# so every poll asks Twitter only for tweets posted after it,
+# paging back with max_id until a page comes back empty (a page can be
+# short and still not be the last one: Twitter drops deleted and withheld
+# tweets after applying count)
+# polls run on the request path, so their work is bounded: without a
+# since_id only the latest cold_start_count tweets are fetched, and at
+# most max_pages pages are; when there are more new tweets than that, the
+# older ones are skipped, and the skipped range is logged and recorded
+# (see gaps) so that it can be backfilled
+# new tweets are classified in batches, oldest first, and since_id is
+# advanced after each batch is stored, so an interrupted poll resumes
+# where it stopped
+# with a history store (see history_store.py), tweets that are already
+# stored are taken from it instead of being classified again
+# with a shadow scorer (see model_registry.py), every classified batch is
+# also queued to be scored by the shadow model
+
+import time
+import logging
+
+from active_learning import batch_prob_classify
+
+
+#max number of tweets per user_timeline request allowed by Twitter
+PAGE_SIZE = 200
+
+#max number of pages fetched in one poll
+MAX_PAGES = 16
+
+#number of tweets fetched by a poll without a since_id
+COLD_START_COUNT = 20
+
+#number of skipped ranges kept per account (see TimelinePoller.gaps)
+MAX_GAPS = 100
+
+#number of tweets featurized and classified at a time
+CLASSIFY_BATCH_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+
+def status_to_tweet(status):
+    """
+    convert a python-twitter Status into a tweet dictionary
+    """
+    return {
+        "id": status.id,
+        "text": status.text,
+        "created_at": status.created_at,
+        "retweet": status.retweeted_status != None
+    }
+
+
+def classify_tweets(tweets, model, shadow=None):
+    """
+    classify a batch of tweets with a model (classifier, featureset, version)
+    returns new tweet dictionaries with "political", "probability"
+    and "model_version" set
+    """
+    start = time.time()
+    featuresets = model.featureset.build_featureset(tweets)
+    prob_dists = batch_prob_classify(model.classifier, featuresets)
+
+    classified = []
+    for tweet, prob_dist in zip(tweets, prob_dists):
+        political = prob_dist.max()
+        classified.append(dict(tweet,
+            political=political,
+            probability=prob_dist.prob(political),
+            model_version=model.version
+        ))
+
+    if shadow is not None:
+        shadow.submit(model, tweets, featuresets,
+            [tweet["political"] for tweet in classified], time.time() - start)
+
+    return classified
+
+
+class TimelinePoller(object):
+    """
+    TimelinePoller class
+    incremental, batched fetching and classification of user timelines
+    """
+
+    def __init__(self, api, get_model, state, sink=None, history=None,
+        shadow=None, batch_size=CLASSIFY_BATCH_SIZE, max_pages=MAX_PAGES,
+        cold_start_count=COLD_START_COUNT):
+        if max_pages < 1:
+            raise ValueError("max_pages must be at least 1, not %r" % max_pages)
+        #python-twitter Api
+        self.api = api
+        #returns the current model (classifier, featureset, version)
+        self.get_model = get_model
+        #dict-like store of since ids with get/set (e.g. the memcached client)
+        self.state = state
+        #called with (account, classified tweets) after every batch
+        self.sink = sink
+        #HistoryStore that classified tweets are stored in and looked up from
+        self.history = history
+        #ShadowScorer that classified batches are also queued for
+        self.shadow = shadow
+        self.batch_size = batch_size
+        self.max_pages = max_pages
+        self.cold_start_count = cold_start_count
+
+
+    def since_id_key(self, account):
+        return "since_id:%s" % account
+
+
+    def gaps_key(self, account):
+        return "gaps:%s" % account
+
+
+    def gaps(self, account):
+        """
+        [after id, before id] ranges of tweets that polls skipped,
+        oldest first; neither id is part of the range
+        """
+        return self.state.get(self.gaps_key(account)) or []
+
+
+    def record_gap(self, account, after_id, before_id):
+        logger.warning("poll of %s skipped the tweets between %s and %s",
+            account, after_id, before_id)
+        gaps = self.gaps(account)
+        gaps.append([after_id, before_id])
+        self.state.set(self.gaps_key(account), gaps[-MAX_GAPS:])
+
+
+    def get_since_id(self, account):
+        return self.state.get(self.since_id_key(account))
+
+
+    def reset(self, account):
+        """
+        forget the since_id of an account; the next poll fetches
+        only the latest tweets
+        """
+        self.state.set(self.since_id_key(account), None)
+
+
+    def fetch_new(self, account):
+        """
+        fetch the tweets posted since the last poll, oldest first
+        without a since_id, only the latest cold_start_count are fetched
+        """
+        since_id = self.get_since_id(account)
+        count = PAGE_SIZE if since_id is not None else self.cold_start_count
+        tweets = []
+        max_id = None
+
+        for page in xrange(self.max_pages):
+            statuses = self.api.GetUserTimeline(
+                screen_name=account,
+                since_id=since_id,
+                max_id=max_id,
+                count=count,
+                trim_user=True
+            )
+            tweets.extend(status_to_tweet(status) for status in statuses)
+
+            #only an empty page is the last one
+            if since_id is None or not statuses:
+                break
+            #max_id is inclusive, so continue just below the oldest tweet
+            max_id = min(status.id for status in statuses) - 1
+        else:
+            #no page was empty; the tweets older than the last page, if
+            #any, are skipped when since_id moves past them
+            self.record_gap(account, since_id, max_id + 1)
+
+        tweets.sort(key=lambda tweet: tweet["id"])
+
+        return tweets
+
+
+    def poll(self, account):
+        """
+        fetch, classify and store the new tweets of an account
+        returns the classified tweets, oldest first
+        """
+        tweets = self.fetch_new(account)
+        classified = []
+
+        for start in xrange(0, len(tweets), self.batch_size):
+            batch = tweets[start:start + self.batch_size]
+            stored = {}
+            if self.history is not None:
+                stored = self.history.lookup(tweet["id"] for tweet in batch)
+
+            #only classify the tweets that aren't stored yet
+            unseen = [tweet for tweet in batch if not tweet["id"] in stored]
+            if unseen:
+                classified_unseen = classify_tweets(unseen, self.get_model(),
+                    self.shadow)
+                if self.history is not None:
+                    self.history.add_many(account, classified_unseen)
+                stored.update(
+                    (tweet["id"], tweet) for tweet in classified_unseen)
+            batch = [stored[tweet["id"]] for tweet in batch]
+
+            if self.sink is not None:
+                self.sink(account, batch)
+            self.state.set(self.since_id_key(account), batch[-1]["id"])
+            classified.extend(batch)
+
+        return classified
@@ -0,0 +1,96 @@
+# train_classifier.py
+# train the featureset builder and the classifier used by the webapp
+
+# tweets are preprocessed once into a corpus store (see corpus_store.py);
+# later runs reuse the store until a source file or the preprocessing changes
+
+import sys
+import pickle
+import argparse
+
+from nltk import NaiveBayesClassifier
+from nltk.classify import accuracy
+
+from corpus_store import CorpusStore
+import preprocess_cache
+from tweet_featureset import TweetFeatureset
+
+
+def train(corpus, pos_filter=False, ngrams=1, min_df=2, hash_buckets=None):
+    """
+    train a featureset builder and a classifier on a labeled corpus view
+    """
+    featureset = TweetFeatureset.from_token_corpus(corpus, pos_filter,
+        ngrams, min_df, hash_buckets)
+    tagged_features = zip(
+        featureset.build_token_featureset(corpus),
+        corpus.political()
+    )
+    classifier = NaiveBayesClassifier.train(tagged_features)
+
+    return featureset, classifier
+
+
+def cross_validate(corpus, folds, pos_filter=False, ngrams=1, min_df=2,
+    hash_buckets=None):
+    """
+    return the accuracy of each of k folds
+    """
+    scores = []
+    for train_corpus, test_corpus in corpus.folds(folds):
+        featureset, classifier = train(train_corpus, pos_filter,
+            ngrams, min_df, hash_buckets)
+        test_features = zip(
+            featureset.build_token_featureset(test_corpus),
+            test_corpus.political()
+        )
+        scores.append(accuracy(classifier, test_features))
+
+    return scores
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="train the tweet classifier")
+    parser.add_argument("sources", nargs="+", help="labeled tweet files")
+    parser.add_argument("--store", default="corpus_store",
+        help="directory of the preprocessed corpus store")
+    parser.add_argument("--pos-filter", action="store_true")
+    parser.add_argument("--ngrams", type=int, default=1,
+        help="use n-grams of up to this many tokens as features")
+    parser.add_argument("--min-df", type=int, default=2,
+        help="drop n-grams that occur in fewer tweets")
+    parser.add_argument("--hash-buckets", type=int, default=None,
+        help="hash n-grams into this many features instead of dropping rare ones")
+    parser.add_argument("--preprocess-cache", default=None,
+        help="SQLite cache of tokenized tweets (see preprocess_cache.py)")
+    parser.add_argument("--folds", type=int, default=0,
+        help="report k-fold cross-validation accuracy first")
+    parser.add_argument("--classifier", default="classifier.txt")
+    parser.add_argument("--featureset", default="featureset.txt")
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    preprocess_cache.enable(args.preprocess_cache)
+
+    store = CorpusStore.open(args.store, args.sources, args.pos_filter)
+    corpus = store.labeled()
+    print "{0} labeled tweets".format(len(corpus))
+
+    if args.folds > 1:
+        scores = cross_validate(corpus, args.folds, args.pos_filter,
+            args.ngrams, args.min_df, args.hash_buckets)
+        print "cross-validation accuracy: {0:.3f} ({1})".format(
+            sum(scores) / len(scores),
+            ", ".join("%.3f" % score for score in scores)
+        )
+
+    featureset, classifier = train(corpus, args.pos_filter,
+        args.ngrams, args.min_df, args.hash_buckets)
+    print "{0} features".format(len(featureset.idf_set))
+    with open(args.featureset, "wb") as f:
+        pickle.dump(featureset, f)
+    with open(args.classifier, "wb") as f:
+        pickle.dump(classifier, f)
@@ -7,10 +7,30 @@
 # -text
 # -political (Boolean; answers whether a tweet is political or not)
 
-from nltk.tokenize import WhitespaceTokenizer
+# features are the tokens of a tweet and, optionally, the n-grams of its
+# tokens (e.g. "single payer"), which are generated from each tweet's
+# tokens as it is counted or featurized; tokenized tweets and token
+# corpora only ever hold the tokens
+# to keep the number of features bounded, n-grams that occur in fewer than
+# min_df training tweets are dropped, or n-grams are hashed into a fixed
+# number of features
 
-from tweet_preprocess import cleanup_text, cleanup_tokens
-from tf_idf import tf, idf_corpus, tf_idf_corpus
+# featurizing never modifies the tweets passed in: tokenizing returns
+# copies (with the tokens as tuples) and build_featureset returns new
+# feature dictionaries, one per tweet, in order
+# a trained featureset can be shared by the threads of a threaded gunicorn
+# worker: building featuresets only reads idf_set, the tokenizer is
+# stateless, the POS tag cache is locked and the preprocessing cache opens
+# a connection per thread; the exception is ingest, which updates idf_set
+# and must not run while other threads featurize with the same featureset
+# (test_featureset_threads.py checks this)
+
+from tweet_preprocess import cleanup_text, cleanup_token_corpus, ngram_tokens, \
+    is_ngram
+from tf_idf import tf, idf_corpus, tf_idf_corpus, document_frequencies
+from vocabulary import TokenCorpus
+from idf_sketch import SketchIdf, DEFAULT_WIDTH, DEFAULT_DEPTH
+from windowed_idf import WindowedIdf, DEFAULT_WINDOW, DEFAULT_BUCKET_SIZE
 
 
 class TweetFeatureset(object):
@@ -19,48 +39,233 @@ class TweetFeatureset(object):
     creates featuresets for tweets
     """
 
-    tokenizer = WhitespaceTokenizer()
+    #NLTK whitespace tokenizer, created on first use (see get_tokenizer)
+    #so that importing this module doesn't import nltk
+    tokenizer = None
+
+    #remove tokens that aren't nouns, verbs or adjectives;
+    #a class attribute so that pickled featuresets default to off
+    pos_filter = False
+
+    #number of tweets tokenized at a time when building a token corpus
+    chunk_size = 5000
+
+    #PreprocessCache that tokenized tweets are read from and written to
+    #(see preprocess_cache.py); shared by all featuresets, off by default
+    preprocess_cache = None
 
+    #longest n-grams used as features (1: tokens only), n-grams
+    #in fewer training tweets than min_df are dropped, and with
+    #hash_buckets, n-grams are hashed into that many features instead;
+    #class attributes so that pickled featuresets default to tokens only
+    ngrams = 1
+    min_df = 2
+    hash_buckets = None
+    #set when training dropped rare n-grams; featurizing then ignores
+    #the n-grams that aren't in idf_set
+    ngram_pruned = False
 
-    def __init__(self, corpus):
+
+    def __init__(self, corpus, pos_filter=False, ngrams=1, min_df=2,
+        hash_buckets=None):
+        self.pos_filter = pos_filter
+        self.ngrams = ngrams
+        self.min_df = min_df
+        self.hash_buckets = hash_buckets
         self.train(corpus)
 
 
     @classmethod
-    def tokenize_tweet(cls, tweet):
+    def get_tokenizer(cls):
+        if TweetFeatureset.tokenizer is None:
+            from nltk.tokenize import WhitespaceTokenizer
+            TweetFeatureset.tokenizer = WhitespaceTokenizer()
+
+        return TweetFeatureset.tokenizer
+
+
+    @classmethod
+    def tokenize_texts(cls, texts, pos_filter=False):
         """
-        tokenize a single tweet
+        return the (cleaned up text, tokens) of every raw text, in order,
+        with the tokens as a tuple
         """
-        #cleanup tweets
-        tweet["text"] = cleanup_text(tweet["text"])
-        #tokenize tweets using NLTK word tokenizer
-        #use the whitespace tokenizer to preserve contractions,
-        #which will be expanded during tokenization processing
-        tweet["tokens"] = cls.tokenizer.tokenize(tweet["text"])
-        #clean up tokenized tweets
-        tweet["tokens"] = cleanup_tokens(tweet["tokens"])
+        texts = list(texts)
+        cache = TweetFeatureset.preprocess_cache
+        if cache is not None:
+            #take the texts that were tokenized before from the cache
+            results = cache.lookup(texts, pos_filter)
+        else:
+            results = [None] * len(texts)
+        misses = [i for i, result in enumerate(results) if result is None]
+
+        #cleanup texts, then tokenize them using the NLTK whitespace tokenizer
+        #to preserve contractions, which will be expanded during
+        #tokenization processing
+        cleaned = [cleanup_text(texts[i]) for i in misses]
+        tokenizer = cls.get_tokenizer()
+        #clean up the tokens of all texts at once,
+        #so that POS tagging can be batched
+        token_corpus = cleanup_token_corpus(
+            [tokenizer.tokenize(text) for text in cleaned], pos_filter
+        )
+        for i, text, tokens in zip(misses, cleaned, token_corpus):
+            results[i] = (text, tokens)
 
-        return tweet
+        if cache is not None and misses:
+            cache.add_many([
+                (texts[i], results[i][0], results[i][1]) for i in misses
+            ], pos_filter)
+
+        return [(text, tuple(tokens)) for text, tokens in results]
 
 
     @classmethod
-    def tokenize_corpus(cls, corpus):
+    def tokenize_tweet(cls, tweet, pos_filter=False):
         """
-        return a tweet corpus in tokenized form
+        return a tokenized copy of a single tweet
         """
-        corpus = [TweetFeatureset.tokenize_tweet(tweet) for tweet in corpus]
+        text, tokens = cls.tokenize_texts([tweet["text"]], pos_filter)[0]
+
+        return dict(tweet, text=text, tokens=tokens)
+
+
+    @classmethod
+    def tokenize_corpus(cls, corpus, pos_filter=False):
+        """
+        return tokenized copies of the non-empty tweets of a corpus
+        """
+        tokenized = cls.tokenize_texts(
+            [tweet["text"] for tweet in corpus], pos_filter)
 
         #remove empty tweets from corpus
-        return [tweet for tweet in corpus if len(tweet["tokens"]) > 0]
+        return [
+            dict(tweet, text=text, tokens=tokens)
+            for tweet, (text, tokens) in zip(corpus, tokenized)
+            if len(tokens) > 0
+        ]
+
+
+    def iter_tokenized(self, tweets):
+        """
+        lazily yield tokenized copies of the non-empty tweets of a corpus
+        tweets are tokenized a chunk at a time,
+        so only one chunk of token lists exists at any time
+        """
+        chunk = []
+        for tweet in tweets:
+            chunk.append(tweet)
+            if len(chunk) >= self.chunk_size:
+                for tokenized in TweetFeatureset.tokenize_corpus(chunk, self.pos_filter):
+                    yield tokenized
+                chunk = []
+        for tokenized in TweetFeatureset.tokenize_corpus(chunk, self.pos_filter):
+            yield tokenized
+
+
+    def expand_tokens(self, tokens):
+        """
+        return the features of a document of tokens: the tokens and,
+        if enabled, their n-grams
+        """
+        if self.ngrams < 2:
+            return tokens
+
+        features = ngram_tokens(tokens, self.ngrams, self.hash_buckets)
+        if self.ngram_pruned:
+            idf_set = self.idf_set
+            features = [term for term in features
+                if not is_ngram(term) or term in idf_set]
+
+        return features
+
+
+    def build_token_corpus(self, tweets, vocab=None):
+        """
+        tokenize a tweet corpus into a compact TokenCorpus of token ids
+        """
+        token_corpus = TokenCorpus(vocab)
+        for tweet in self.iter_tokenized(tweets):
+            token_corpus.append(tweet["tokens"])
+
+        return token_corpus
+
+
+    @classmethod
+    def from_token_corpus(cls, token_corpus, pos_filter=False, ngrams=1,
+        min_df=2, hash_buckets=None):
+        """
+        create a featureset from an already tokenized corpus
+        (a TokenCorpus, a CorpusStore or a view of one)
+        """
+        featureset = cls.__new__(cls)
+        featureset.pos_filter = pos_filter
+        featureset.ngrams = ngrams
+        featureset.min_df = min_df
+        featureset.hash_buckets = hash_buckets
+        featureset.train_token_corpus(token_corpus)
+
+        return featureset
 
 
     def train(self, corpus):
         """
         use corpus to calculate idf scores
         """
-        corpus = TweetFeatureset.tokenize_corpus(corpus)
-        token_corpus = [tweet["tokens"] for tweet in corpus]
-        self.idf_set = idf_corpus(token_corpus)
+        self.train_token_corpus(self.build_token_corpus(corpus))
+
+
+    def train_token_corpus(self, token_corpus):
+        """
+        calculate idf scores from a corpus of token ids
+        """
+        self.ngram_pruned = False
+        if self.ngrams < 2:
+            #calculate idf scores on token ids, then key them by token again
+            self.idf_set = token_corpus.vocab.decode_keys(idf_corpus(token_corpus))
+            return
+
+        #count tokens and n-grams, generating the n-grams of one tweet at a time
+        vocab = token_corpus.vocab
+        df = document_frequencies(
+            self.expand_tokens(vocab.decode(token_ids))
+            for token_ids in token_corpus
+        )
+        if self.hash_buckets is None:
+            df.prune(self.min_df, is_ngram)
+            self.ngram_pruned = True
+        self.idf_set = df.idf()
+
+
+    def train_approximate(self, corpus, width=DEFAULT_WIDTH, depth=DEFAULT_DEPTH):
+        """
+        use corpus to calculate approximate idf scores in fixed memory
+        (see idf_sketch.py); more tweets can be added later with ingest
+        """
+        self.idf_set = SketchIdf(width, depth)
+        self.ngram_pruned = False
+        self.ingest(corpus)
+
+
+    def train_windowed(self, corpus, window=DEFAULT_WINDOW,
+        bucket_size=DEFAULT_BUCKET_SIZE):
+        """
+        use the tweets of corpus posted in the last window seconds
+        to calculate idf scores (see windowed_idf.py);
+        new tweets are added, and old ones expired, with ingest
+        """
+        self.idf_set = WindowedIdf(window, bucket_size)
+        self.ngram_pruned = False
+        self.ingest(corpus)
+
+
+    def ingest(self, tweets):
+        """
+        add tweets to an idf backend that supports incremental updates
+        """
+        for tweet in self.iter_tokenized(tweets):
+            self.idf_set.add_tweet(
+                dict(tweet, tokens=self.expand_tokens(tweet["tokens"])))
 
 
     def build_tagged_featureset(self, tweets, algorithm="BOOL"):
@@ -80,15 +285,27 @@ class TweetFeatureset(object):
         return tagged_features
 
 
+    def build_token_featureset(self, token_corpus, algorithm="BOOL"):
+        """
+        build a featureset from a corpus of token ids
+        """
+        documents = (self.expand_tokens(token_corpus.vocab.decode(token_ids))
+            for token_ids in token_corpus)
+
+        return tf_idf_corpus(documents, algorithm, self.idf_set)
+
+
     def build_featureset(self, tweets, algorithm="BOOL"):
         """
         build a featureset with no pairing to a tag
+        returns one feature dictionary per tweet, in the order of tweets;
+        tweets with no tokens left after preprocessing get an empty one
         """
-        #tokenize corpus
-        corpus = TweetFeatureset.tokenize_corpus(tweets)
+        tokenized = TweetFeatureset.tokenize_texts(
+            [tweet["text"] for tweet in tweets], self.pos_filter)
 
         #extract features from tweet corpus
-        token_corpus = [tweet["tokens"] for tweet in tweets]
+        token_corpus = [self.expand_tokens(tokens) for text, tokens in tokenized]
         feature_corpus = tf_idf_corpus(token_corpus, algorithm, self.idf_set)
 
         return feature_corpus
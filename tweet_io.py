@@ -0,0 +1,127 @@
+# tweet_io.py
+# stream tweets from corpus files without loading the whole file into memory
+
+# tweet files are either a single JSON array of tweets
+# (the format written by the original scraping scripts, e.g. rms_tweets.txt)
+# or JSON lines (one tweet object per line); JSON lines files can also be
+# read in byte ranges, so several processes can each parse part of a file
+
+import json
+
+
+READ_CHUNK_SIZE = 1 << 16
+
+
+def iter_json_array(f, chunk_size=READ_CHUNK_SIZE):
+    """
+    lazily yield the elements of a JSON array stored in a file object
+    only one chunk of the file plus the element being decoded is kept in memory
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    started = False
+    eof = False
+
+    while True:
+        #skip whitespace and element separators
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+
+        if not started and pos < len(buf):
+            if buf[pos] != "[":
+                raise ValueError("expected a JSON array")
+            started = True
+            pos += 1
+            continue
+
+        if started and pos < len(buf) and buf[pos] == "]":
+            return
+
+        if pos < len(buf):
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                #the element is cut off by the end of the buffer,
+                #so read more of the file and try again
+                if eof:
+                    raise
+                element = None
+                end = None
+
+            if end is not None and (end < len(buf) or eof):
+                yield element
+                pos = end
+                continue
+
+        if eof:
+            if started:
+                raise ValueError("unterminated JSON array")
+            return
+
+        #drop the consumed part of the buffer and read the next chunk
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+
+def iter_json_lines(f):
+    """
+    lazily yield one JSON object per non-blank line of a file object
+    """
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def iter_json_lines_range(f, start, end):
+    """
+    lazily yield the JSON objects of the non-blank lines of a file object
+    that start at a byte offset in [start, end); ranges that split a file
+    yield every line exactly once
+    """
+    if start > 0:
+        #skip the rest of a line that started before start
+        f.seek(start - 1)
+        f.readline()
+    else:
+        f.seek(0)
+
+    while f.tell() < end:
+        line = f.readline()
+        if not line:
+            break
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def is_json_array(f):
+    """
+    check if a tweet file object holds a JSON array rather than JSON lines
+    """
+    #peek at the first non-whitespace character to detect the format
+    first = ""
+    while True:
+        first = f.read(1)
+        if not first or not first.isspace():
+            break
+    f.seek(0)
+
+    return first == "["
+
+
+def iter_tweets(path):
+    """
+    lazily yield tweets from a JSON array or JSON lines file
+    """
+    with open(path, "r") as f:
+        if is_json_array(f):
+            for tweet in iter_json_array(f):
+                yield tweet
+        else:
+            for tweet in iter_json_lines(f):
+                yield tweet
@@ -3,14 +3,59 @@
 # to build a featureset for a classifier
 
 import re
+import zlib
 import string
-
-import nltk
-from nltk.tag import pos_tag
+import hashlib
+import threading
+from collections import OrderedDict
 
 from stopwords import stopwords
 from contractions import contractions
 
+#bump this whenever the output of cleanup_text or cleanup_tokens changes,
+#so that anything built from preprocessed tweets gets rebuilt
+PREPROCESS_VERSION = 1
+
+
+def preprocess_fingerprint(pos_filter=False):
+    """
+    return a hash identifying the preprocessing configuration:
+    the preprocessing version, the stopword and contraction lists,
+    and the optional stages that are enabled
+    """
+    config = hashlib.sha1()
+    config.update("version:%d\n" % PREPROCESS_VERSION)
+    config.update("stopwords:%s\n" % "|".join(sorted(stopwords)))
+    config.update("contractions:%s\n" % "|".join(
+        "%s=%s" % (contraction, expansion)
+        for contraction, expansion in contractions
+    ))
+    config.update("pos_filter:%s\n" % bool(pos_filter))
+    #the regular expressions and other literals of every stage,
+    #so that editing one changes the fingerprint even without a version bump
+    for stage in PREPROCESS_STAGES:
+        config.update("%s:%s\n" % (stage.__name__,
+            "|".join(code_constants(stage.__code__))))
+
+    return config.hexdigest()
+
+
+def code_constants(code):
+    """
+    return the literal constants (e.g. regular expressions) of a code object,
+    including those of the functions defined inside it
+    """
+    constants = []
+    #the first constant of a function is its docstring (or None)
+    for constant in code.co_consts[1:]:
+        if hasattr(constant, "co_consts"):
+            constants.extend(code_constants(constant))
+        else:
+            constants.append(repr(constant))
+
+    return constants
+
+
 #utility functions for cleaning up 
 #i.e., preprocessing tweet text before tokenization
 
@@ -113,6 +158,95 @@ def cleanup_text(text):
 
 #preprocess tokens
 
+#part of speech tags (Penn Treebank) that are probably relevant to the
+#political content of a tweet: nouns, verbs and adjectives
+RELEVANT_POS_PREFIXES = ("N", "V", "J")
+
+#max number of token -> tag decisions remembered by the POS cache
+POS_CACHE_SIZE = 100000
+
+#max number of tweets sent to the tagger in one call
+POS_BATCH_SIZE = 1000
+
+
+class PosTagCache(object):
+    """
+    PosTagCache class
+    bounded, thread-safe least-recently-used cache of token -> POS tag
+    """
+
+    def __init__(self, size=POS_CACHE_SIZE):
+        self.size = size
+        self.tags = OrderedDict()
+        self.lock = threading.Lock()
+
+
+    def get(self, token):
+        with self.lock:
+            tag = self.tags.pop(token, None)
+            if tag is not None:
+                #move the token to the most recently used end
+                self.tags[token] = tag
+            return tag
+
+
+    def set(self, token, tag):
+        with self.lock:
+            self.tags.pop(token, None)
+            self.tags[token] = tag
+            while len(self.tags) > self.size:
+                self.tags.popitem(last=False)
+
+
+    def __len__(self):
+        return len(self.tags)
+
+
+pos_tag_cache = PosTagCache()
+
+
+def batch_pos_tag_tokens(token_lists):
+    """
+    POS tag a batch of token lists with a single call to the NLTK tagger
+    """
+    #nltk is slow to import and only needed when the POS filter is used
+    import nltk.tag
+
+    if hasattr(nltk.tag, "pos_tag_sents"):
+        return nltk.tag.pos_tag_sents(token_lists)
+    elif hasattr(nltk.tag, "batch_pos_tag"):
+        return nltk.tag.batch_pos_tag(token_lists)
+    else:
+        return [nltk.tag.pos_tag(tokens) for tokens in token_lists]
+
+
+def tag_token_corpus(token_lists, cache=pos_tag_cache, batch_size=POS_BATCH_SIZE):
+    """
+    return a POS tag for every token of every token list
+
+    tags are memoized per token, so only token lists that contain
+    a token that hasn't been seen before are sent to the tagger;
+    those are tagged together, in batches, so their context is preserved
+    """
+    tags = [[cache.get(token) for token in tokens] for tokens in token_lists]
+
+    untagged = [i for i, token_tags in enumerate(tags) if None in token_tags]
+    for start in xrange(0, len(untagged), batch_size):
+        batch = untagged[start:start + batch_size]
+        tagged = batch_pos_tag_tokens([token_lists[i] for i in batch])
+        for i, pos_tokens in zip(batch, tagged):
+            for j, (token, tag) in enumerate(pos_tokens):
+                if tags[i][j] is None:
+                    tags[i][j] = tag
+                    cache.set(token, tag)
+
+    return tags
+
+
+def is_relevant_pos(tag):
+    return tag.startswith(RELEVANT_POS_PREFIXES)
+
+
 def remove_irrelevant_pos_tokens(tokens):
     """
     remove tokens of a certain part of speech that is probably irrelevant
@@ -121,12 +255,18 @@ def remove_irrelevant_pos_tokens(tokens):
     assume that only nouns, verbs, and adjectives are relevant;
     remove all other tokens
     """
-    pos_tokens = pos_tag(tokens)
+    return remove_irrelevant_pos_token_corpus([tokens])[0]
 
-    return [token for token, tag in pos_tokens
-        if token.startswith("N")
-        or token.startswith("V")
-        or token.startswith("J")
+
+def remove_irrelevant_pos_token_corpus(token_lists):
+    """
+    remove_irrelevant_pos_tokens for a list of token lists
+    """
+    tags = tag_token_corpus(token_lists)
+
+    return [
+        [token for token, tag in zip(tokens, token_tags) if is_relevant_pos(tag)]
+        for tokens, token_tags in zip(token_lists, tags)
     ]
 
 
@@ -166,12 +306,62 @@ def expand_contraction_tokens(tokens):
     return result_tokens
 
 
-def cleanup_tokens(tokens):
+#an n-gram feature is its tokens joined by a space;
+#tokens never contain one, since they come from the whitespace tokenizer
+NGRAM_SEPARATOR = " "
+
+
+def ngram_tokens(tokens, max_n=2, hash_buckets=None):
+    """
+    return the tokens followed by their n-grams for 2 <= n <= max_n
+    with hash_buckets, every n-gram is replaced by one of hash_buckets
+    "ngram <bucket>" features, so there are at most that many n-gram features
+    """
+    features = list(tokens)
+    for n in xrange(2, max_n + 1):
+        for i in xrange(len(tokens) - n + 1):
+            ngram = NGRAM_SEPARATOR.join(tokens[i:i + n])
+            if hash_buckets:
+                ngram = "ngram%s%d" % (NGRAM_SEPARATOR,
+                    (zlib.crc32(ngram) & 0xffffffff) % hash_buckets)
+            features.append(ngram)
+
+    return features
+
+
+def is_ngram(term):
+    return NGRAM_SEPARATOR in term
+
+
+def cleanup_tokens(tokens, pos_filter=False):
     """
     preprocess tokens before using them to build a featureset
+    if pos_filter is set, tokens that aren't nouns, verbs or adjectives
+    are removed as well
     """
-    tokens = expand_contraction_tokens(tokens)
-    tokens = remove_stopwords(tokens)
-    tokens = remove_short_tokens(tokens)
+    return cleanup_token_corpus([tokens], pos_filter)[0]
+
+
+def cleanup_token_corpus(token_lists, pos_filter=False):
+    """
+    cleanup_tokens for a list of token lists
+    POS tagging (if enabled) is done for the whole list at once
+    """
+    token_lists = [expand_contraction_tokens(tokens) for tokens in token_lists]
+    if pos_filter:
+        token_lists = remove_irrelevant_pos_token_corpus(token_lists)
+
+    return [
+        remove_short_tokens(remove_stopwords(tokens))
+        for tokens in token_lists
+    ]
+
 
-    return tokens
\ No newline at end of file
+#the stages of cleanup_text and cleanup_tokens (see preprocess_fingerprint)
+PREPROCESS_STAGES = [
+    normalize_whitespace, remove_punctuation, remove_possessives,
+    convert_to_lowercase, convert_hashtags, remove_retweets, remove_usernames,
+    remove_email, remove_links, convert_to_ascii,
+    expand_contraction_tokens, is_relevant_pos, remove_stopwords,
+    remove_short_tokens, cleanup_token_corpus
+]
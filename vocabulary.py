@@ -0,0 +1,177 @@
+# vocabulary.py
+# compact storage for tokenized corpora
+
+# tokens are interned to integer ids by a Vocabulary,
+# and the documents of a corpus are stored back to back in one array('I')
+# with an array of offsets marking where each document starts,
+# instead of one list of strings per document
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Vocabulary(object):
+    """
+    Vocabulary class
+    maps tokens to consecutive integer ids and back
+    """
+
+    def __init__(self, tokens=()):
+        self.ids = {}
+        self.tokens = []
+        for token in tokens:
+            self.intern(token)
+
+
+    def __len__(self):
+        return len(self.tokens)
+
+
+    def __contains__(self, token):
+        return token in self.ids
+
+
+    def intern(self, token):
+        """
+        return the id of a token, adding the token if it is new
+        """
+        token_id = self.ids.get(token)
+        if token_id is None:
+            token_id = len(self.tokens)
+            self.ids[token] = token_id
+            self.tokens.append(token)
+
+        return token_id
+
+
+    def lookup(self, token):
+        """
+        return the id of a token, or None if it isn't in the vocabulary
+        """
+        return self.ids.get(token)
+
+
+    def encode(self, tokens):
+        """
+        return a document of tokens as an array of ids
+        """
+        return array("I", [self.intern(token) for token in tokens])
+
+
+    def decode(self, token_ids):
+        """
+        return a document of ids as a list of tokens
+        """
+        return [self.tokens[token_id] for token_id in token_ids]
+
+
+    def decode_keys(self, scores):
+        """
+        return a copy of a dictionary keyed by id (e.g. an IdfDict)
+        that is keyed by token instead
+        """
+        decoded = copy_empty(scores)
+        for token_id, score in scores.iteritems():
+            decoded[self.tokens[token_id]] = score
+
+        return decoded
+
+
+def copy_empty(mapping):
+    """
+    return an empty dictionary of the same type (and attributes) as mapping
+    """
+    empty = mapping.__class__.__new__(mapping.__class__)
+    dict.__init__(empty)
+    empty.__dict__.update(getattr(mapping, "__dict__", {}))
+
+    return empty
+
+
+class TokenCorpus(object):
+    """
+    TokenCorpus class
+    a corpus of documents of token ids stored in two flat arrays
+
+    a TokenCorpus can be passed anywhere tf_idf expects a corpus:
+    it has a length and yields one array of ids per document
+    """
+
+    def __init__(self, vocab=None):
+        self.vocab = vocab if vocab is not None else Vocabulary()
+        self.token_ids = array("I")
+        #offsets[i] is where document i starts; offsets[-1] is the end
+        self.offsets = array("L", [0])
+
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("document index out of range")
+
+        return self.token_ids[self.offsets[i]:self.offsets[i + 1]]
+
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self.token_ids[self.offsets[i]:self.offsets[i + 1]]
+
+
+    def append(self, tokens):
+        """
+        add a document of tokens
+        """
+        self.append_ids(self.vocab.encode(tokens))
+
+
+    def append_ids(self, token_ids):
+        """
+        add a document of token ids
+        """
+        self.token_ids.extend(token_ids)
+        self.offsets.append(len(self.token_ids))
+
+
+    def extend(self, documents):
+        for tokens in documents:
+            self.append(tokens)
+
+
+    def documents(self):
+        """
+        yield every document as a list of tokens
+        """
+        for token_ids in self:
+            yield self.vocab.decode(token_ids)
+
+
+    def nbytes(self):
+        """
+        memory used by the token and offset arrays
+        """
+        return (len(self.token_ids) * self.token_ids.itemsize
+            + len(self.offsets) * self.offsets.itemsize)
+
+
+    def as_numpy(self):
+        """
+        return (token ids, offsets) as NumPy arrays sharing memory with the corpus
+        """
+        if numpy is None:
+            raise ImportError("as_numpy requires numpy")
+
+        token_ids = numpy.frombuffer(self.token_ids, dtype=numpy.uint32) \
+            if len(self.token_ids) else numpy.zeros(0, dtype=numpy.uint32)
+        offsets = numpy.frombuffer(self.offsets,
+            dtype=numpy.dtype("u%d" % self.offsets.itemsize))
+
+        return token_ids, offsets
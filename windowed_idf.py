@@ -0,0 +1,131 @@
+# windowed_idf.py
+# idf scores over a sliding time window of recent tweets
+
+# political current-event keywords are transient (see corrections.txt),
+# so idf scores computed once at training time go stale
+# WindowedIdf keeps document frequencies per time bucket (e.g. per hour)
+# plus a running total over all buckets in the window;
+# adding a tweet touches one bucket and the total,
+# and expiring a bucket subtracts only that bucket's counts from the total
+
+from __future__ import division
+import math
+import time
+import heapq
+import calendar
+
+from tf_idf import DfCounts
+
+
+#tweet ids are snowflake ids: milliseconds since this epoch, shifted left 22 bits
+TWITTER_EPOCH_MS = 1288834974657
+
+DEFAULT_WINDOW = 7 * 24 * 60 * 60
+DEFAULT_BUCKET_SIZE = 60 * 60
+
+
+def tweet_timestamp(tweet):
+    """
+    return the unix time a tweet was posted at
+    uses "created_at" if the tweet has it, otherwise the tweet id
+    """
+    created_at = tweet.get("created_at")
+    if isinstance(created_at, (int, long, float)):
+        return created_at
+    elif created_at:
+        #Twitter's format, e.g. "Wed Jun 26 17:40:32 +0000 2013"
+        return calendar.timegm(
+            time.strptime(created_at, "%a %b %d %H:%M:%S +0000 %Y"))
+    else:
+        return ((tweet["id"] >> 22) + TWITTER_EPOCH_MS) / 1000
+
+
+class WindowedIdf(object):
+    """
+    WindowedIdf class
+    drop-in replacement for tf_idf.IdfDict over the tweets of a time window
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, bucket_size=DEFAULT_BUCKET_SIZE):
+        self.bucket_size = bucket_size
+        self.num_buckets = max(1, int(math.ceil(window / bucket_size)))
+
+        #bucket number -> DfCounts of the tweets in that bucket
+        self.buckets = {}
+        #min-heap of bucket numbers, to find the oldest bucket
+        self.bucket_heap = []
+        #sum of the counts of all buckets
+        self.total = DfCounts()
+        self.latest = None
+
+
+    @property
+    def corpus_size(self):
+        return self.total.corpus_size
+
+
+    def add(self, document, timestamp):
+        """
+        count the terms of a document posted at timestamp
+        documents older than the window are ignored
+        """
+        bucket = int(timestamp // self.bucket_size)
+        if self.latest is not None and bucket <= self.latest - self.num_buckets:
+            return
+
+        counts = self.buckets.get(bucket)
+        if counts is None:
+            counts = self.buckets[bucket] = DfCounts()
+            heapq.heappush(self.bucket_heap, bucket)
+        counts.add(document)
+        self.total.add(document)
+
+        if self.latest is None or bucket > self.latest:
+            self.latest = bucket
+            self.expire()
+
+
+    def add_tweet(self, tweet):
+        self.add(tweet["tokens"], tweet_timestamp(tweet))
+
+
+    def advance(self, timestamp):
+        """
+        move the window forward to timestamp without adding a document,
+        e.g. when no tweets were posted for a while
+        """
+        bucket = int(timestamp // self.bucket_size)
+        if self.latest is None or bucket > self.latest:
+            self.latest = bucket
+            self.expire()
+
+
+    def expire(self):
+        """
+        drop the buckets that fell out of the window
+        """
+        total = self.total.counts
+        while self.bucket_heap \
+            and self.bucket_heap[0] <= self.latest - self.num_buckets:
+            counts = self.buckets.pop(heapq.heappop(self.bucket_heap))
+            for term, count in counts.counts.iteritems():
+                remaining = total[term] - count
+                if remaining:
+                    total[term] = remaining
+                else:
+                    del total[term]
+            self.total.corpus_size -= counts.corpus_size
+
+
+    def __contains__(self, term):
+        return term in self.total.counts
+
+
+    def __getitem__(self, term):
+        #same formula as tf_idf.idf(); terms that aren't in the window
+        #get log(corpus_size), like missing terms of an IdfDict
+        if self.total.corpus_size == 0:
+            return 0.0
+
+        return math.log(
+            self.total.corpus_size / (self.total.counts.get(term, 0)+1) )